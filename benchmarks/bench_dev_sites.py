@@ -0,0 +1,96 @@
+"""Compare find_dev_sites with iter_dev_sites for a large roster of users.
+
+Home directory lookups are served by a fake ``pwd`` backend with added latency
+to simulate LDAP/NIS, and homes are created in a temporary directory::
+
+    $ python benchmarks/bench_dev_sites.py --users 300 --latency 0.005
+
+"""
+
+import argparse
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sitetools import sites, utils
+
+
+_pwd_entry = collections.namedtuple('struct_passwd', 'pw_name pw_dir')
+
+
+class FakePwd(object):
+
+    def __init__(self, root, latency):
+        self.root = root
+        self.latency = latency
+        self.calls = 0
+
+    def getpwnam(self, name):
+        self.calls += 1
+        time.sleep(self.latency)
+        return _pwd_entry(name, os.path.join(self.root, name))
+
+    def getpwuid(self, uid):
+        return self.getpwnam('current')
+
+
+def build_homes(root, count):
+    users = []
+    for i in xrange(count):
+        user = 'user%03d' % i
+        users.append(user)
+        # Every third user has a dev directory, and every ninth a venv.
+        if not i % 3:
+            os.makedirs(os.path.join(root, user, 'dev'))
+        if not i % 9:
+            bin_path = os.path.join(root, user, 'dev', 'venv', 'bin')
+            os.makedirs(bin_path)
+            os.makedirs(os.path.join(root, user, 'dev', 'venv', sites.site_package_postfix))
+            open(os.path.join(bin_path, 'python'), 'w').close()
+    return users
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    original = utils.pwd
+    try:
+
+        users = build_homes(root, args.users)
+        patterns = ['~/dev/venv/bin/python', '~/dev']
+        utils.pwd = fake = FakePwd(root, args.latency)
+
+        start = time.time()
+        serial = sites.find_dev_sites(patterns, users)
+        serial_time = time.time() - start
+        serial_calls, fake.calls = fake.calls, 0
+
+        start = time.time()
+        bulk = list(sites.iter_dev_sites(patterns, users, threads=args.threads))
+        bulk_time = time.time() - start
+        bulk_calls = fake.calls
+
+        assert sorted(map(str, serial)) == sorted(str(site) for _, site in bulk)
+
+        print '%d users, %d sites found, %.1fms lookup latency' % (args.users, len(bulk), 1000 * args.latency)
+        print 'find_dev_sites: %7.1fms (%d lookups)' % (1000 * serial_time, serial_calls)
+        print 'iter_dev_sites: %7.1fms (%d lookups, %d threads)' % (1000 * bulk_time, bulk_calls, args.threads)
+
+    finally:
+        utils.pwd = original
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
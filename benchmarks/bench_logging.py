@@ -0,0 +1,117 @@
+"""Measure how many DEBUG records per second the root handlers can format.
+
+Compares, for a stderr-like handler and a file-like handler both writing to
+nowhere:
+
+- a :class:`~sitetools.logging.ContextInfoFilter` on each handler (as
+  ``_setup`` used to do);
+- a :class:`~sitetools.logging.ContextFormatter`;
+- a :class:`~sitetools.logging.JSONFormatter`;
+- a naive JSON formatter which calls :func:`json.dumps` for each record.
+
+::
+
+    $ python benchmarks/bench_logging.py --records 100000
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sitetools.logging import FULL_FORMAT, ContextFormatter, ContextInfoFilter, JSONFormatter, _get_context
+
+
+class NullStream(object):
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+class NaiveJSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        context = _get_context()
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'login': context['login'],
+            'ip': context['ip'],
+            'pid': record.process,
+        }
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+def filter_handlers(count):
+    handlers = []
+    for _ in xrange(count):
+        handler = logging.StreamHandler(NullStream())
+        handler.setFormatter(logging.Formatter(FULL_FORMAT))
+        handler.addFilter(ContextInfoFilter())
+        handlers.append(handler)
+    return handlers
+
+
+def formatter_handlers(count, formatter_class):
+    handlers = []
+    for _ in xrange(count):
+        handler = logging.StreamHandler(NullStream())
+        handler.setFormatter(formatter_class())
+        handlers.append(handler)
+    return handlers
+
+
+def bench(handlers, records, repeat):
+    """Return the best records-per-second over several runs."""
+
+    logger = logging.getLogger('sitetools.bench')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers[:] = handlers
+
+    best = 0
+    for _ in xrange(repeat):
+        start = time.time()
+        for i in xrange(records):
+            logger.debug('record %d of %d', i, records)
+        best = max(best, records / (time.time() - start))
+
+    logger.handlers[:] = []
+    return best
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--handlers', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    before = bench(filter_handlers(args.handlers), args.records, args.repeat)
+    print '%d records, %d handlers' % (args.records, args.handlers)
+    print 'ContextInfoFilter:  %9.0f records/s' % before
+
+    for name, formatter_class in (
+        ('ContextFormatter', ContextFormatter),
+        ('JSONFormatter', JSONFormatter),
+        ('naive json.dumps', NaiveJSONFormatter),
+    ):
+        rate = bench(formatter_handlers(args.handlers, formatter_class), args.records, args.repeat)
+        print '%-19s %9.0f records/s (%.2fx)' % (name + ':', rate, rate / before)
+
+
+if __name__ == '__main__':
+    main()
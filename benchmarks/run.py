@@ -0,0 +1,194 @@
+"""Benchmark the startup sequence against synthetic site trees.
+
+Builds a set of synthetic sites (see :mod:`sitetree`), optionally behind a
+slow filesystem shim (see :mod:`slowfs`), and measures:
+
+- ``add_site_list``: adding all of the sites to ``sys.path``;
+- ``site``: constructing a :class:`~sitetools.sites.Site` for each site;
+- ``startup``: importing ``sitetools._startup`` in a fresh subprocess, with
+  :envvar:`SITETOOLS_SITES` pointing at the sites.
+
+Results are summarized as percentiles and may be saved as JSON, and compared
+against a previously saved baseline::
+
+    $ python benchmarks/run.py --sites 20 --latency 0.001 --output baseline.json
+    $ python benchmarks/run.py --sites 20 --latency 0.001 --compare baseline.json
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root)
+
+from sitetools import sites
+from sitetree import build_sites
+from slowfs import SlowFS
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of the given values."""
+    values = sorted(values)
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(times, calls=None):
+    summary = {
+        'n': len(times),
+        'min': min(times),
+        'p50': percentile(times, 50),
+        'p90': percentile(times, 90),
+        'p99': percentile(times, 99),
+        'max': max(times),
+    }
+    if calls is not None:
+        summary['fs_calls'] = calls
+    return summary
+
+
+def _reset_sites(sys_path, processed_pths):
+    sys.path[:] = sys_path
+    sites._processed_pths.clear()
+    sites._processed_pths.update(processed_pths)
+    sites._prefixes.clear()
+
+
+def bench_add_site_list(site_dirs, repeat, latency, threads):
+    sys_path = list(sys.path)
+    processed_pths = set(sites._processed_pths)
+    times = []
+    try:
+        for _ in xrange(repeat):
+            _reset_sites(sys_path, processed_pths)
+            with SlowFS(latency) as fs:
+                start = time.time()
+                sites.add_site_list(site_dirs, threads=threads)
+                times.append(time.time() - start)
+    finally:
+        _reset_sites(sys_path, processed_pths)
+    return summarize(times, fs.calls)
+
+
+def bench_site(site_dirs, repeat, latency):
+    times = []
+    for _ in xrange(repeat):
+        sites._prefixes.clear()
+        with SlowFS(latency) as fs:
+            start = time.time()
+            for path in site_dirs:
+                sites.Site(path)
+            times.append(time.time() - start)
+    return summarize(times, fs.calls)
+
+
+def bench_startup(site_dirs, repeat, latency, env=None):
+    environ = dict(os.environ)
+    environ.update(env or {})
+    environ['SITETOOLS_SITES'] = ':'.join(site_dirs)
+    environ['SITETOOLS_BENCH_LATENCY'] = str(latency)
+    environ['PYTHONPATH'] = root
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'slowfs.py')
+    times = []
+    calls = None
+    for _ in xrange(repeat):
+        out = subprocess.check_output([sys.executable, script], env=environ)
+        elapsed, calls = out.split()
+        times.append(float(elapsed))
+    return summarize(times, int(calls))
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison of p50s, returning the names which regressed."""
+    regressed = []
+    for name, summary in sorted(results['benchmarks'].iteritems()):
+        base = baseline.get('benchmarks', {}).get(name)
+        if not base:
+            print '%-16s (no baseline)' % name
+            continue
+        ratio = summary['p50'] / base['p50'] if base['p50'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = ' REGRESSED'
+            regressed.append(name)
+        print '%-16s %9.3fms vs %9.3fms (%.2fx)%s' % (name, 1000 * summary['p50'], 1000 * base['p50'], ratio, flag)
+    return regressed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sites', type=int, default=10)
+    parser.add_argument('--packages', type=int, default=100)
+    parser.add_argument('--modules', type=int, default=50)
+    parser.add_argument('--pths', type=int, default=5)
+    parser.add_argument('--nested', type=int, default=10)
+    parser.add_argument('--platform-lines', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every filesystem call')
+    parser.add_argument('--threads', type=int, default=1, help='SITETOOLS_SCAN_THREADS for add_site_list')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--skip-startup', action='store_true')
+    parser.add_argument('-o', '--output', help='save results as JSON')
+    parser.add_argument('-c', '--compare', help='compare against a saved JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed p50 slowdown versus the baseline')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+
+        site_dirs = build_sites(tmp, args.sites,
+            packages=args.packages,
+            modules=args.modules,
+            pths=args.pths,
+            nested=args.nested,
+            platform_lines=args.platform_lines,
+        )
+
+        benchmarks = {}
+        benchmarks['add_site_list'] = bench_add_site_list(site_dirs, args.repeat, args.latency, args.threads)
+        benchmarks['site'] = bench_site(site_dirs, args.repeat, args.latency)
+        if not args.skip_startup:
+            benchmarks['startup'] = bench_startup(site_dirs, args.repeat, args.latency, {
+                'SITETOOLS_SCAN_THREADS': str(args.threads),
+            })
+
+    finally:
+        shutil.rmtree(tmp)
+
+    results = {
+        'params': dict(vars(args), output=None, compare=None),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'time': time.time(),
+        'benchmarks': benchmarks,
+    }
+
+    for name, summary in sorted(benchmarks.iteritems()):
+        print '%-16s p50 %9.3fms  p90 %9.3fms  p99 %9.3fms  (%d fs calls)' % (
+            name, 1000 * summary['p50'], 1000 * summary['p90'], 1000 * summary['p99'], summary['fs_calls'],
+        )
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        print
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Generate synthetic site trees for benchmarking."""
+
+import os
+
+from sitetools.platform import get_extended_platform_spec
+
+
+def build_site(root, packages=100, pths=10, nested=10, platform_lines=5, modules=0):
+    """Build a synthetic site directory.
+
+    :param str root: The site directory to create.
+    :param int packages: Top-level package directories (with ``__init__.py``).
+    :param int pths: Top-level ``*.pth`` files, each pointing at a package.
+    :param int nested: Packages with a ``__site__.pth`` adding their own
+        ``python`` directory.
+    :param int platform_lines: Of those nested packages, how many also have
+        an ``{extended_platform_spec}`` line (and matching directory).
+    :param int modules: Top-level plain modules.
+    :returns: The given root.
+
+    """
+
+    os.makedirs(root)
+
+    for i in xrange(packages):
+        path = os.path.join(root, 'package%04d' % i)
+        os.makedirs(path)
+        open(os.path.join(path, '__init__.py'), 'w').close()
+
+    for i in xrange(modules):
+        open(os.path.join(root, 'module%04d.py' % i), 'w').close()
+
+    for i in xrange(pths):
+        with open(os.path.join(root, 'extra%04d.pth' % i), 'w') as fh:
+            fh.write('# Synthetic.\npackage%04d\n' % (i % max(1, packages)))
+
+    for i in xrange(nested):
+        path = os.path.join(root, 'tool%04d' % i)
+        os.makedirs(os.path.join(path, 'python'))
+        lines = ['python']
+        if i < platform_lines:
+            lines.append('build/{extended_platform_spec}/lib')
+            os.makedirs(os.path.join(path, 'build', get_extended_platform_spec(), 'lib'))
+        with open(os.path.join(path, '__site__.pth'), 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+
+    return root
+
+
+def build_sites(root, count, **kwargs):
+    """Build ``count`` sites via :func:`build_site` within the given root.
+
+    :returns: The list of site directories.
+
+    """
+    return [build_site(os.path.join(root, 'site%03d' % i), **kwargs) for i in xrange(count)]
@@ -0,0 +1,60 @@
+"""A filesystem shim which adds latency to every stat, listdir, and open.
+
+This simulates a high-latency network filesystem on local disk via the same
+monkey-patching as :class:`sitetools.instrument.FSCounter` (so that the two
+never stack their patches). It may be installed in a subprocess with the
+``SITETOOLS_BENCH_LATENCY`` variable by running this file as a script, which
+installs it before importing any of sitetools (see :func:`main`).
+
+"""
+
+import imp
+import os
+import sys
+import time
+
+# Taken before anything of sitetools is imported, so that main() times all of
+# it when this is run as a script.
+_start = time.time()
+
+# Importing any part of the sitetools package imports sitetools.sites (and
+# much else), which we must not do before the shim is installed. The
+# instrument module needs nothing else from sitetools, so we load it directly.
+_instrument = imp.load_source('_slowfs_instrument', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sitetools', 'instrument.py'))
+FSCounter = _instrument.FSCounter
+
+
+class SlowFS(FSCounter):
+    """An :class:`~sitetools.instrument.FSCounter` which sleeps for
+    ``latency`` seconds before every call (and still counts them without)."""
+
+    def __init__(self, latency):
+        super(SlowFS, self).__init__(latency=latency)
+
+    @property
+    def calls(self):
+        return self.total
+
+
+def main():
+    """Time ``import sitetools._startup`` under the latency given by
+    ``SITETOOLS_BENCH_LATENCY``, printing the seconds taken (since this
+    script started) and the filesystem calls made.
+
+    Nothing of sitetools is imported until the shim is in place, except for
+    (a private copy of) :mod:`sitetools.instrument`, which makes no filesystem
+    calls of its own.
+
+    """
+    latency = float(os.environ.get('SITETOOLS_BENCH_LATENCY') or 0)
+    fs = SlowFS(latency)
+    fs.install()
+    import sitetools._startup
+    elapsed = time.time() - _start
+    fs.uninstall()
+    sys.stdout.write('%r %d\n' % (elapsed, fs.calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,11 @@ setup(
     url='http://github.com/westernx/sitetools',
     
     packages=['sitetools'],
+
+    install_requires=[
+        # So that sites are scanned without probing every entry.
+        'scandir; python_version < "3.5"',
+    ],
     
     entry_points={
         'sitehooks': {
@@ -1,8 +1,23 @@
 import traceback
 import warnings
 
+# Startup carries on without its instrumentation if need be.
+try:
+    from . import instrument
+except Exception, e:
+    warnings.warn('Error while importing sitetools.instrument\n%s' % traceback.format_exc())
+    instrument = None
+
 
 def import_and_call(mod_name, func_name, *args, **kwargs):
+    if instrument is None:
+        _import_and_call(mod_name, func_name, *args, **kwargs)
+        return
+    with instrument.span('%s.%s' % (mod_name, func_name), 'startup'):
+        _import_and_call(mod_name, func_name, *args, **kwargs)
+
+
+def _import_and_call(mod_name, func_name, *args, **kwargs):
 
     try:
         mod = __import__(mod_name, fromlist=['.'])
@@ -23,11 +38,15 @@ def import_and_call(mod_name, func_name, *args, **kwargs):
 
 # We don't need to guard against this only running once since it is a module
 # and should only eval once.
+if instrument is not None:
+    _import_and_call('sitetools.instrument', '_setup')
 import_and_call('sitetools.logging', '_setup')
 import_and_call('sitetools.logging', '_setup_maya')
 import_and_call('sitetools.sites', '_setup')
 import_and_call('sitetools.monkeypatch', '_setup')
 import_and_call('sitetools.environ', '_setup')
+if instrument is not None:
+    _import_and_call('sitetools.instrument', '_teardown')
 
 # Something for sitehooks to latch onto.
 sitehook = lambda: None
@@ -0,0 +1,313 @@
+"""
+
+A site with thousands of small files on a network filesystem costs a metadata
+lookup for each one on every cold import. A bundle packs an entire site into a
+single zip archive (with precompiled bytecode), which Python can import from
+via :mod:`python:zipimport` at the cost of a single open and read.
+
+A bundle for a site at ``/path/to/site`` lives next to it at
+``/path/to/site.sitebundle.zip``, and contains:
+
+- every file from the site (other than dotfiles and bytecode);
+- freshly compiled bytecode for every ``*.py``;
+- ``__sitebundle__.json``, with the bundle format, an arbitrary version label,
+  the modification times of the site and of every top-level directory within
+  it when packed, and the contents of every ``*.pth`` and ``__site__.pth``
+  within the site.
+
+When :envvar:`SITETOOLS_BUNDLES` is set, :func:`sitetools.sites.add_site_dir`
+prefers a bundle over the loose directory when the bundle exists, is of a
+supported format, and the loose directory has not been modified since the
+bundle was packed. That is the only check made at startup, so that a bundle
+costs a single stat on top of its open and read.
+
+Changing anything within a package does not modify the site directory, so the
+bundle must be repacked after every such change, or it will keep shadowing the
+loose files. Deployments should check for this with::
+
+    $ python -m sitetools.bundles verify /path/to/site
+
+which compares every top-level directory (i.e. package) of the site against
+the modification times recorded when it was packed, and exits with a non-zero
+status if any are newer. Writing to a module in place, or changing anything
+within a nested sub-package, is still not noticed.
+
+The :class:`~sitetools.importindex.IndexedFinder` is given the listing of each
+bundle (and of every directory within it added by a ``*.pth``), so bundles do
+not stop it from indexing the rest of ``sys.path``.
+
+Sites containing extension modules cannot be bundled, since they cannot be
+imported from a zip archive.
+
+To pack a site::
+
+    $ python -m sitetools.bundles pack /path/to/site --version v1.2.3
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_BUNDLES
+
+    Set to ``"1"`` to use bundles. They are ignored by default, since looking
+    for one costs an extra (failed) open for every site in every process.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import imp
+import json
+import logging
+import marshal
+import os
+import struct
+import sys
+import time
+
+from sitetools.utils import encode_strings
+
+log = logging.getLogger(__name__)
+
+
+#: The format of bundles written by this version of sitetools.
+FORMAT = 1
+
+#: Appended to the path of a site to find its bundle.
+SUFFIX = '.sitebundle.zip'
+
+#: The name of the metadata within a bundle.
+METADATA_NAME = '__sitebundle__.json'
+
+_extension_suffixes = tuple(s for s, _, t in imp.get_suffixes() if t == imp.C_EXTENSION)
+
+
+def is_enabled():
+    return os.environ.get('SITETOOLS_BUNDLES', '0') != '0'
+
+
+def get_bundle_path(site_path):
+    """Get the path of the bundle for the given site directory."""
+    return os.path.abspath(site_path).rstrip(os.sep) + SUFFIX
+
+
+def _iter_site_files(site_path):
+    """Yield the relative paths of every file to include in a bundle."""
+    for dir_path, dir_names, file_names in os.walk(site_path, followlinks=True):
+        dir_names[:] = sorted(x for x in dir_names if not x.startswith('.') and x != '__pycache__')
+        for file_name in sorted(file_names):
+            if file_name.startswith('.') or file_name.endswith(('.pyc', '.pyo')):
+                continue
+            yield os.path.relpath(os.path.join(dir_path, file_name), site_path)
+
+
+def _compile(source, filename, mtime):
+    """Compile source into the contents of a ``.pyc`` file."""
+    code = compile(source.replace('\r\n', '\n'), filename, 'exec')
+    return imp.get_magic() + struct.pack('<I', mtime & 0xFFFFFFFF) + marshal.dumps(code)
+
+
+def _read_pths(site_path):
+    """Read every ``*.pth`` in a site, in the order :mod:`sitetools.sites`
+    would process them."""
+
+    from sitetools.sites import ScanStats, _iter_dir
+
+    pths = []
+    for name, is_dir in _iter_dir(site_path, ScanStats()):
+        if name.startswith('.'):
+            continue
+        candidates = []
+        if name.endswith('.pth') and not is_dir:
+            candidates.append(('', name))
+        if is_dir is not False:
+            candidates.append((name, '__site__.pth'))
+        for base, file_name in candidates:
+            path = os.path.join(site_path, base, file_name)
+            try:
+                with open(path) as fh:
+                    lines = fh.read().splitlines()
+            except IOError:
+                continue
+            pths.append({'base': base, 'file_name': file_name, 'lines': lines})
+    return pths
+
+
+def pack(site_path, output=None, version=None):
+    """Pack a site directory into a bundle.
+
+    :param str site_path: The site to pack.
+    :param str output: Where to write the bundle; defaults to
+        :func:`get_bundle_path`.
+    :param str version: An arbitrary label to record in the bundle.
+    :returns: The path to the bundle.
+    :raises ValueError: if the site contains extension modules.
+
+    The bundle is written to a temporary file and renamed into place, so that
+    running processes never see a partial bundle.
+
+    """
+
+    import tempfile
+    import zipfile
+
+    site_path = os.path.abspath(site_path)
+    output = output or get_bundle_path(site_path)
+
+    # Take these before reading anything, so that any changes made while
+    # packing will make the bundle appear stale.
+    source_mtime = os.stat(site_path).st_mtime
+    dir_mtimes = {}
+    for name in os.listdir(site_path):
+        path = os.path.join(site_path, name)
+        if not name.startswith('.') and os.path.isdir(path):
+            dir_mtimes[name] = os.stat(path).st_mtime
+
+    files = list(_iter_site_files(site_path))
+    extensions = [x for x in files if x.endswith(_extension_suffixes)]
+    if extensions:
+        raise ValueError('cannot bundle extension modules: %s' % ', '.join(extensions))
+
+    metadata = {
+        'format': FORMAT,
+        'version': version,
+        'source': site_path,
+        'source_mtime': source_mtime,
+        'dir_mtimes': dir_mtimes,
+        'python': '%d.%d' % sys.version_info[:2],
+        'magic': imp.get_magic().encode('hex'),
+        'packed': time.time(),
+        'pths': _read_pths(site_path),
+    }
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(output), dir=os.path.dirname(output))
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            with zipfile.ZipFile(fh, 'w', zipfile.ZIP_DEFLATED) as zf:
+
+                for rel_path in files:
+                    abs_path = os.path.join(site_path, rel_path)
+                    arc_name = rel_path.replace(os.sep, '/')
+                    with open(abs_path, 'rb') as src:
+                        content = src.read()
+
+                    # zipimport compares the bytecode's mtime to the DOS time
+                    # of the source within the archive, so they must agree.
+                    date_time = time.localtime(os.stat(abs_path).st_mtime)[:6]
+                    info = zipfile.ZipInfo(arc_name, date_time)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.external_attr = 0o644 << 16
+                    zf.writestr(info, content)
+
+                    if arc_name.endswith('.py'):
+                        try:
+                            pyc = _compile(content, abs_path, int(time.mktime(date_time + (0, 0, -1))))
+                        except SyntaxError as e:
+                            log.warning('could not compile %s: %s', abs_path, e)
+                        else:
+                            info = zipfile.ZipInfo(arc_name + 'c', date_time)
+                            info.compress_type = zipfile.ZIP_DEFLATED
+                            info.external_attr = 0o644 << 16
+                            zf.writestr(info, pyc)
+
+                zf.writestr(METADATA_NAME, json.dumps(metadata, indent=4, sort_keys=True))
+
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, output)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+    return output
+
+
+def read_metadata(bundle):
+    """Read the metadata and file names from a bundle.
+
+    :param bundle: The path to a bundle, or an open file object.
+    :returns: ``(metadata, names)``.
+
+    """
+    import zipfile
+    with zipfile.ZipFile(bundle) as zf:
+        return encode_strings(json.loads(zf.read(METADATA_NAME))), encode_strings(zf.namelist())
+
+
+def find_stale(site_path, bundle=None):
+    """Find the directories of a site which have changed since it was bundled.
+
+    :param str site_path: The site to check.
+    :param str bundle: The bundle to check against; defaults to
+        :func:`get_bundle_path`.
+    :returns: A list of paths modified since the bundle was packed; the site
+        itself and its top-level directories are checked.
+
+    This stats every top-level directory, so it is for build and deployment
+    tools rather than startup (which only checks the site itself).
+
+    """
+
+    site_path = os.path.abspath(site_path)
+    metadata, _ = read_metadata(bundle or get_bundle_path(site_path))
+
+    checks = [(site_path, metadata['source_mtime'])]
+    for name, packed_mtime in sorted(metadata.get('dir_mtimes', {}).iteritems()):
+        checks.append((os.path.join(site_path, name), packed_mtime))
+
+    stale = []
+    for path, packed_mtime in checks:
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        if mtime > packed_mtime:
+            stale.append(path)
+    return stale
+
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m sitetools.bundles')
+    commands = parser.add_subparsers(dest='command')
+
+    pack_parser = commands.add_parser('pack', help='pack a site into a bundle')
+    pack_parser.add_argument('-o', '--output')
+    pack_parser.add_argument('--version', help='a version label to record in the bundle')
+    pack_parser.add_argument('site')
+
+    info_parser = commands.add_parser('info', help='describe a bundle')
+    info_parser.add_argument('bundle')
+
+    verify_parser = commands.add_parser('verify', help='check that a site has not changed since it was bundled')
+    verify_parser.add_argument('-b', '--bundle')
+    verify_parser.add_argument('site')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        try:
+            print pack(args.site, args.output, args.version)
+        except ValueError as e:
+            parser.error(str(e))
+
+    elif args.command == 'verify':
+        stale = find_stale(args.site, args.bundle)
+        for path in stale:
+            print 'modified since bundled:', path
+        if stale:
+            sys.exit(1)
+
+    else:
+        metadata, names = read_metadata(args.bundle)
+        metadata['files'] = len(names)
+        print json.dumps(metadata, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,533 @@
+"""
+
+Sites are often mounted read-only, in which case Python cannot write ``*.pyc``
+files next to their sources, and so must recompile every module on every
+start. This module keeps the bytecode for modules within the sites in a cache
+on local disk instead.
+
+A :data:`python:sys.meta_path` finder (which works alongside the
+:class:`~sitetools.importindex.IndexedFinder`) loads every module whose
+source lies within a site via the cache. Entries are keyed by the source's
+path, modification time, and size, so they never need to be invalidated;
+instead, the least recently used entries are evicted once the cache grows
+beyond :envvar:`SITETOOLS_BYTECODE_CACHE_SIZE`.
+
+The cache may be warmed ahead of time (e.g. when deploying) with::
+
+    $ python -m sitetools.bytecode warm --processes 8 /path/to/site ...
+
+which defaults to the sites in :envvar:`SITETOOLS_SITES`.
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_BYTECODE_CACHE
+
+    Set to ``"1"`` to load bytecode for modules within sites from a cache
+    within :envvar:`SITETOOLS_CACHE_DIR`.
+
+.. envvar:: SITETOOLS_BYTECODE_CACHE_SIZE
+
+    The size (in MB) beyond which the least recently used bytecode is evicted;
+    defaults to 512.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import imp
+import logging
+import marshal
+import os
+import struct
+import sys
+import time
+
+from sitetools import cache
+
+log = logging.getLogger(__name__)
+
+
+_magic = imp.get_magic()
+
+
+class BytecodeCache(object):
+    """A directory of bytecode, keyed by source path, modification time, and size.
+
+    :param str root: The directory to keep bytecode in.
+    :param int max_size: The size (in bytes) beyond which to evict entries.
+
+    """
+
+    #: How often (in seconds) to check the size of the cache after writing.
+    evict_interval = 3600
+
+    #: Entries are touched when they are used if they are older than this.
+    touch_interval = 86400
+
+    def __init__(self, root, max_size=512 << 20):
+        self.root = root
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get_path(self, source_path, st):
+        key = hashlib.sha1('%s\0%r\0%d' % (source_path, st.st_mtime, st.st_size)).hexdigest()
+        return os.path.join(self.root, key[:2], key[2:] + '.pyc')
+
+    def get(self, source_path, st):
+        """Get the code for the given source and stat result, or ``None``."""
+
+        path = self.get_path(source_path, st)
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+                # Keep the modification time roughly up to date, for eviction.
+                if os.fstat(fh.fileno()).st_mtime < time.time() - self.touch_interval:
+                    os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return
+
+        if data[:4] != _magic:
+            self.misses += 1
+            return
+        try:
+            code = marshal.loads(data[8:])
+        except (EOFError, ValueError, TypeError) as e:
+            log.log(5, 'corrupt bytecode %s: %r', path, e)
+            self.misses += 1
+            return
+
+        self.hits += 1
+        return code
+
+    def put(self, source_path, st, code):
+        """Store the code for the given source and stat result.
+
+        The bytecode is written to a temporary file and renamed into place, so
+        that concurrent readers never see a partial file.
+
+        """
+
+        if sys.dont_write_bytecode:
+            return
+
+        path = self.get_path(source_path, st)
+        dir_path = os.path.dirname(path)
+        data = _magic + struct.pack('<I', int(st.st_mtime) & 0xFFFFFFFF) + marshal.dumps(code)
+
+        import tempfile
+
+        try:
+            try:
+                os.makedirs(dir_path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            fd, tmp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=dir_path)
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    fh.write(data)
+                os.chmod(tmp_path, 0o644)
+                os.rename(tmp_path, path)
+            except:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as e:
+            log.log(5, 'could not write bytecode %s: %r', path, e)
+            return
+
+        self._maybe_evict()
+
+    def _maybe_evict(self):
+        marker = os.path.join(self.root, '.evicted')
+        try:
+            if os.stat(marker).st_mtime > time.time() - self.evict_interval:
+                return
+        except OSError:
+            pass
+        try:
+            open(marker, 'w').close()
+        except (IOError, OSError):
+            return
+        self.evict()
+
+    def evict(self, max_size=None):
+        """Remove the least recently used entries until the cache is at most
+        80% of its maximum size.
+
+        :returns: The number of entries removed.
+
+        """
+
+        max_size = self.max_size if max_size is None else max_size
+
+        entries = []
+        total = 0
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if not file_name.endswith('.pyc'):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        if total <= max_size:
+            return 0
+
+        removed = 0
+        target = 0.8 * max_size
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        log.info('evicted %d entries from bytecode cache %s', removed, self.root)
+        return removed
+
+
+def compile_source(cache, path, fh=None):
+    """Get the code for the given source file, via the given cache.
+
+    :param BytecodeCache cache: The cache to use.
+    :param str path: The source file.
+    :param file fh: The source file, if it is already open.
+
+    """
+
+    own_fh = fh is None
+    if own_fh:
+        fh = open(path, 'rb')
+    try:
+        st = os.fstat(fh.fileno())
+        code = cache.get(path, st)
+        if code is None:
+            source = fh.read()
+            code = compile(source, path, 'exec', 0, True)
+            cache.put(path, st, code)
+        return code
+    finally:
+        if own_fh:
+            fh.close()
+
+
+_cache = None
+_finder = None
+_prefixes = ()
+
+
+def add_root(path):
+    """Cache bytecode for modules within the given directory."""
+    global _prefixes
+    prefix = os.path.abspath(path).rstrip(os.sep) + os.sep
+    if prefix not in _prefixes:
+        _prefixes += (prefix, )
+
+
+def is_cached(path):
+    """Would bytecode for the given source be cached?"""
+    return _cache is not None and path.startswith(_prefixes)
+
+
+def _exec_module(fullname, code, attrs):
+    existing = sys.modules.get(fullname)
+    module = existing or imp.new_module(fullname)
+    module.__dict__.update(attrs)
+    sys.modules[fullname] = module
+    try:
+        exec code in module.__dict__
+    except:
+        if existing is None:
+            sys.modules.pop(fullname, None)
+        raise
+    return sys.modules[fullname]
+
+
+def load_module(fullname, found):
+    """Load a module as found by :func:`python:imp.find_module`, via the
+    bytecode cache if the module is within a site.
+
+    This is a drop-in replacement for :func:`python:imp.load_module`, except
+    that it closes the file.
+
+    """
+
+    fh, path, description = found
+    kind = description[2]
+
+    try:
+
+        if kind == imp.PY_SOURCE and is_cached(path):
+            code = compile_source(_cache, path, fh)
+            return _exec_module(fullname, code, {'__file__': path})
+
+        if kind == imp.PKG_DIRECTORY and is_cached(path):
+            init_path = os.path.join(path, '__init__.py')
+            try:
+                code = compile_source(_cache, init_path)
+            except IOError:
+                # Perhaps it only has bytecode, or is an extension.
+                pass
+            else:
+                return _exec_module(fullname, code, {
+                    '__file__': init_path,
+                    '__path__': [path],
+                    '__package__': fullname,
+                })
+
+        return imp.load_module(fullname, fh, path, description)
+
+    finally:
+        if fh is not None:
+            fh.close()
+
+
+class _Loader(object):
+
+    def __init__(self, found):
+        self.found = found
+
+    def load_module(self, fullname):
+        return load_module(fullname, self.found)
+
+
+class CachedBytecodeFinder(object):
+    """A :data:`python:sys.meta_path` finder which loads modules (and
+    packages) within sites via :func:`load_module`.
+
+    It searches ``sys.path`` (or a package's ``__path__``) just as the normal
+    machinery would, but only through entries within a site (see
+    :func:`add_root`) which the normal machinery would search as plain
+    directories (i.e. for which no :data:`python:sys.path_hooks` provide an
+    importer). It stops (and lets the normal machinery take over) at the first
+    entry which is anything else, so the standard library (for example) is
+    left alone.
+
+    """
+
+    def __init__(self):
+        from sitetools.importindex import _get_importer
+        self._get_importer = _get_importer
+        self._in_sites = {}
+        self._in_sites_prefixes = _prefixes
+
+    def _is_site_dir(self, entry):
+        # Forget everything whenever another site is added.
+        if self._in_sites_prefixes is not _prefixes:
+            self._in_sites.clear()
+            self._in_sites_prefixes = _prefixes
+        try:
+            return self._in_sites[entry]
+        except KeyError:
+            pass
+        res = self._in_sites[entry] = (os.path.abspath(entry) + os.sep).startswith(_prefixes)
+        return res
+
+    def find_module(self, fullname, path=None):
+
+        if path is None and (imp.is_builtin(fullname) or imp.is_frozen(fullname)):
+            return
+
+        name = fullname.rpartition('.')[2]
+        for entry in (sys.path if path is None else path):
+
+            if not isinstance(entry, basestring):
+                return
+
+            # A NullImporter means the normal machinery skips the entry, and
+            # anything else means it has its own importer.
+            importer = self._get_importer(entry)
+            if isinstance(importer, imp.NullImporter):
+                continue
+            if importer is not None or not self._is_site_dir(entry):
+                return
+
+            try:
+                found = imp.find_module(name, [entry])
+            except ImportError:
+                continue
+            return _Loader(found)
+
+
+def get_installed():
+    """Get the installed :class:`BytecodeCache`, or ``None``."""
+    return _cache
+
+
+def install(root=None, max_size=None):
+    """Start loading modules within sites via a :class:`BytecodeCache`.
+
+    :param str root: The cache directory; defaults to one within
+        :envvar:`SITETOOLS_CACHE_DIR`.
+    :param int max_size: Defaults to :envvar:`SITETOOLS_BYTECODE_CACHE_SIZE`.
+    :returns: The :class:`BytecodeCache`, or ``None`` if there is no cache
+        directory.
+
+    The finder is installed after the
+    :class:`~sitetools.importindex.IndexedFinder` (if there is one), which
+    loads top-level modules via the cache itself.
+
+    """
+
+    global _cache, _finder
+
+    if _cache is not None:
+        return _cache
+
+    root = root or cache.get_cache_path('bytecode-%s' % _magic.encode('hex'))
+    if not root:
+        log.warning('SITETOOLS_BYTECODE_CACHE requires SITETOOLS_CACHE_DIR')
+        return
+
+    if max_size is None:
+        try:
+            max_size = int(float(os.environ.get('SITETOOLS_BYTECODE_CACHE_SIZE') or 512) * (1 << 20))
+        except ValueError:
+            log.warning('SITETOOLS_BYTECODE_CACHE_SIZE must be a number; got %r', os.environ['SITETOOLS_BYTECODE_CACHE_SIZE'])
+            max_size = 512 << 20
+
+    _cache = BytecodeCache(root, max_size)
+    _finder = CachedBytecodeFinder()
+
+    from sitetools import importindex
+    index = importindex.get_installed()
+    position = sys.meta_path.index(index) + 1 if index in sys.meta_path else 0
+    sys.meta_path.insert(position, _finder)
+
+    return _cache
+
+
+def uninstall():
+    """Stop loading modules via the bytecode cache."""
+    global _cache, _finder
+    if _finder is not None:
+        try:
+            sys.meta_path.remove(_finder)
+        except ValueError:
+            pass
+    _cache = _finder = None
+
+
+def _iter_sources(dir_path):
+    for dir_path, dir_names, file_names in os.walk(dir_path, followlinks=True):
+        dir_names[:] = [x for x in dir_names if not x.startswith('.')]
+        for file_name in file_names:
+            if file_name.endswith('.py') and not file_name.startswith('.'):
+                yield os.path.join(dir_path, file_name)
+
+
+_worker_cache = None
+
+
+def _warm_init(root, max_size):
+    global _worker_cache
+    _worker_cache = BytecodeCache(root, max_size)
+    # Warming is an explicit request to write.
+    sys.dont_write_bytecode = False
+
+
+def _warm_one(path):
+    hits = _worker_cache.hits
+    try:
+        compile_source(_worker_cache, path)
+    except (IOError, OSError, SyntaxError, TypeError, ValueError) as e:
+        return path, e
+    return path, _worker_cache.hits > hits
+
+
+def warm(site_paths, processes=None, root=None, max_size=None):
+    """Compile every module within the given sites into the bytecode cache.
+
+    :param list site_paths: Sites (as in :envvar:`SITETOOLS_SITES`) to warm.
+    :param int processes: The size of the process pool; defaults to the
+        number of CPUs.
+    :returns: ``(compiled, cached, errors)``, where ``errors`` is a list of
+        ``(path, exception)``.
+
+    """
+
+    import multiprocessing
+
+    from sitetools.sites import Site
+
+    root = root or cache.get_cache_path('bytecode-%s' % _magic.encode('hex'))
+    if not root:
+        raise ValueError('no bytecode cache directory; set SITETOOLS_CACHE_DIR')
+    if max_size is None:
+        max_size = int(float(os.environ.get('SITETOOLS_BYTECODE_CACHE_SIZE') or 512) * (1 << 20))
+
+    paths = []
+    for site_path in site_paths:
+        try:
+            site = Site(site_path)
+        except ValueError as e:
+            log.warning('skipping invalid site %s: %s', site_path, e)
+            continue
+        paths.extend(_iter_sources(site.python_path))
+
+    compiled = cached = 0
+    errors = []
+
+    pool = multiprocessing.Pool(processes, _warm_init, (root, max_size))
+    try:
+        for path, res in pool.imap_unordered(_warm_one, paths, chunksize=64):
+            if isinstance(res, Exception):
+                errors.append((path, res))
+            elif res:
+                cached += 1
+            else:
+                compiled += 1
+    finally:
+        pool.close()
+        pool.join()
+
+    BytecodeCache(root, max_size).evict()
+
+    return compiled, cached, errors
+
+
+def main(argv=None):
+
+    import argparse
+
+    from sitetools.utils import get_environ_list
+
+    parser = argparse.ArgumentParser(prog='python -m sitetools.bytecode')
+    commands = parser.add_subparsers(dest='command')
+
+    warm_parser = commands.add_parser('warm', help='compile sites into the bytecode cache')
+    warm_parser.add_argument('-j', '--processes', type=int)
+    warm_parser.add_argument('-d', '--cache-dir', help='defaults to one within SITETOOLS_CACHE_DIR')
+    warm_parser.add_argument('sites', nargs='*', help='defaults to SITETOOLS_SITES')
+
+    args = parser.parse_args(argv)
+
+    try:
+        compiled, cached, errors = warm(args.sites or get_environ_list('SITETOOLS_SITES'), args.processes, args.cache_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    for path, e in errors:
+        print >> sys.stderr, '%s: %s' % (path, e)
+    print '%d compiled, %d already cached, %d errors' % (compiled, cached, len(errors))
+
+
+if __name__ == '__main__':
+    main()
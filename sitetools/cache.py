@@ -0,0 +1,119 @@
+"""
+
+Several parts of the startup sequence are expensive to compute, but rarely
+change between processes on the same host. This module provides a tiny on-disk
+store for such results, so that they may be reused by the next interpreter.
+
+Everything stored here must be safe to throw away at any time; a missing,
+corrupt, or unwritable cache simply results in the work being done again.
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_CACHE_DIR
+
+    A directory in which to store startup caches. This should be on local disk
+    (e.g. ``/var/tmp/sitetools``) since the whole point is to avoid the network.
+
+    If unset, no caches are read or written.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import errno
+import json
+import logging
+import os
+import tempfile
+
+from sitetools.utils import encode_strings
+
+log = logging.getLogger(__name__)
+
+
+def get_cache_dir(create=False):
+    """Get the directory for startup caches, or ``None`` if caching is disabled.
+
+    :param bool create: Create the directory if it does not exist.
+
+    """
+
+    path = os.environ.get('SITETOOLS_CACHE_DIR')
+    if not path:
+        return
+
+    path = os.path.abspath(os.path.expanduser(path))
+    if create:
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                log.log(5, 'could not create cache directory %s: %r', path, e)
+                return
+    return path
+
+
+def get_cache_path(name, create=False):
+    """Get the full path to a named cache file, or ``None`` if caching is disabled."""
+    dir_path = get_cache_dir(create=create)
+    if dir_path:
+        return os.path.join(dir_path, name)
+
+
+def read_json(name):
+    """Read a named JSON cache, returning ``None`` if it is missing or corrupt."""
+
+    path = get_cache_path(name)
+    if not path:
+        return
+
+    try:
+        with open(path) as fh:
+            return encode_strings(json.load(fh))
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            log.log(5, 'could not read cache %s: %r', path, e)
+    except ValueError as e:
+        log.log(5, 'corrupt cache %s: %r', path, e)
+
+
+def write_json(name, data):
+    """Atomically write a named JSON cache.
+
+    The data is written to a temporary file in the same directory and then
+    renamed into place, so that readers never see a partial file.
+
+    :returns: The path that was written to, or ``None`` if it was not written.
+
+    """
+
+    path = get_cache_path(name, create=True)
+    if not path:
+        return
+
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % name, dir=os.path.dirname(path))
+    except OSError as e:
+        log.log(5, 'could not write cache %s: %r', path, e)
+        return
+
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(data, fh, sort_keys=True)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        log.log(5, 'could not write cache %s: %r', path, e)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        return
+
+    return path
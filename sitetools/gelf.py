@@ -0,0 +1,354 @@
+"""
+
+A handler which sends records to Graylog as `GELF
+<https://go2docs.graylog.org/current/getting_in_log_data/gelf.html>`_ over UDP,
+as set up by :mod:`sitetools.logging` when :envvar:`GRAYLOG` is set.
+
+Every message is compressed with zlib, and messages which still do not fit
+within a single datagram are split into GELF chunks (of which Graylog accepts
+at most 128 per message) rather than being silently lost by the network. This
+matters most for errors, which carry the Python stack (see
+:envvar:`SITETOOLS_LOG_STACK_SAMPLE`).
+
+Messages are sent from a background thread, so logging never waits for DNS or
+the network. That thread sends whenever :attr:`GELFHandler.batch_size`
+messages are waiting, or once the oldest has waited for
+:attr:`GELFHandler.flush_interval` seconds, whichever is first. Everything
+still waiting is sent at exit.
+
+The number of messages sent, chunked, and dropped (because the queue was full,
+they needed too many chunks, or the network refused them) are counted on the
+handler.
+
+
+Environment Variables
+---------------------
+
+.. envvar:: GRAYLOG
+
+    The ``host:port`` of a Graylog GELF UDP input to send ``INFO`` and above
+    to.
+
+.. envvar:: SITETOOLS_GELF_BATCH_SIZE
+
+    The number of messages to wait for before sending; defaults to 1 (i.e.
+    send as soon as possible).
+
+.. envvar:: SITETOOLS_GELF_FLUSH_INTERVAL
+
+    The longest (in seconds) that a message waits to be sent; defaults to 1.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import collections
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+
+from sitetools.logging import _add_stack_fields, _capture_stack
+
+log = logging.getLogger(__name__)
+
+
+#: The magic bytes which start every GELF chunk.
+CHUNK_MAGIC = '\x1e\x0f'
+
+#: The most chunks Graylog will accept for a single message.
+MAX_CHUNKS = 128
+
+# The magic, the message ID, the sequence number, and the sequence count.
+_chunk_header_size = 2 + 8 + 1 + 1
+
+
+# From logging levels to syslog severities, as GELF requires.
+_syslog_levels = (
+    (logging.CRITICAL, 2),
+    (logging.ERROR, 3),
+    (logging.WARNING, 4),
+    (logging.INFO, 6),
+)
+
+
+def get_syslog_level(levelno):
+    for threshold, level in _syslog_levels:
+        if levelno >= threshold:
+            return level
+    return 7
+
+
+def chunk(data, chunk_size):
+    """Split an encoded message into GELF chunks.
+
+    :param str data: The (compressed) message.
+    :param int chunk_size: The largest datagram to produce.
+    :returns: A list of datagrams, or ``None`` if it would take more than
+        :data:`MAX_CHUNKS`.
+
+    """
+
+    payload_size = chunk_size - _chunk_header_size
+    count = (len(data) + payload_size - 1) // payload_size
+    if count > MAX_CHUNKS:
+        return
+
+    message_id = os.urandom(8)
+    return [
+        CHUNK_MAGIC + message_id + chr(i) + chr(count) + data[i * payload_size:(i + 1) * payload_size]
+        for i in xrange(count)
+    ]
+
+
+class GELFHandler(logging.Handler):
+    """A handler which sends GELF messages over UDP on a background thread.
+
+    :param str host: The Graylog host.
+    :param int port: The Graylog GELF UDP port.
+    :param bool compress: Compress messages with zlib.
+    :param int chunk_size: The largest datagram to send; 1420 is safe across
+        most networks, but up to 8154 is fine within a LAN.
+    :param int batch_size: The number of messages to wait for before sending.
+    :param float flush_interval: The longest a message waits to be sent.
+    :param int maxsize: The most messages to hold; others are dropped.
+
+    .. attribute:: fields
+
+        A dict of additional fields (whose names start with ``_``) to send
+        with every message.
+
+    .. attribute:: sent
+
+        The number of messages sent.
+
+    .. attribute:: chunked
+
+        The number of messages sent as multiple chunks (which are included
+        in :attr:`sent`).
+
+    .. attribute:: dropped
+
+        The number of messages which could not be sent.
+
+    """
+
+    #: The maximum number of seconds :meth:`flush` waits for.
+    flush_timeout = 5.0
+
+    def __init__(self, host, port, compress=True, chunk_size=1420, batch_size=1,
+        flush_interval=1.0, maxsize=10000
+    ):
+        logging.Handler.__init__(self)
+        self.host = host
+        self.port = port
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self.hostname = socket.gethostname()
+        self.fields = {}
+        self.sent = 0
+        self.chunked = 0
+        self.dropped = 0
+        self._closed = False
+        self._start()
+
+    @classmethod
+    def from_environ(cls, host, port):
+        """Construct a handler configured by :envvar:`SITETOOLS_GELF_BATCH_SIZE`
+        and :envvar:`SITETOOLS_GELF_FLUSH_INTERVAL`."""
+        kwargs = {}
+        for name, key, type_ in (
+            ('SITETOOLS_GELF_BATCH_SIZE', 'batch_size', int),
+            ('SITETOOLS_GELF_FLUSH_INTERVAL', 'flush_interval', float),
+        ):
+            raw = os.environ.get(name)
+            if raw:
+                try:
+                    kwargs[key] = type_(raw)
+                except ValueError:
+                    log.error('invalid %s %r', name, raw)
+        return cls(host, port, **kwargs)
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._queue = collections.deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._oldest = None
+        self._unfinished = 0
+        self._flushing = False
+        self._stopping = False
+        self._addr = None
+        self._sock = None
+        self._thread = threading.Thread(target=self._run, name='sitetools.gelf')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def make_message(self, record):
+        """Build the GELF message (as a dict) for a record."""
+
+        msg = dict(
+            self.fields,
+            version='1.1',
+            host=self.hostname,
+            short_message=self.format(record),
+            timestamp=record.created,
+            level=get_syslog_level(record.levelno),
+            _application='python.logging',
+            _pid=record.process,
+            _python_log_name=record.name,
+            _python_log_levelno=record.levelno,
+            _python_log_levelname=record.levelname,
+        )
+
+        # For error and above, we would like a traceback.
+        if record.levelno >= logging.ERROR:
+            _add_stack_fields(msg, record)
+
+        return msg
+
+    def encode(self, record):
+        data = json.dumps(self.make_message(record))
+        if self.compress:
+            data = zlib.compress(data)
+        return data
+
+    def prepare(self, record):
+        """Capture the stack while still on the logging thread (see
+        :class:`~sitetools.logqueue.QueueHandler`)."""
+        if record.levelno >= logging.ERROR:
+            _capture_stack(record)
+
+    def emit(self, record):
+
+        if self._closed:
+            return
+
+        # The parent's thread does not exist here.
+        if self._pid != os.getpid():
+            self._start()
+
+        try:
+            data = self.encode(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                self.dropped += 1
+                return
+            # Wake the thread for the first message (to start waiting for the
+            # interval) and once the batch is full.
+            if not self._queue:
+                self._oldest = time.time()
+                self._cond.notify_all()
+            self._queue.append(data)
+            self._unfinished += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+
+    def _wait_for_batch(self):
+        """Wait (with the condition held) until there is something to send."""
+        queue = self._queue
+        while not self._stopping:
+            if not queue:
+                self._cond.wait()
+            elif len(queue) >= self.batch_size or self._flushing:
+                return
+            else:
+                remaining = self._oldest + self.flush_interval - time.time()
+                if remaining <= 0:
+                    return
+                self._cond.wait(remaining)
+
+    def _run(self):
+        cond = self._cond
+        queue = self._queue
+        while True:
+
+            with cond:
+                self._wait_for_batch()
+                if not queue:
+                    return
+                batch = list(queue)
+                queue.clear()
+
+            for data in batch:
+                self._send(data)
+
+            with cond:
+                self._unfinished -= len(batch)
+                cond.notify_all()
+
+    def _send(self, data):
+
+        if len(data) > self.chunk_size:
+            datagrams = chunk(data, self.chunk_size)
+            if datagrams is None:
+                self.dropped += 1
+                return
+        else:
+            datagrams = [data]
+
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if self._addr is None:
+                # Only resolve once; DNS lookups per record were ridiculous.
+                self._addr = (socket.gethostbyname(self.host), self.port)
+            for datagram in datagrams:
+                self._sock.sendto(datagram, self._addr)
+        except (socket.error, EnvironmentError):
+            self.dropped += 1
+            return
+
+        self.sent += 1
+        if len(datagrams) > 1:
+            self.chunked += 1
+
+    def flush(self):
+        """Send everything waiting, and wait (for at most :attr:`flush_timeout`) for it to be sent."""
+
+        if self._pid != os.getpid():
+            return
+
+        deadline = time.time() + self.flush_timeout
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            try:
+                while self._unfinished > 0 and self._thread.is_alive():
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing = False
+
+    def close(self):
+        """Send everything waiting, and stop the thread."""
+
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._pid == os.getpid():
+            self.flush()
+            with self._cond:
+                self._stopping = True
+                self._cond.notify_all()
+            self._thread.join(self.flush_timeout)
+            if self._sock is not None:
+                self._sock.close()
+
+        logging.Handler.close(self)
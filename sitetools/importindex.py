@@ -0,0 +1,302 @@
+"""
+
+With many sites there may be hundreds of entries on :data:`python:sys.path`,
+and every cold top-level import must check each of them in turn until the
+module is found. This module provides a :data:`python:sys.meta_path` finder
+which lists each directory on ``sys.path`` once, and then goes directly to the
+directories which could possibly contain a given top-level module.
+
+The sites scanned by :mod:`sitetools.sites` are fed into the index as they are
+scanned, so that they need not be listed again.
+
+The finder is conservative; whenever it cannot be sure what the normal import
+machinery would find, it declines and lets the normal machinery do its job. In
+particular, it:
+
+- only handles top-level modules (packages have their own ``__path__``);
+- never handles builtin or frozen modules;
+- stops at the first ``sys.path`` entry which is not a plain directory (e.g. a
+  zip file), since it cannot know what is inside, unless it has been given the
+  archive's listing (as it is for site bundles; see :mod:`sitetools.bundles`);
+- stops at the first ``sys.path`` entry claimed by one of
+  :data:`python:sys.path_hooks`, which are asked about every entry (and the
+  answer cached in :data:`python:sys.path_importer_cache`) exactly as the
+  normal machinery would;
+- always probes the current directory (the ``''`` entry) directly, since it
+  may change;
+- rebuilds itself whenever ``sys.path`` is replaced, changes length, or has
+  its first or last entry changed.
+
+Since directories are only listed once, modules created on ``sys.path`` after
+they are listed may be shadowed by those which were listed. Likewise, other
+changes within ``sys.path`` (e.g. replacing an entry in the middle) are not
+noticed. Call :meth:`IndexedFinder.invalidate_caches` if this matters.
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_IMPORT_INDEX
+
+    Set to ``"1"`` to install the :class:`IndexedFinder` at startup.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import errno
+import imp
+import logging
+import os
+import sys
+import zipimport
+
+from sitetools import bytecode
+
+log = logging.getLogger(__name__)
+
+
+def _get_suffixes():
+    return [suffix for suffix, _, _ in imp.get_suffixes()]
+
+
+def get_module_names(file_names):
+    """Get the set of top-level module names which could be provided by the
+    given directory entries.
+
+    Entries without any extension are included as they may be packages, and
+    entries matching several suffixes are included under each name (e.g.
+    ``barmodule.so`` provides both ``bar`` and ``barmodule``).
+
+    """
+
+    suffixes = _get_suffixes()
+    names = set()
+    for file_name in file_names:
+        if file_name.startswith('.'):
+            continue
+        if '.' not in file_name:
+            names.add(file_name)
+            continue
+        for suffix in suffixes:
+            if file_name.endswith(suffix):
+                names.add(file_name[:-len(suffix)])
+    return names
+
+
+def _get_importer(entry):
+    """Get the importer for a path entry just as the normal machinery would,
+    caching it in :data:`python:sys.path_importer_cache`.
+
+    :returns: The importer, or ``None`` if the normal (builtin) machinery
+        handles this entry.
+
+    """
+
+    try:
+        return sys.path_importer_cache[entry]
+    except KeyError:
+        pass
+
+    importer = None
+    for hook in sys.path_hooks:
+        try:
+            importer = hook(entry)
+        except ImportError:
+            continue
+        break
+    else:
+        # Anything other than a directory cannot contain anything.
+        try:
+            importer = imp.NullImporter(entry)
+        except ImportError:
+            pass
+
+    sys.path_importer_cache[entry] = importer
+    return importer
+
+
+class _Loader(object):
+
+    def __init__(self, found):
+        self.found = found
+
+    def load_module(self, fullname):
+        return bytecode.load_module(fullname, self.found)
+
+
+class IndexedFinder(object):
+    """A :data:`python:sys.meta_path` finder for top-level modules on
+    :data:`python:sys.path`, backed by an index of directory listings."""
+
+    def __init__(self):
+        self._listings = {}
+        self._archives = set()
+        self._path_stamp = None
+        self._plan = None
+
+    def add_listing(self, dir_path, file_names, archive=False):
+        """Provide the contents of a directory so that it need not be listed.
+
+        :param bool archive: The path is within a zip archive, and so will be
+            searched via :mod:`python:zipimport`.
+
+        """
+        dir_path = os.path.abspath(dir_path)
+        self._listings[dir_path] = get_module_names(file_names)
+        if archive:
+            self._archives.add(dir_path)
+        else:
+            self._archives.discard(dir_path)
+        self._path_stamp = None
+
+    def invalidate_caches(self):
+        """Forget all directory listings."""
+        self._listings.clear()
+        self._archives.clear()
+        self._path_stamp = None
+
+    def _get_listing(self, dir_path):
+        try:
+            return self._listings[dir_path]
+        except KeyError:
+            pass
+        try:
+            names = get_module_names(os.listdir(dir_path))
+        except OSError as e:
+            # Missing directories are harmless; Python will skip them too.
+            names = set() if e.errno == errno.ENOENT else None
+        self._listings[dir_path] = names
+        return names
+
+    def _build_plan(self, path):
+        """Build the list of steps which mimic the normal search of ``path``.
+
+        Each step is one of ``('index', {name: [dirs]})``, ``('probe', entry)``,
+        or ``('barrier', entry)``.
+
+        """
+
+        plan = []
+        index = None
+
+        for entry in path:
+
+            if not isinstance(entry, basestring):
+                plan.append(('barrier', entry))
+                break
+
+            # The current directory is always probed directly.
+            if not entry:
+                index = None
+                plan.append(('probe', entry))
+                continue
+
+            dir_path = os.path.abspath(entry)
+            if dir_path not in self._archives:
+                importer = _get_importer(entry)
+                if importer is not None and not isinstance(importer, imp.NullImporter):
+                    plan.append(('barrier', entry))
+                    break
+
+            names = self._get_listing(dir_path)
+            if names is None:
+                plan.append(('barrier', entry))
+                break
+
+            if index is None:
+                index = {}
+                plan.append(('index', index))
+            for name in names:
+                index.setdefault(name, []).append(entry)
+
+        return plan
+
+    def _get_plan(self):
+        # Comparing all of sys.path on every import costs as much as the
+        # search we are avoiding, so we only look at a cheap stamp of it.
+        path = sys.path
+        stamp = (id(path), len(path), path[0], path[-1]) if path else (id(path), 0)
+        if stamp != self._path_stamp:
+            self._path_stamp = stamp
+            self._plan = self._build_plan(list(path))
+        return self._plan
+
+    def _find(self, name, entry):
+        """Get a loader for the given module within a single path entry."""
+
+        if os.path.abspath(entry) in self._archives:
+            importer = sys.path_importer_cache.get(entry)
+            if importer is None:
+                try:
+                    importer = zipimport.zipimporter(entry)
+                except zipimport.ZipImportError:
+                    return
+                sys.path_importer_cache[entry] = importer
+            return importer.find_module(name)
+
+        try:
+            return _Loader(imp.find_module(name, [entry]))
+        except ImportError:
+            pass
+
+    def find_module(self, fullname, path=None):
+
+        # Only top-level modules; packages have their own (short) path.
+        if path is not None or '.' in fullname:
+            return
+        if imp.is_builtin(fullname) or imp.is_frozen(fullname):
+            return
+
+        for kind, value in self._get_plan():
+
+            if kind == 'index':
+                for entry in value.get(fullname, ()):
+                    loader = self._find(fullname, entry)
+                    if loader is not None:
+                        log.log(1, 'found %s in %s via index', fullname, entry)
+                        return loader
+
+            elif kind == 'probe':
+                loader = self._find(fullname, value)
+                if loader is not None:
+                    return loader
+
+            else:
+                return
+
+
+_finder = None
+
+
+def get_installed():
+    """Get the installed :class:`IndexedFinder`, or ``None``."""
+    return _finder
+
+
+def install():
+    """Install an :class:`IndexedFinder` at the front of :data:`python:sys.meta_path`.
+
+    :returns: The installed finder (which may have already been installed).
+
+    """
+    global _finder
+    if _finder is None:
+        _finder = IndexedFinder()
+        sys.meta_path.insert(0, _finder)
+    return _finder
+
+
+def uninstall():
+    """Remove the installed :class:`IndexedFinder`, if there is one."""
+    global _finder
+    if _finder is not None:
+        try:
+            sys.meta_path.remove(_finder)
+        except ValueError:
+            pass
+        _finder = None
@@ -0,0 +1,406 @@
+"""
+
+Every phase of the startup sequence run by :mod:`sitetools._startup` is timed,
+so that regressions may be tracked down to a single phase (and, with
+profiling enabled, a single site).
+
+The timings are recorded as :class:`Span` objects, available via
+:func:`get_spans`. Wall and CPU time, and the filesystem calls made by
+:mod:`sitetools.sites` itself (as counted by its
+:data:`~sitetools.sites.scan_stats`, which costs nothing extra), are always
+recorded for each phase. When profiling is enabled, every filesystem call (by
+monkey-patching :mod:`os` and :func:`open` via :class:`FSCounter`) and the
+change in resident set size are recorded instead, as are spans for the
+scanning and processing of each individual site.
+
+Filesystem calls made by the import machinery itself (which happen in C) are
+never counted. Since filesystem calls are counted for the whole process, spans
+which overlap with other threads (e.g. scanning sites concurrently) include
+the calls of those threads.
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_STARTUP_PROFILE
+
+    Set to ``"1"`` to count every filesystem call and the resident set size
+    during startup, and to record spans for each site.
+
+.. envvar:: SITETOOLS_STARTUP_TRACE
+
+    A path to write the startup spans to, as a `Chrome trace event
+    <https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU>`_
+    JSON file (which may be viewed at ``chrome://tracing``). ``{pid}`` will be
+    replaced with the process ID. This implies :envvar:`SITETOOLS_STARTUP_PROFILE`.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import __builtin__
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+_cpu_time = getattr(time, 'process_time', None) or time.clock
+_original_open = __builtin__.open
+
+
+# Modules whose frames are skipped when attributing calls to a caller.
+_wrapper_modules = set(['os', 'posixpath', 'ntpath', 'genericpath', 'sitetools.instrument'])
+
+
+def _get_caller(depth):
+    frame = sys._getframe(depth + 1)
+    while frame.f_back and frame.f_globals.get('__name__') in _wrapper_modules:
+        frame = frame.f_back
+    return '%s:%s' % (frame.f_globals.get('__name__'), frame.f_code.co_name)
+
+
+class _CountingFile(object):
+    """Proxy for a file object which counts reads on behalf of an :class:`FSCounter`."""
+
+    def __init__(self, fh, counter):
+        self._fh = fh
+        self._counter = counter
+
+    def read(self, *args):
+        self._counter._count('read', 2)
+        return self._fh.read(*args)
+
+    def readline(self, *args):
+        self._counter._count('read', 2)
+        return self._fh.readline(*args)
+
+    def readlines(self, *args):
+        self._counter._count('read', 2)
+        return self._fh.readlines(*args)
+
+    def __iter__(self):
+        # Buffered iteration is counted as a single read.
+        self._counter._count('read', 2)
+        return iter(self._fh)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._fh.close()
+
+    def __getattr__(self, name):
+        return getattr(self._fh, name)
+
+
+class FSCounter(object):
+    """Counts filesystem calls made via :mod:`os` and :func:`open`.
+
+    :param str root: Only count calls on paths within this directory (and
+        ``fstat`` of files opened within it).
+    :param bool callers: Also count calls by the calling function, in
+        :attr:`callers`, as ``{'module:function': {name: count}}``.
+    :param bool reads: Also count reads from files opened via :func:`open`;
+        this wraps the returned file objects in a proxy.
+    :param float latency: Seconds to sleep before every counted call, to
+        simulate a high-latency network filesystem on local disk.
+
+    Counting starts on :meth:`install` (or entering the context), and stops
+    on :meth:`uninstall`. Counts are kept by function name in :attr:`counts`.
+
+    """
+
+    targets = (
+        (os, 'stat'),
+        (os, 'lstat'),
+        (os, 'fstat'),
+        (os, 'listdir'),
+        (os, 'scandir'),
+        (os, 'access'),
+        (os, 'open'),
+        (os, 'readlink'),
+        (__builtin__, 'open'),
+    )
+
+    def __init__(self, root=None, callers=False, reads=False, latency=0):
+        self.root = os.path.abspath(root) if root else None
+        self.track_callers = callers
+        self.track_reads = reads
+        self.latency = latency
+        self.counts = {}
+        self.callers = {}
+        self._fds = set()
+        self._originals = None
+
+    @property
+    def total(self):
+        return sum(self.counts.itervalues())
+
+    def snapshot(self):
+        return dict(self.counts)
+
+    def _count(self, name, depth=1):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if self.track_callers:
+            by_name = self.callers.setdefault(_get_caller(depth), {})
+            by_name[name] = by_name.get(name, 0) + 1
+
+    def _is_counted(self, name, args):
+        if self.root is None:
+            return True
+        if not args:
+            return False
+        if name == 'fstat':
+            return args[0] in self._fds
+        path = args[0]
+        if not isinstance(path, basestring):
+            return False
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(self.root.rstrip(os.sep) + os.sep)
+
+    def _wrap(self, name, func):
+        def wrapped(*args, **kwargs):
+            if not self._is_counted(name, args):
+                return func(*args, **kwargs)
+            self._count(name, 2)
+            if self.latency:
+                time.sleep(self.latency)
+            res = func(*args, **kwargs)
+            if name == 'open' and not isinstance(res, int):
+                if self.root is not None:
+                    self._fds.add(res.fileno())
+                if self.track_reads:
+                    res = _CountingFile(res, self)
+            elif name == 'open' and self.root is not None:
+                self._fds.add(res)
+            return res
+        wrapped.__name__ = func.__name__
+        wrapped.__doc__ = func.__doc__
+        return wrapped
+
+    def install(self):
+        if self._originals is not None:
+            return
+        self._originals = []
+
+        # The scandir backport (on Python 2) is its own module; we patch the
+        # same one that sitetools.sites would use.
+        targets = list(self.targets)
+        if not hasattr(os, 'scandir'):
+            for module_name in ('_scandir', 'scandir'):
+                try:
+                    module = __import__(module_name)
+                except ImportError:
+                    continue
+                targets.append((module, 'scandir'))
+                break
+
+        for obj, name in targets:
+            func = getattr(obj, name, None)
+            if func is None:
+                continue
+            self._originals.append((obj, name, func))
+            setattr(obj, name, self._wrap(name, func))
+
+    def uninstall(self):
+        if self._originals is None:
+            return
+        for obj, name, func in reversed(self._originals):
+            setattr(obj, name, func)
+        self._originals = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *args):
+        self.uninstall()
+
+
+def _get_rss():
+    """Get the resident set size of the process in bytes, or ``None`` if it
+    cannot be determined (i.e. anywhere without ``/proc``)."""
+
+    try:
+        with _original_open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+
+class Span(object):
+    """A timed section of the startup sequence.
+
+    .. attribute:: wall_time
+
+        Seconds elapsed.
+
+    .. attribute:: cpu_time
+
+        Seconds of process CPU time used.
+
+    .. attribute:: fs_calls
+
+        A dict of filesystem calls made, by function name. These are only the
+        calls made by :mod:`sitetools.sites` unless profiling was enabled.
+
+    .. attribute:: rss
+
+        Change in resident set size in bytes, or ``None`` if profiling was not
+        enabled or it could not be determined.
+
+    """
+
+    def __init__(self, name, category, args=None):
+        self.name = name
+        self.category = category
+        self.args = args or {}
+        self.thread = threading.current_thread().ident
+        self.start_time = None
+        self.wall_time = None
+        self.cpu_time = None
+        self.fs_calls = None
+        self.rss = None
+
+    def start(self):
+        self._counter = _counter
+        self._fs_start = _snapshot_fs_calls(_counter)
+        self._rss_start = _get_rss() if _counter else None
+        self._cpu_start = _cpu_time()
+        self.start_time = time.time()
+
+    def stop(self):
+        self.wall_time = time.time() - self.start_time
+        self.cpu_time = _cpu_time() - self._cpu_start
+        end = _snapshot_fs_calls(self._counter)
+        self.fs_calls = dict(
+            (k, v - self._fs_start.get(k, 0))
+            for k, v in end.iteritems()
+            if v != self._fs_start.get(k, 0)
+        )
+        if self._counter is not None:
+            rss = _get_rss()
+            if rss is not None and self._rss_start is not None:
+                self.rss = rss - self._rss_start
+
+    def to_trace_event(self):
+        """Get this span as a Chrome "complete" trace event."""
+        args = dict(self.args)
+        args['cpu_ms'] = 1000 * self.cpu_time
+        if self.fs_calls is not None:
+            args['fs_calls'] = self.fs_calls
+        if self.rss is not None:
+            args['rss'] = self.rss
+        return {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': int(1e6 * self.start_time),
+            'dur': int(1e6 * self.wall_time),
+            'pid': os.getpid(),
+            'tid': self.thread,
+            'args': args,
+        }
+
+    def __repr__(self):
+        return '<Span %s %.3fms>' % (self.name, 1000 * (self.wall_time or 0))
+
+
+_spans = []
+_counter = None
+
+
+def _snapshot_fs_calls(counter):
+    """Get the filesystem calls counted so far by the given :class:`FSCounter`,
+    or else by :data:`sitetools.sites.scan_stats`."""
+
+    if counter is not None:
+        return counter.snapshot()
+
+    # This is imported by sitetools.sites, so we don't import it in turn.
+    stats = getattr(sys.modules.get('sitetools.sites'), 'scan_stats', None)
+    if stats is None:
+        return {}
+    return {'listdir': stats.listdir, 'stat': stats.stat, 'open': stats.open, 'read': stats.read}
+
+
+def get_spans():
+    """Get all recorded :class:`Span` objects, in the order they finished."""
+    return list(_spans)
+
+
+def is_profiling():
+    """Are filesystem calls and per-site spans being recorded?"""
+    return _counter is not None
+
+
+@contextlib.contextmanager
+def span(name, category='sitetools', detail=False, **args):
+    """Context manager which records a :class:`Span`.
+
+    :param bool detail: Only record this span while profiling.
+
+    """
+    if detail and _counter is None:
+        yield
+        return
+    obj = Span(name, category, args)
+    obj.start()
+    try:
+        yield obj
+    finally:
+        obj.stop()
+        _spans.append(obj)
+
+
+def start_profiling():
+    """Start counting filesystem calls and recording detailed spans."""
+    global _counter
+    if _counter is None:
+        _counter = FSCounter()
+        _counter.install()
+
+
+def stop_profiling():
+    """Stop counting filesystem calls."""
+    global _counter
+    if _counter is not None:
+        _counter.uninstall()
+        _counter = None
+
+
+def write_trace(path, spans=None):
+    """Write spans (defaulting to all of them) as a Chrome trace event JSON file."""
+    spans = _spans if spans is None else spans
+    with _original_open(path, 'w') as fh:
+        json.dump({
+            'traceEvents': [x.to_trace_event() for x in spans],
+            'displayTimeUnit': 'ms',
+        }, fh)
+
+
+def _setup():
+    if os.environ.get('SITETOOLS_STARTUP_TRACE') or os.environ.get('SITETOOLS_STARTUP_PROFILE', '0') != '0':
+        start_profiling()
+
+
+def _teardown():
+    stop_profiling()
+    path = os.environ.get('SITETOOLS_STARTUP_TRACE')
+    if path:
+        # Not str.format, since the path may have other braces in it.
+        path = path.replace('{pid}', str(os.getpid()))
+        try:
+            write_trace(path)
+        except (IOError, OSError) as e:
+            log.warning('could not write startup trace to %s: %r', path, e)
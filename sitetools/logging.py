@@ -35,6 +35,38 @@ Environment Variables
 
     Keys available include: ``date``, ``time``, ``login``, ``ip``, and ``pid``.
 
+    See :envvar:`SITETOOLS_LOG_SPOOL` to buffer and rotate these files, and
+    :mod:`sitetools.logs` to search them.
+
+.. envvar:: SITETOOLS_LOG_FORMAT
+
+    Set to ``json`` to write one JSON object per record to stderr and
+    :envvar:`SITETOOLS_LOG_FILE` (see :class:`JSONFormatter`) instead of text,
+    and to send the ``login`` and ``ip`` to Graylog as fields rather than only
+    the message.
+
+.. envvar:: SITETOOLS_LOG_CONTEXT
+
+    Set by sitetools once the ``ip`` or ``login`` of a process is known, so
+    that subprocesses need not work them out again. It is ignored by a process
+    on another host, or running as another user.
+
+    Each of those fields is only worked out when a log format or
+    :envvar:`SITETOOLS_LOG_FILE` uses it, by trying (in order) this variable,
+    a per-host cache within :envvar:`SITETOOLS_CACHE_DIR` (which expires
+    after an hour for the ``ip``), and then the system. The ``ip`` is that of
+    the interface with the default route, which is read from the routing
+    table rather than the network.
+
+.. envvar:: SITETOOLS_LOG_STACK_SAMPLE
+
+    Records of ``ERROR`` and above sent to Graylog carry the stack which
+    logged them, along with a fingerprint of that stack and how many times the
+    process has seen it. Since formatting stacks is expensive (and repeated
+    stacks are of little use) only the first occurrence of each, and then
+    every Nth, carries the stack itself. Defaults to 100; set to 0 to only
+    send each stack once.
+
 .. envvar:: SITETOOLS_VERBOSE
 
     Set by ``-v`` flags to the :ref:`dev command <dev_command>'.
@@ -59,6 +91,18 @@ Environment Variables
 
     which is too high for any (built-in) log levels.
 
+.. envvar:: SITETOOLS_LOG_QUEUE
+
+    Set to ``block``, ``drop-oldest``, or ``drop-new`` to hand records to the
+    handlers above via a queue and a background thread; see
+    :mod:`sitetools.logqueue`.
+
+.. envvar:: SITETOOLS_LOG_RATE_LIMIT
+
+    Set to ``rate[:burst[:interval]]`` to limit how many records per second
+    each call site may log through the handlers above; see
+    :mod:`sitetools.ratelimit`.
+
 
 """
 
@@ -66,14 +110,20 @@ from __future__ import absolute_import
 
 import codecs
 import datetime
+import errno
+import hashlib
 import json
 import logging.handlers
 import os
 import pwd
 import re
 import socket
+import string
 import sys
+import threading
+import time
 import traceback
+import urlparse
 import warnings
 
 log = logging.getLogger(__name__)
@@ -102,37 +152,213 @@ def _show_warning(message, category, filename, lineno, file=None, line=None):
 
 
 _context_start_time = datetime.datetime.now()
-_context = {}
-def _get_context():
-    if _context.get('pid') != os.getpid():
 
-        # Try to get the outward-facing IP of this machine. We connect
-        # to a remote IP (in this case, Google's DNS) and read out the
-        # IP that the socket picked. Since we are using a DGRAM socket,
-        # there really isn't any connection going on, so it doesn't
-        # matter who we connect to.
+
+#: How long (in seconds) a cached IP address remains valid.
+ip_cache_age = 3600
+
+
+def _get_route_ip():
+    """Get the IP address of the interface with the default route.
+
+    This reads the routing table and asks the kernel for the address of an
+    interface, so (unlike "connecting" a socket) it never needs the network.
+    Only works on Linux; returns ``None`` elsewhere, or if there is no
+    default route.
+
+    """
+
+    import fcntl
+    import struct
+
+    try:
+        with open('/proc/net/route') as fh:
+            lines = fh.read().splitlines()[1:]
+    except IOError:
+        return
+
+    # Find the default route (destination 0.0.0.0, flags RTF_UP|RTF_GATEWAY)
+    # with the lowest metric.
+    routes = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 7 or parts[1] != '00000000':
+            continue
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.settimeout(0)
-            s.connect(('8.8.8.8', 53))
-            ip = s.getsockname()[0]
+            flags = int(parts[3], 16)
+            metric = int(parts[6])
+        except ValueError:
+            continue
+        if flags & 0x3 == 0x3:
+            routes.append((metric, parts[0]))
+    if not routes:
+        return
+    iface = min(routes)[1]
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        res = fcntl.ioctl(s.fileno(), 0x8915, struct.pack('256s', iface[:15])) # SIOCGIFADDR
+    except IOError:
+        return
+    finally:
+        s.close()
+    return socket.inet_ntoa(res[20:24])
+
+
+def _get_connected_ip():
+
+    # Try to get the outward-facing IP of this machine. We connect
+    # to a remote IP (in this case, Google's DNS) and read out the
+    # IP that the socket picked. Since we are using a DGRAM socket,
+    # there really isn't any connection going on, so it doesn't
+    # matter who we connect to.
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.settimeout(0)
+        s.connect(('8.8.8.8', 53))
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+
+def _load_inherited_context():
+    """Parse :envvar:`SITETOOLS_LOG_CONTEXT` into what is valid for us."""
+
+    from sitetools.platform import get_host_key
+
+    raw = os.environ.get('SITETOOLS_LOG_CONTEXT')
+    if not raw:
+        return {}
+
+    fields = dict(x.split('=', 1) for x in raw.split() if '=' in x)
+    inherited = {}
+    if fields.get('host') == get_host_key() and fields.get('ip'):
+        inherited['ip'] = fields['ip']
+    if fields.get('uid') == str(os.getuid()) and fields.get('login'):
+        inherited['login'] = fields['login']
+    return inherited
+
+
+def _get_host_cache_name():
+    from sitetools.platform import get_host_key
+    return 'context-%s-%d.json' % (get_host_key(), os.getuid())
+
+
+def _compute_ip():
+
+    from sitetools import cache
+
+    inherited = _load_inherited_context()
+    if 'ip' in inherited:
+        return inherited['ip']
+
+    cache_name = _get_host_cache_name()
+    cached = cache.read_json(cache_name) or {}
+    if cached.get('ip') and cached.get('ip_time', 0) > time.time() - ip_cache_age:
+        return cached['ip']
+
+    ip = None
+    for func in (_get_route_ip, _get_connected_ip):
+        try:
+            ip = func()
         except Exception:
-            ip = '0.0.0.0'
+            pass
+        if ip:
+            break
+    else:
+        return '0.0.0.0'
+
+    cached.update(ip=ip, ip_time=time.time())
+    cache.write_json(cache_name, cached)
+    return ip
+
+
+def _compute_login():
+
+    from sitetools import cache
+
+    inherited = _load_inherited_context()
+    if 'login' in inherited:
+        return inherited['login']
+
+    cache_name = _get_host_cache_name()
+    cached = cache.read_json(cache_name) or {}
+    if cached.get('login'):
+        return cached['login']
+
+    # Get the current login name. We must be rather defensive about it.
+    try:
+        login = pwd.getpwuid(os.getuid())[0]
+    except (ValueError, KeyError, OSError):
+        return os.environ.get('USER', 'unknown')
+
+    cached['login'] = login
+    cache.write_json(cache_name, cached)
+    return login
 
-        # Get the current login name. We must be rather defensive about it.
+
+def _publish_context(context):
+    from sitetools.platform import get_host_key
+    values = _load_inherited_context()
+    values.update((k, v) for k, v in context.iteritems() if k in ('ip', 'login'))
+    fields = ['host=%s' % get_host_key(), 'uid=%d' % os.getuid()]
+    for name in ('ip', 'login'):
+        value = values.get(name)
+        if value and ' ' not in value:
+            fields.append('%s=%s' % (name, value))
+    os.environ['SITETOOLS_LOG_CONTEXT'] = ' '.join(fields)
+
+
+class _Context(dict):
+    """The context of this process, with each field worked out when first used.
+
+    The ``pid`` is never stored, so the context remains correct after a fork.
+
+    """
+
+    _getters = {
+        'ip': _compute_ip,
+        'login': _compute_login,
+        'date': lambda: _context_start_time.strftime('%Y-%m-%d'),
+        'time': lambda: _context_start_time.strftime('%H-%M-%S'),
+    }
+
+    #: Every field, for those which need them all.
+    fields = ('pid', 'ip', 'login', 'date', 'time')
+
+    def __init__(self):
+        dict.__init__(self)
+        self._local = threading.local()
+
+    def __missing__(self, key):
+
+        if key == 'pid':
+            return os.getpid()
+
+        getter = self._getters[key]
+
+        # Working out a field may log (e.g. from the cache), which may format
+        # a record that needs that same field.
+        computing = self._local.__dict__.setdefault('computing', set())
+        if key in computing:
+            return 'unknown'
+        computing.add(key)
         try:
-            login = pwd.getpwuid(os.getuid())[0]
-        except (ValueError, KeyError, OSError):
-            login = os.environ.get('USER', 'unknown')
-
-        _context.update({
-            'pid': os.getpid(),
-            'ip': ip,
-            'login': login,
-            'date': _context_start_time.strftime('%Y-%m-%d'),
-            'time': _context_start_time.strftime('%H-%M-%S'),
-        })
+            value = getter()
+        finally:
+            computing.discard(key)
+
+        self[key] = value
+        if key in ('ip', 'login'):
+            _publish_context(self)
+        return value
 
+    def get_all(self):
+        return dict((name, self[name]) for name in self.fields)
+
+
+_context = _Context()
+def _get_context():
     return _context
 
 
@@ -163,35 +389,326 @@ class _FileSafetyWrapper(object):
             print '# Error while writing log:', repr(e)
 
 
-class PatternedFileHandler(logging.FileHandler):
+def _get_log_path(pattern):
 
-    def _open(self):
+    # E.g.: /Volumes/VFX/logs/{date}/{login}@{ip}/{time}.{pid}.log
+    #       /Volumes/VFX/logs/2013-01-22/mboers@10.2.200.1/11-15-15.12345.log
 
-        # E.g.: /Volumes/VFX/logs/{date}/{login}@{ip}/{time}.{pid}.log
-        #       /Volumes/VFX/logs/2013-01-22/mboers@10.2.200.1/11-15-15.12345.log
+    return string.Formatter().vformat(pattern, (), _get_context())
 
-        file_path = self.baseFilename.format(**_get_context())
-        dir_path = os.path.dirname(file_path)
-        umask = os.umask(0)
-        try:
-            os.makedirs(dir_path)
-        except OSError as e:
-            if e.errno != errno.EEXIST: # File exists.
-                warnings.warn('Error while creating log directory: %r' % e)
-                return _NullFile()
-        finally:
-            os.umask(umask)
 
+def _make_log_dir(dir_path):
+    """Create a (world-writable) log directory, returning if it exists."""
+    umask = os.umask(0)
+    try:
+        os.makedirs(dir_path)
+    except OSError as e:
+        if e.errno != errno.EEXIST: # File exists.
+            warnings.warn('Error while creating log directory: %r' % e)
+            return False
+    finally:
+        os.umask(umask)
+    return True
+
+
+class PatternedFileHandler(logging.FileHandler):
+
+    def _open(self):
+        file_path = _get_log_path(self.baseFilename)
+        if not _make_log_dir(os.path.dirname(file_path)):
+            return _NullFile()
         return _FileSafetyWrapper(open(file_path, 'ab'))
 
 
 class ContextInfoFilter(logging.Filter):
 
     def filter(self, record):
-        record.__dict__.update(_get_context())
+        record.__dict__.update(_get_context().get_all())
         return True
 
 
+class ContextFormatter(logging.Formatter):
+    """A formatter which fills in the process context (``login``, ``ip``, and
+    ``pid``) without touching the records.
+
+    The context is substituted into the format once per process (and again
+    after a fork), so that formatting a record costs no more than with a plain
+    :class:`logging.Formatter`. This replaces a :class:`ContextInfoFilter` on
+    each handler.
+
+    """
+
+    _context_pattern = re.compile(r'%\((login|ip|pid)\)([-#0 +]*\d*(?:\.\d+)?[diouxXeEfFgGcrs])')
+
+    def __init__(self, fmt=FULL_FORMAT, datefmt=None):
+        logging.Formatter.__init__(self, fmt, datefmt)
+        self._context_fmt = fmt
+        self._pid = None
+
+    def _bind(self, pid):
+        context = _get_context()
+        def replace(m):
+            name = m.group(1)
+            value = pid if name == 'pid' else context[name]
+            return (('%' + m.group(2)) % value).replace('%', '%%')
+        self._fmt = self._context_pattern.sub(replace, self._context_fmt)
+        self._pid = pid
+
+    def format(self, record):
+        # Records know which process they are from, so this is free.
+        pid = record.process or os.getpid()
+        if pid != self._pid:
+            self._bind(pid)
+        return logging.Formatter.format(self, record)
+
+
+_encode_json_string = json.encoder.encode_basestring_ascii
+
+
+def _encode_json_text(value):
+    try:
+        return _encode_json_string(value)
+    except UnicodeDecodeError:
+        return _encode_json_string(value.decode('utf-8', 'replace'))
+
+
+class JSONFormatter(logging.Formatter):
+    """A formatter which outputs each record as a single line of JSON.
+
+    Each object has ``time`` (seconds since the epoch), ``level``, ``logger``,
+    ``message``, ``exception`` (only if there is one), ``login``, ``ip``, and
+    ``pid``. As with :class:`ContextFormatter`, the process context is only
+    encoded once per process, and the rest is encoded without building any
+    intermediate dicts.
+
+    """
+
+    def __init__(self):
+        logging.Formatter.__init__(self)
+        self._static = None
+        self._pid = None
+
+    def _bind(self, pid):
+        context = _get_context()
+        static = json.dumps({'login': context['login'], 'ip': context['ip'], 'pid': pid}, sort_keys=True)
+        self._static = ', ' + static[1:]
+        self._pid = pid
+
+    def format(self, record):
+
+        pid = record.process or os.getpid()
+        if pid != self._pid:
+            self._bind(pid)
+
+        parts = [
+            '{"time": ', repr(record.created),
+            ', "level": ', _encode_json_text(record.levelname),
+            ', "logger": ', _encode_json_text(record.name),
+            ', "message": ', _encode_json_text(record.getMessage()),
+        ]
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            parts.extend((', "exception": ', _encode_json_text(record.exc_text)))
+
+        parts.append(self._static)
+        return ''.join(parts)
+
+
+def _get_formatter():
+    """Get the formatter for stderr and log files, as requested by
+    :envvar:`SITETOOLS_LOG_FORMAT`."""
+    if os.environ.get('SITETOOLS_LOG_FORMAT') == 'json':
+        return JSONFormatter()
+    return ContextFormatter()
+
+
+# Our own modules which records pass through on their way to handlers.
+_logging_modules = set([__name__, 'sitetools.gelf', 'sitetools.logqueue'])
+
+
+def _is_logging_frame(frame):
+    name = frame.f_globals.get('__name__') or ''
+    return (
+        name == 'logging' or
+        name.startswith('logging.') or
+        name in _logging_modules or
+        (frame.f_globals.get('__package__') or '').startswith('logging')
+    )
+
+
+_stack_counts = {}
+_stack_lock = threading.Lock()
+_max_stack_fingerprints = 1000
+
+
+def _get_stack_sample():
+    try:
+        return int(os.environ.get('SITETOOLS_LOG_STACK_SAMPLE') or 100)
+    except ValueError:
+        return 100
+
+
+def _capture_stack(record):
+    """Attach the stack which logged a record to it.
+
+    Sets ``python_stack_fingerprint`` (a hash of the code location of every
+    frame) and ``python_stack_count`` (how many times this process has seen
+    that fingerprint), and ``python_stack`` only for the first occurrence and
+    every :envvar:`SITETOOLS_LOG_STACK_SAMPLE`-th one after that. Does nothing
+    if the record already has a fingerprint.
+
+    """
+
+    if hasattr(record, 'python_stack_fingerprint'):
+        return
+
+    # Find the root of the stack trace in which we have left
+    # the logging package.
+    frame = sys._getframe(1)
+    while frame.f_back and _is_logging_frame(frame):
+        frame = frame.f_back
+
+    locations = []
+    f = frame
+    while f is not None:
+        code = f.f_code
+        locations.append('%s:%d:%s' % (code.co_filename, f.f_lineno, code.co_name))
+        f = f.f_back
+    fingerprint = hashlib.sha1('\n'.join(locations)).hexdigest()[:16]
+
+    with _stack_lock:
+        if len(_stack_counts) >= _max_stack_fingerprints and fingerprint not in _stack_counts:
+            _stack_counts.clear()
+        count = _stack_counts[fingerprint] = _stack_counts.get(fingerprint, 0) + 1
+
+    record.python_stack_fingerprint = fingerprint
+    record.python_stack_count = count
+
+    # Formatting is the expensive part, so only do it for the sample.
+    sample = _get_stack_sample()
+    if count == 1 or (sample > 0 and not (count - 1) % sample):
+        record.python_stack = ''.join(traceback.format_stack(frame))
+
+
+def _add_stack_fields(msg, record):
+    """Add the stack of a record (see :func:`_capture_stack`) to a GELF message."""
+    _capture_stack(record)
+    msg['_python_stack_fingerprint'] = record.python_stack_fingerprint
+    msg['_python_stack_count'] = record.python_stack_count
+    stack = getattr(record, 'python_stack', None)
+    if stack is not None:
+        msg['_python_stack'] = stack
+
+
+class LazyHandler(logging.Handler):
+    """A stand-in for a handler which is expensive to construct.
+
+    :param factory: A callable which returns the real handler.
+    :param int level: The level of this stand-in; records below it never
+        cause the real handler to be constructed.
+
+    The real handler (and anything it imports) is constructed when the first
+    record reaches this stand-in. If that fails, a warning is issued once and
+    all records are dropped.
+
+    """
+
+    def __init__(self, factory, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.factory = factory
+        self._handler = None
+        self._failed = False
+        self._building = False
+
+    @property
+    def handler(self):
+        """The real handler, or ``None`` if it could not be constructed."""
+        if self._handler is None and not self._failed:
+            # Threads racing for the first record must not each construct one
+            # (e.g. a GELF handler would leak its socket and thread). The lock
+            # is reentrant, so anything the factory logs is dropped.
+            self.acquire()
+            try:
+                if self._handler is None and not self._failed and not self._building:
+                    self._building = True
+                    try:
+                        self._handler = self.factory()
+                    except Exception:
+                        self._failed = True
+                        warnings.warn('Error while constructing log handler:\n%s' % traceback.format_exc().rstrip())
+                    finally:
+                        self._building = False
+            finally:
+                self.release()
+        return self._handler
+
+    def emit(self, record):
+        handler = self.handler
+        if handler is not None and record.levelno >= handler.level:
+            handler.handle(record)
+
+    def prepare(self, record):
+        if record.levelno >= self.level:
+            handler = self.handler
+            prepare = getattr(handler, 'prepare', None)
+            if prepare is not None and record.levelno >= handler.level:
+                prepare(record)
+
+    def flush(self):
+        if self._handler is not None:
+            self._handler.flush()
+
+    def close(self):
+        if self._handler is not None:
+            self._handler.close()
+        logging.Handler.close(self)
+
+
+def _parse_graylog_addr(addr):
+    host, port = addr.rsplit(':', 1)
+    if not host:
+        raise ValueError('missing host')
+    return host, int(port)
+
+
+def _graylog_factory(host, port):
+    def factory():
+        from sitetools.gelf import GELFHandler
+        handler = GELFHandler.from_environ(host, port)
+        handler.setLevel(logging.INFO)
+        if os.environ.get('SITETOOLS_LOG_FORMAT') == 'json':
+            context = _get_context()
+            handler.fields = {'_login': context['login'], '_ip': context['ip']}
+            handler.setFormatter(logging.Formatter('%(message)s'))
+        else:
+            handler.setFormatter(logging.Formatter('%(levelname)8s %(name)s: %(message)s'))
+        return handler
+    return factory
+
+
+def _check_sentry_dsn(dsn):
+    """Check the general shape of a Sentry DSN without importing raven."""
+    parts = urlparse.urlsplit(dsn)
+    if not parts.scheme or not parts.hostname:
+        raise ValueError('missing scheme or host')
+    if not parts.username:
+        raise ValueError('missing public key')
+    if not parts.path.strip('/'):
+        raise ValueError('missing project')
+
+
+def _sentry_factory(dsn):
+    def factory():
+        from raven import Client
+        from raven.handlers.logging import SentryHandler
+        if not hasattr(sys, 'argv'):
+            sys.argv = ['<startup>']
+        return SentryHandler(Client(dsn))
+    return factory
+
+
 def _patch_file_handler():
 
     # Older than 2.6.2, the "delay" kwarg to a FileHandler would result
@@ -237,8 +754,7 @@ def _setup():
     root = logging.getLogger()
     root.setLevel(level)
     handler = logging.StreamHandler(_FileSafetyWrapper(sys.stderr))
-    handler.setFormatter(logging.Formatter(FULL_FORMAT))
-    handler.addFilter(ContextInfoFilter())
+    handler.setFormatter(_get_formatter())
     root.addHandler(handler)
 
     log.log(BLATHER, 'root logging setup')
@@ -281,57 +797,44 @@ def _setup():
     # Setup logging to a file, if requested.
     pattern = os.environ.get('SITETOOLS_LOG_FILE')
     if pattern:
-        handler = PatternedFileHandler(pattern, delay=True)
+        spool_dir = os.environ.get('SITETOOLS_LOG_SPOOL')
+        if spool_dir:
+            from sitetools.logspool import SpooledFileHandler
+            handler = SpooledFileHandler.from_environ(pattern, spool_dir)
+        else:
+            handler = PatternedFileHandler(pattern, delay=True)
         handler.setLevel(logging.INFO)
-        handler.setFormatter(logging.Formatter(FULL_FORMAT))
-        handler.addFilter(ContextInfoFilter())
+        handler.setFormatter(_get_formatter())
         logging.getLogger().addHandler(handler)
         
-    # Log to Graylog
-    hostname = socket.gethostname()
-    class GraylogHandler(logging.handlers.DatagramHandler):
-        def makePickle(self, record):
-            
-            msg = dict(
-                version='1.1',
-                host=hostname,
-                short_message=self.format(record),
-                _application='python.logging',
-                _pid=record.process,
-                _python_log_name=record.name,
-                _python_log_levelno=record.levelno,
-                _python_log_levelname=record.levelname,
-            )
-
-            # For error and above, we would like a traceback.
-            if record.levelno >= logging.ERROR:
-                # Find the root of the stack trace in which we have left
-                # the logging package.
-                frame = sys._getframe(1)
-                while frame.f_back and (frame.f_globals.get('__package__') or '').startswith('logging'):
-                    frame = frame.f_back
-                msg['_python_stack'] = ''.join(traceback.format_stack(frame))
-
-            return json.dumps(msg)
-    
-
+    # Log to Graylog and Sentry; these are only constructed if something is
+    # actually logged to them, but their configuration is checked now.
     graylog_addr = os.environ.get('GRAYLOG')
     if graylog_addr:
-        host, port = graylog_addr.split(':')
-        handler = GraylogHandler(host, int(port)) # DNS lookup was rediculous.
-        handler.setLevel(logging.INFO)
-        handler.setFormatter(logging.Formatter('%(levelname)8s %(name)s: %(message)s'))
-        root.addHandler(handler)
+        try:
+            host, port = _parse_graylog_addr(graylog_addr)
+        except ValueError as e:
+            log.error('invalid GRAYLOG %r: %s', graylog_addr, e)
+        else:
+            root.addHandler(LazyHandler(_graylog_factory(host, port), level=logging.INFO))
 
     sentry_dsn = os.environ.get('PYTHONSENTRYDSN')
     if sentry_dsn:
-        from raven import Client
-        from raven.handlers.logging import SentryHandler
-        if not hasattr(sys, 'argv'):
-            sys.argv = ['<startup>']
-        sentry_client = Client(sentry_dsn)
-        sentry_handler = SentryHandler(sentry_client)
-        logging.getLogger().addHandler(sentry_handler)
+        try:
+            _check_sentry_dsn(sentry_dsn)
+        except ValueError as e:
+            log.error('invalid PYTHONSENTRYDSN %r: %s', sentry_dsn, e)
+        else:
+            root.addHandler(LazyHandler(_sentry_factory(sentry_dsn)))
+
+    # Move all of the above to a background thread, if requested.
+    from sitetools import logqueue
+    logqueue._install(root)
+
+    # Limit log storms, if requested. This is last so that suppressed records
+    # are dropped before they reach the queue.
+    from sitetools import ratelimit
+    ratelimit._install(root)
 
 
 def _setup_maya():
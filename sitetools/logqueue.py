@@ -0,0 +1,286 @@
+"""
+
+Normally every handler writes on the thread which logged the record, so when
+the network filesystem stalls, so does every thread which logs anything. In
+queue mode, the root logger instead hands each record to a bounded in-memory
+queue, and a background thread passes them on to the real handlers.
+
+What happens when the queue is full is configurable:
+
+- ``block``: wait for space (the default; nothing is lost, but a stalled
+  handler can still stall the logging thread once the queue fills);
+- ``drop-oldest``: discard the oldest queued record to make space;
+- ``drop-new``: discard the new record.
+
+Dropped records are counted (in :attr:`QueueHandler.dropped`), and a warning
+with the count is passed to the real handlers when the queue is closed. The
+queue is flushed at exit (for at most :attr:`QueueHandler.flush_timeout`
+seconds), and is started afresh in a child after a ``fork()``, leaving any
+records still queued by the parent to the parent.
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_LOG_QUEUE
+
+    Set to ``block``, ``drop-oldest``, or ``drop-new`` to log via a
+    :class:`QueueHandler` with that overflow behaviour.
+
+.. envvar:: SITETOOLS_LOG_QUEUE_SIZE
+
+    The maximum number of queued records; defaults to 10000.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import collections
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+#: The valid overflow behaviours.
+OVERFLOW_POLICIES = ('block', 'drop-oldest', 'drop-new')
+
+
+class QueueHandler(logging.Handler):
+    """A handler which queues records for other handlers on a background thread.
+
+    :param list handlers: The real handlers.
+    :param int maxsize: The maximum number of queued records.
+    :param str overflow: What to do when the queue is full; one of
+        :data:`OVERFLOW_POLICIES`.
+
+    Handlers which have a ``prepare(record)`` method have it called on the
+    logging thread before the record is queued, for anything which must be
+    captured there (e.g. the stack).
+
+    .. attribute:: dropped
+
+        The number of records dropped since the queue started.
+
+    .. attribute:: handled
+
+        The number of records passed to the real handlers.
+
+    """
+
+    #: The maximum number of seconds :meth:`flush` waits for.
+    flush_timeout = 5.0
+
+    def __init__(self, handlers, maxsize=10000, overflow='block'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('overflow must be one of %s; got %r' % (', '.join(OVERFLOW_POLICIES), overflow))
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._formatter = logging.Formatter()
+        self._closed = False
+        self._start()
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._queue = collections.deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._unfinished = 0
+        self._stopping = False
+        self.dropped = 0
+        self.handled = 0
+        self._thread = threading.Thread(target=self._run, name='sitetools.logqueue')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _after_fork(self):
+
+        # The parent's thread does not exist here, and it may have held any of
+        # the real handlers' locks (or our own) when we forked.
+        self.createLock()
+        for handler in self.handlers:
+            handler.createLock()
+        self._start()
+
+    def prepare(self, record):
+        """Capture everything about a record which may change once we return."""
+
+        # Merge the arguments now, since they may be mutated later.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._formatter.formatException(record.exc_info)
+
+        for handler in self.handlers:
+            prepare = getattr(handler, 'prepare', None)
+            if prepare is not None:
+                prepare(record)
+
+    def handle(self, record):
+        """Filter and emit a record, without holding our lock.
+
+        Unlike other handlers, we may wait (for space in the queue) while
+        emitting, and the thread which makes that space may itself need to log
+        through us; holding the lock would deadlock the two. The queue has its
+        own locking.
+
+        """
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+
+        if self._closed:
+            return
+        if self._pid != os.getpid():
+            self._after_fork()
+
+        # Anything logged by the handlers themselves is handled directly, since
+        # waiting on our own queue would never end.
+        if threading.current_thread() is self._thread:
+            self._handle(record)
+            return
+
+        try:
+            self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        with self._cond:
+
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == 'drop-new':
+                    self.dropped += 1
+                    return
+                elif self.overflow == 'drop-oldest':
+                    self._queue.popleft()
+                    self._unfinished -= 1
+                    self.dropped += 1
+                else:
+                    while len(self._queue) >= self.maxsize and self._thread.is_alive():
+                        self._cond.wait()
+
+            self._queue.append(record)
+            self._unfinished += 1
+            self._cond.notify_all()
+
+    def _handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+    def _run(self):
+        cond = self._cond
+        queue = self._queue
+        while True:
+
+            with cond:
+                while not queue and not self._stopping:
+                    cond.wait()
+                if not queue:
+                    return
+                batch = list(queue)
+                queue.clear()
+                # There is space again.
+                cond.notify_all()
+
+            for record in batch:
+                self._handle(record)
+
+            with cond:
+                self.handled += len(batch)
+                self._unfinished -= len(batch)
+                cond.notify_all()
+
+    def flush(self):
+        """Wait for every queued record to be handled, and flush the real handlers."""
+
+        if self._pid != os.getpid():
+            return
+
+        deadline = time.time() + self.flush_timeout
+        with self._cond:
+            while self._unfinished > 0 and self._thread.is_alive():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+
+    def close(self):
+        """Flush, stop the thread, and close the real handlers."""
+
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._pid == os.getpid():
+            self.flush()
+            with self._cond:
+                self._stopping = True
+                self._cond.notify_all()
+            self._thread.join(self.flush_timeout)
+
+        if self.dropped:
+            self._handle(logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                'dropped %d log records due to a full queue', (self.dropped, ), None,
+            ))
+
+        for handler in self.handlers:
+            try:
+                handler.flush()
+                handler.close()
+            except Exception:
+                pass
+
+        logging.Handler.close(self)
+
+
+def _install(root=None):
+    """Move all of the root handlers behind a :class:`QueueHandler`, if
+    requested by :envvar:`SITETOOLS_LOG_QUEUE`.
+
+    :returns: The :class:`QueueHandler`, or ``None``.
+
+    """
+
+    overflow = os.environ.get('SITETOOLS_LOG_QUEUE')
+    if not overflow:
+        return
+
+    if overflow not in OVERFLOW_POLICIES:
+        log.error('invalid SITETOOLS_LOG_QUEUE %r; expected one of %s', overflow, ', '.join(OVERFLOW_POLICIES))
+        return
+
+    try:
+        maxsize = int(os.environ.get('SITETOOLS_LOG_QUEUE_SIZE') or 10000)
+    except ValueError:
+        log.error('SITETOOLS_LOG_QUEUE_SIZE must be an integer; got %r', os.environ['SITETOOLS_LOG_QUEUE_SIZE'])
+        maxsize = 10000
+
+    root = root or logging.getLogger()
+    handlers = list(root.handlers)
+    handler = QueueHandler(handlers, maxsize, overflow)
+    for x in handlers:
+        root.removeHandler(x)
+    root.addHandler(handler)
+    return handler
@@ -0,0 +1,509 @@
+"""
+
+Finding the logs of one process within the tree written by
+:envvar:`SITETOOLS_LOG_FILE` (e.g.
+``/Volumes/VFX/logs/{date}/{login}@{ip}/{time}.{pid}.log``) normally means
+walking the whole tree over the network. This module keeps an index of that
+tree, and uses it to find and read logs::
+
+    $ python -m sitetools.logs find --since 2013-01-20 --login mboers
+    $ python -m sitetools.logs cat --date 2013-01-22 --ip 10.2.200.1 --level ERROR
+
+The index records the listing (and modification time) of every directory,
+and the size and modification time of every log. Updating it re-lists only
+the directories which have changed, and re-stats only the logs within those
+and the logs which were still being written to a day ago. Directories which
+a query rules out (e.g. by ``--since``) are never visited at all. The highest
+level logged within each file is also recorded, but only worked out the first
+time a query asks for a ``--level``.
+
+``cat`` streams the matching records from every matching log (including
+rotated and compressed ones from :mod:`sitetools.logspool`, and JSON ones from
+:class:`~sitetools.logging.JSONFormatter`) in timestamp order. Logs are read
+incrementally and merged via a heap, and each log is only opened once the
+merge reaches the time its process started.
+
+The index is kept within :envvar:`SITETOOLS_CACHE_DIR` unless another path is
+given via ``--index``; without either, the tree is walked afresh every time.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import string
+import time
+
+from sitetools import cache
+from sitetools.utils import encode_strings
+
+log = logging.getLogger(__name__)
+
+
+#: The pattern to use when :envvar:`SITETOOLS_LOG_FILE` is not set.
+DEFAULT_PATTERN = '/Volumes/VFX/logs/{date}/{login}@{ip}/{time}.{pid}.log'
+
+#: The format of indexes written by this version of sitetools.
+INDEX_FORMAT = 1
+
+#: Logs modified this recently (in seconds) may still be growing, so are
+#: always re-stat-ed when updating the index.
+active_age = 86400
+
+_field_patterns = {
+    'date': r'\d{4}-\d{2}-\d{2}',
+    'time': r'\d{2}-\d{2}-\d{2}',
+    'pid': r'\d+',
+    'login': r'[^/]+?',
+    'ip': r'[^/]+?',
+}
+
+_level_numbers = {
+    'CRITICAL': logging.CRITICAL,
+    'FATAL': logging.CRITICAL,
+    'ERROR': logging.ERROR,
+    'WARNING': logging.WARNING,
+    'WARN': logging.WARNING,
+    'INFO': logging.INFO,
+    'DEBUG': logging.DEBUG,
+    'TRACE': 5,
+    'BLATHER': 1,
+    'NOTSET': logging.NOTSET,
+}
+
+# As written by sitetools.logging.FULL_FORMAT.
+_text_record = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}) (\S+)@(\S+):(\d+) (\w+(?: \d+)?) (\S+): (.*)$'
+)
+
+
+def get_level_number(name):
+    """Get the number of a level by name (or as ``"Level N"``), or ``None``."""
+    level = _level_numbers.get(name.upper())
+    if level is None:
+        try:
+            level = int(name.split()[-1])
+        except (ValueError, IndexError):
+            pass
+    return level
+
+
+class LogTree(object):
+    """The tree of logs described by a pattern.
+
+    :param str pattern: A pattern as for :envvar:`SITETOOLS_LOG_FILE`;
+        defaults to that, or :data:`DEFAULT_PATTERN`.
+    :param str index_path: Where to keep the index; defaults to one within
+        :envvar:`SITETOOLS_CACHE_DIR`. If neither, nothing is kept.
+
+    """
+
+    def __init__(self, pattern=None, index_path=None):
+
+        self.pattern = pattern or os.environ.get('SITETOOLS_LOG_FILE') or DEFAULT_PATTERN
+
+        # The static part of the pattern, and a regex for each path component
+        # after that.
+        head = self.pattern.split('{', 1)[0]
+        self.root = os.path.dirname(head) if not head.endswith(os.sep) else head.rstrip(os.sep)
+        components = os.path.relpath(self.pattern, self.root).split(os.sep)
+        self._regexes = [self._compile(x, i == len(components) - 1) for i, x in enumerate(components)]
+
+        if index_path is None:
+            key = hashlib.sha1(self.pattern).hexdigest()[:16]
+            index_path = cache.get_cache_path('logs-%s.json' % key)
+        self.index_path = index_path
+        self._index = None
+
+    def _compile(self, component, is_file):
+        parts = []
+        for literal, field, _, _ in string.Formatter().parse(component):
+            parts.append(re.escape(literal))
+            if field is not None:
+                parts.append('(?P<%s>%s)' % (field, _field_patterns.get(field, r'[^/]+?')))
+        # Rotated (and compressed) segments from sitetools.logspool.
+        if is_file:
+            parts.append(r'(?:\.(?P<segment>\d+))?(?P<gz>\.gz)?')
+        return re.compile(''.join(parts) + '$')
+
+    def _load_index(self):
+
+        if self._index is not None:
+            return self._index
+
+        index = None
+        if self.index_path:
+            try:
+                with open(self.index_path) as fh:
+                    index = encode_strings(json.load(fh))
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    log.warning('could not read log index %s: %s', self.index_path, e)
+            except ValueError as e:
+                log.warning('corrupt log index %s: %s', self.index_path, e)
+
+        if not index or index.get('format') != INDEX_FORMAT or index.get('pattern') != self.pattern:
+            index = {'format': INDEX_FORMAT, 'pattern': self.pattern, 'dirs': {}}
+
+        self._index = index
+        return index
+
+    def save_index(self):
+        """Write the index (if it was loaded, and there is somewhere to put it)."""
+
+        if self._index is None or not self.index_path:
+            return
+
+        import tempfile
+
+        dir_path = os.path.dirname(self.index_path)
+        try:
+            if not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+            fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(self.index_path), dir=dir_path)
+        except OSError as e:
+            log.warning('could not write log index %s: %s', self.index_path, e)
+            return
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(self._index, fh, separators=(',', ':'), sort_keys=True)
+            os.rename(tmp_path, self.index_path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    def find(self, since=None, until=None, level=None, **fields):
+        """Find every log matching the given criteria, updating the index as
+        it goes.
+
+        :param str since: The first ``date`` to include, e.g. ``"2013-01-20"``.
+        :param str until: The last ``date`` to include.
+        :param int level: Only logs with a record at or above this level.
+        :param fields: Required values of other fields, e.g. ``login="mboers"``.
+        :returns: A list of :class:`LogFile`, sorted by start time.
+
+        """
+
+        fields = dict((k, str(v)) for k, v in fields.iteritems() if v is not None)
+        index = self._load_index()
+        now = time.time()
+
+        def accept(values):
+            date = values.get('date')
+            if date is not None:
+                if since and date < since:
+                    return False
+                if until and date > until:
+                    return False
+            for name, value in values.iteritems():
+                expected = fields.get(name)
+                if expected is not None and value != expected:
+                    return False
+            return True
+
+        found = []
+        self._walk(index, '', 0, {}, accept, now, found)
+
+        if level is not None:
+            found = [x for x in found if x.get_max_level() >= level]
+
+        found.sort(key=lambda x: (x.start_time, x.fields.get('pid'), x.segment))
+        return found
+
+    def _walk(self, index, rel_dir, depth, values, accept, now, found):
+
+        abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        dirs = index['dirs']
+        try:
+            mtime = os.stat(abs_dir).st_mtime
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                log.warning('could not stat %s: %s', abs_dir, e)
+            self._forget(rel_dir)
+            return
+
+        is_leaf = depth == len(self._regexes) - 1
+        regex = self._regexes[depth]
+
+        entry = dirs.get(rel_dir)
+        changed = entry is None or entry['mtime'] != mtime
+        if changed:
+            try:
+                names = os.listdir(abs_dir)
+            except OSError as e:
+                if e.errno != errno.ENOTDIR:
+                    log.warning('could not list %s: %s', abs_dir, e)
+                return
+            old = entry['entries'] if entry else {}
+            entries = dict((name, old.get(name)) for name in names if regex.match(name))
+            for name in old:
+                if name not in entries and not is_leaf:
+                    self._forget(os.path.join(rel_dir, name))
+            entry = dirs[rel_dir] = {'mtime': mtime, 'entries': entries}
+
+        entries = entry['entries']
+        for name in sorted(entries):
+
+            m = regex.match(name)
+            child_values = dict(values)
+            child_values.update((k, v) for k, v in m.groupdict().iteritems() if k not in ('segment', 'gz'))
+            if not accept(child_values):
+                continue
+
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if not is_leaf:
+                self._walk(index, rel_path, depth + 1, child_values, accept, now, found)
+                continue
+
+            stat = entries[name]
+            if stat is None or changed or now - stat[1] < active_age:
+                try:
+                    st = os.stat(os.path.join(self.root, rel_path))
+                except OSError:
+                    entries.pop(name, None)
+                    continue
+                if stat is None or stat[0] != st.st_size or stat[1] != st.st_mtime:
+                    stat = entries[name] = [st.st_size, st.st_mtime, None]
+
+            found.append(LogFile(os.path.join(self.root, rel_path), child_values,
+                int(m.group('segment') or 0), bool(m.group('gz')), stat))
+
+    def _forget(self, rel_dir):
+        dirs = self._load_index()['dirs']
+        if not rel_dir:
+            dirs.clear()
+            return
+        prefix = rel_dir + os.sep
+        for key in [k for k in dirs if k == rel_dir or k.startswith(prefix)]:
+            del dirs[key]
+
+
+class LogFile(object):
+    """A single log (or segment of one) within a :class:`LogTree`.
+
+    .. attribute:: fields
+
+        The values of the fields in its path, e.g. ``{'pid': '12345', ...}``.
+
+    """
+
+    def __init__(self, path, fields, segment, compressed, stat):
+        self.path = path
+        self.fields = fields
+        self.segment = segment
+        self.compressed = compressed
+        self._stat = stat
+
+    def __repr__(self):
+        return '<LogFile %s>' % self.path
+
+    @property
+    def start_time(self):
+        """When the process started, according to the path (or 0 if unknown)."""
+        date = self.fields.get('date')
+        if not date:
+            return 0
+        clock = self.fields.get('time') or '00-00-00'
+        return time.mktime(time.strptime('%s %s' % (date, clock), '%Y-%m-%d %H-%M-%S'))
+
+    def open(self):
+        if self.compressed:
+            import gzip
+            return gzip.open(self.path, 'rb')
+        return open(self.path, 'rb')
+
+    def iter_records(self, level=None):
+        """Yield every record (see :func:`parse_records`) within this log."""
+        with self.open() as fh:
+            for record in parse_records(fh, level):
+                record['path'] = self.path
+                yield record
+
+    def get_max_level(self):
+        """The highest level logged, which is stored in the index."""
+        if self._stat[2] is None:
+            max_level = -1
+            try:
+                for record in self.iter_records():
+                    max_level = max(max_level, record['levelno'])
+            except IOError as e:
+                log.warning('could not read %s: %s', self.path, e)
+                return max_level
+            self._stat[2] = max_level
+        return self._stat[2]
+
+
+def parse_records(lines, level=None):
+    """Parse records written via :data:`~sitetools.logging.FULL_FORMAT` or
+    :class:`~sitetools.logging.JSONFormatter` from an iterable of lines.
+
+    Yields dicts with ``time`` (seconds since the epoch), ``level``,
+    ``levelno``, ``logger``, ``message``, ``login``, ``ip``, ``pid``, and
+    ``raw`` (the original text). Lines which do not start a record (e.g.
+    tracebacks) are added to the previous one.
+
+    :param int level: Only yield records at or above this level.
+
+    """
+
+    record = None
+    last_stamp = last_time = None
+    for line in lines:
+
+        if line.startswith('{'):
+            try:
+                data = json.loads(line)
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and 'time' in data:
+                if record is not None and (level is None or record['levelno'] >= level):
+                    yield record
+                levelname = data.get('level') or 'NOTSET'
+                record = {
+                    'time': data['time'],
+                    'level': levelname,
+                    'levelno': get_level_number(levelname) or 0,
+                    'logger': data.get('logger'),
+                    'message': data.get('message'),
+                    'login': data.get('login'),
+                    'ip': data.get('ip'),
+                    'pid': data.get('pid'),
+                    'raw': line,
+                }
+                continue
+
+        m = _text_record.match(line.rstrip('\n'))
+        if m is None:
+            if record is not None:
+                record['message'] += '\n' + line.rstrip('\n')
+                record['raw'] += line
+            continue
+
+        if record is not None and (level is None or record['levelno'] >= level):
+            yield record
+
+        stamp, millis, login, ip, pid, levelname, logger, message = m.groups()
+        if stamp != last_stamp:
+            last_stamp = stamp
+            last_time = time.mktime(time.strptime(stamp, '%Y-%m-%d %H:%M:%S'))
+        record = {
+            'time': last_time + int(millis) / 1000.0,
+            'level': levelname,
+            'levelno': get_level_number(levelname) or 0,
+            'logger': logger,
+            'message': message,
+            'login': login,
+            'ip': ip,
+            'pid': int(pid),
+            'raw': line,
+        }
+
+    if record is not None and (level is None or record['levelno'] >= level):
+        yield record
+
+
+def merge_records(log_files, level=None):
+    """Yield every record from many logs, in timestamp order.
+
+    Each log is only opened once every record before its start time (see
+    :attr:`LogFile.start_time`) has been yielded, so only the logs of
+    overlapping processes are open at once.
+
+    """
+
+    pending = sorted(log_files, key=lambda x: x.start_time, reverse=True)
+    heap = []
+    counter = 0
+
+    while heap or pending:
+
+        # Open every log which may have a record before the next one.
+        while pending and (not heap or pending[-1].start_time <= heap[0][0]):
+            records = pending.pop().iter_records(level)
+            for record in records:
+                counter += 1
+                heapq.heappush(heap, (record['time'], counter, record, records))
+                break
+
+        if not heap:
+            continue
+
+        _, _, record, records = heapq.heappop(heap)
+        yield record
+        for record in records:
+            counter += 1
+            heapq.heappush(heap, (record['time'], counter, record, records))
+            break
+
+
+def main(argv=None):
+
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(prog='python -m sitetools.logs')
+    parser.add_argument('--pattern', help='defaults to SITETOOLS_LOG_FILE')
+    parser.add_argument('--index', help='defaults to one within SITETOOLS_CACHE_DIR')
+    commands = parser.add_subparsers(dest='command')
+
+    def add_query_args(command):
+        command.add_argument('--since', metavar='DATE', help='first date, e.g. 2013-01-20')
+        command.add_argument('--until', metavar='DATE', help='last date')
+        command.add_argument('--date', help='a single date')
+        command.add_argument('--login')
+        command.add_argument('--ip')
+        command.add_argument('--pid', type=int)
+        command.add_argument('--level', help='minimum level, e.g. ERROR')
+
+    add_query_args(commands.add_parser('index', help='update the index'))
+    add_query_args(commands.add_parser('find', help='print the paths of matching logs'))
+    add_query_args(commands.add_parser('cat', help='print matching records in timestamp order'))
+
+    args = parser.parse_args(argv)
+
+    level = None
+    if args.level:
+        level = get_level_number(args.level)
+        if level is None:
+            parser.error('unknown level %r' % args.level)
+
+    since = args.date or args.since
+    until = args.date or args.until
+
+    tree = LogTree(args.pattern, args.index)
+    try:
+        # Only prune by level (which may read the logs to fill in the index)
+        # when not about to read them anyway.
+        files = tree.find(since, until, level if args.command != 'cat' else None,
+            login=args.login, ip=args.ip, pid=args.pid)
+    finally:
+        tree.save_index()
+
+    if args.command == 'index':
+        print '%d logs indexed' % len(files)
+
+    elif args.command == 'find':
+        for log_file in files:
+            print log_file.path
+
+    else:
+        try:
+            for record in merge_records(files, level):
+                sys.stdout.write(record['raw'] if record['raw'].endswith('\n') else record['raw'] + '\n')
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,491 @@
+"""
+
+Normally :class:`~sitetools.logging.PatternedFileHandler` writes (and flushes)
+every record straight to the network filesystem, into a file which grows
+without limit. In spool mode, records are instead:
+
+1. buffered in memory, until :attr:`SpooledFileHandler.flush_size` bytes have
+   accumulated, the oldest has waited :attr:`SpooledFileHandler.flush_interval`
+   seconds, something at ``ERROR`` or above is logged, or the process exits;
+2. written to a segment on local disk within :envvar:`SITETOOLS_LOG_SPOOL`,
+   which is rotated once it reaches :envvar:`SITETOOLS_LOG_MAX_BYTES`;
+3. moved by a background thread to the path given by
+   :envvar:`SITETOOLS_LOG_FILE` once finished (i.e. rotated, or at exit).
+
+The first segment is moved to that path, and later segments to that path plus
+``.1``, ``.2``, etc.. Rotated segments may be gzipped on their way (adding
+``.gz``); the last segment is not, so that exit stays quick.
+
+Each segment is locked while its process is using it, and its destination is
+recorded next to it (in the same name plus ``.target``). Segments left behind
+by processes which died (or could not be moved) are moved to that destination
+by the next process to log via the same spool.
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_LOG_SPOOL
+
+    A directory on local disk (e.g. ``/var/tmp/sitetools-logs``) to spool log
+    files in before moving them to :envvar:`SITETOOLS_LOG_FILE`. If unset, log
+    files are written directly.
+
+.. envvar:: SITETOOLS_LOG_MAX_BYTES
+
+    The size at which to rotate spooled log files; defaults to 64MB.
+
+.. envvar:: SITETOOLS_LOG_COMPRESS
+
+    Set to ``"1"`` to gzip rotated log files.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import collections
+import errno
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import warnings
+
+from sitetools.logging import _get_log_path, _make_log_dir
+
+log = logging.getLogger(__name__)
+
+
+# Spooled segments are named after their destination, plus this.
+_spool_suffix = '.%d.spool'
+_spool_suffix_pattern = re.compile(r'\.\d+\.spool$')
+
+# The destination of each segment is recorded in its name plus this.
+_target_suffix = '.target'
+
+
+def _lock(fh):
+    """Lock an open file, returning if we got the lock."""
+    import fcntl
+    try:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return False
+    return True
+
+
+def _move(fh, spool_path, target, compress=False):
+    """Copy a spooled segment to its destination, and remove it.
+
+    :param fh: The open (and locked) segment, which is closed when done.
+    :param str spool_path: The path of the segment.
+    :param str target: The path to move it to.
+    :param bool compress: Gzip the segment (and add ``.gz`` to the target).
+    :returns: If it was moved.
+
+    """
+
+    import tempfile
+
+    if compress:
+        target += '.gz'
+
+    try:
+
+        dir_path = os.path.dirname(target)
+        if not _make_log_dir(dir_path):
+            return False
+
+        fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(target), dir=dir_path)
+        try:
+            with os.fdopen(fd, 'wb') as dst, open(spool_path, 'rb') as src:
+                if compress:
+                    import gzip
+                    with gzip.GzipFile(os.path.basename(target)[:-3], 'wb', fileobj=dst) as gz:
+                        shutil.copyfileobj(src, gz)
+                else:
+                    shutil.copyfileobj(src, dst)
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, target)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+        os.unlink(spool_path)
+        try:
+            os.unlink(spool_path + _target_suffix)
+        except OSError:
+            pass
+
+    except (IOError, OSError) as e:
+        warnings.warn('Error while moving log file %s to %s: %r' % (spool_path, target, e))
+        return False
+
+    finally:
+        fh.close()
+
+    return True
+
+
+def _prune_dirs(dir_path, root):
+    """Remove empty directories from ``dir_path`` up to (but not including) ``root``."""
+    while dir_path.startswith(root + os.sep):
+        try:
+            os.rmdir(dir_path)
+        except OSError:
+            return
+        dir_path = os.path.dirname(dir_path)
+
+
+def _read_target(spool_path):
+    """Read the recorded destination of a segment, or ``None``."""
+    try:
+        with open(spool_path + _target_suffix) as fh:
+            return fh.read() or None
+    except IOError:
+        return None
+
+
+def recover(spool_dir):
+    """Move every segment within a spool which no process is using.
+
+    :returns: The number of segments moved.
+
+    """
+
+    moved = 0
+    for dir_path, dir_names, file_names in os.walk(spool_dir):
+        for file_name in file_names:
+
+            # A process may have died between moving a segment and removing
+            # its recorded target.
+            if file_name.endswith(_target_suffix):
+                spool_path = os.path.join(dir_path, file_name[:-len(_target_suffix)])
+                if not os.path.exists(spool_path):
+                    try:
+                        os.unlink(spool_path + _target_suffix)
+                    except OSError:
+                        pass
+                    else:
+                        _prune_dirs(dir_path, spool_dir)
+                continue
+
+            if not _spool_suffix_pattern.search(file_name):
+                continue
+            spool_path = os.path.join(dir_path, file_name)
+
+            try:
+                fh = open(spool_path, 'rb')
+            except IOError:
+                continue
+            try:
+                # It may have been moved (and replaced) while we were locking it.
+                if not _lock(fh) or os.fstat(fh.fileno()).st_ino != os.stat(spool_path).st_ino:
+                    fh.close()
+                    continue
+            except (IOError, OSError):
+                fh.close()
+                continue
+
+            # The spool's layout only mirrors absolute destinations, so we
+            # only fall back to it if the process died before recording one.
+            target = _read_target(spool_path)
+            if target is None:
+                rel_path = os.path.relpath(spool_path, spool_dir)
+                target = os.sep + _spool_suffix_pattern.sub('', rel_path)
+            log.log(5, 'recovering log file %s', target)
+            if _move(fh, spool_path, target):
+                _prune_dirs(dir_path, spool_dir)
+                moved += 1
+
+    return moved
+
+
+class SpooledFileHandler(logging.Handler):
+    """A handler which buffers records into rotating files on local disk,
+    and moves those files to their final path in the background.
+
+    :param str pattern: The final path, as for :envvar:`SITETOOLS_LOG_FILE`.
+    :param str spool_dir: The local directory to write into.
+    :param int max_bytes: The size to rotate at.
+    :param bool compress: Gzip rotated segments.
+
+    .. attribute:: moved
+
+        The number of segments moved so far.
+
+    """
+
+    #: Write the buffer once it is this many bytes.
+    flush_size = 64 * 1024
+
+    #: Write the buffer once the oldest record in it is this many seconds old.
+    flush_interval = 5.0
+
+    #: The maximum number of seconds :meth:`close` waits for segments to be moved.
+    close_timeout = 30.0
+
+    def __init__(self, pattern, spool_dir, max_bytes=64 * 1024 * 1024, compress=False):
+        logging.Handler.__init__(self)
+        self.pattern = pattern
+        self.spool_dir = os.path.abspath(spool_dir)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.moved = 0
+        self._closed = False
+        self._start()
+
+    @classmethod
+    def from_environ(cls, pattern, spool_dir):
+        """Construct a handler configured by :envvar:`SITETOOLS_LOG_MAX_BYTES`
+        and :envvar:`SITETOOLS_LOG_COMPRESS`."""
+        kwargs = {'compress': os.environ.get('SITETOOLS_LOG_COMPRESS') == '1'}
+        raw = os.environ.get('SITETOOLS_LOG_MAX_BYTES')
+        if raw:
+            try:
+                kwargs['max_bytes'] = int(raw)
+            except ValueError:
+                log.error('invalid SITETOOLS_LOG_MAX_BYTES %r', raw)
+        return cls(pattern, spool_dir, **kwargs)
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._buffer = []
+        self._buffered = 0
+        self._oldest = None
+        self._target = None
+        self._segment = None
+        self._segment_size = 0
+        self._index = 0
+        self._pending = collections.deque()
+        self._moving = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._stopping = False
+
+        # The thread is only started by the first record, so that processes
+        # which log nothing pay nothing.
+        self._thread = None
+
+    def _start_thread(self):
+        self._thread = threading.Thread(target=self._run, name='sitetools.logspool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _after_fork(self):
+
+        # The parent's thread does not exist here, and it may have held our
+        # lock (or condition) when we forked.
+        self.createLock()
+
+        # Everything buffered or spooled so far belongs to the parent.
+        for fh in [self._segment[0]] if self._segment else []:
+            fh.close()
+        for fh, _, _, _ in self._pending:
+            fh.close()
+        self._start()
+
+    def handle(self, record):
+        # We must be reset after a fork before we take our lock; see above.
+        if self._pid != os.getpid():
+            self._after_fork()
+        return logging.Handler.handle(self, record)
+
+    def emit(self, record):
+
+        if self._closed:
+            return
+
+        try:
+            data = self.format(record) + '\n'
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+        except Exception:
+            self.handleError(record)
+            return
+
+        if self._thread is None:
+            self._start_thread()
+
+        if not self._buffer:
+            self._oldest = time.time()
+            with self._cond:
+                self._cond.notify_all()
+        self._buffer.append(data)
+        self._buffered += len(data)
+
+        if self._buffered >= self.flush_size or record.levelno >= logging.ERROR:
+            self._write()
+
+    def _write(self):
+        """Write the buffer into the current segment; call with the lock held."""
+
+        if not self._buffer:
+            return
+
+        data = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._oldest = None
+
+        try:
+            if self._segment is None:
+                self._open_segment()
+            fh = self._segment[0]
+            fh.write(data)
+            fh.flush()
+        except (IOError, OSError) as e:
+            print '# Error while writing log:', repr(e)
+            return
+
+        self._segment_size += len(data)
+        if self._segment_size >= self.max_bytes:
+            self._rotate(self.compress)
+
+    def _open_segment(self):
+
+        import tempfile
+
+        if self._target is None:
+            self._target = os.path.abspath(_get_log_path(self.pattern))
+
+        target = '%s.%d' % (self._target, self._index) if self._index else self._target
+        spool_path = os.path.join(self.spool_dir, target.lstrip(os.sep)) + _spool_suffix % self._pid
+
+        # Empty directories in the spool are removed as segments are moved, so
+        # this one may disappear before we get a file into it.
+        dir_path = os.path.dirname(spool_path)
+        for attempt in xrange(5):
+            try:
+                if not os.path.exists(dir_path):
+                    os.makedirs(dir_path)
+                fd, tmp_path = tempfile.mkstemp(prefix='.', dir=dir_path)
+                break
+            except OSError as e:
+                if e.errno not in (errno.EEXIST, errno.ENOENT) or attempt == 4:
+                    raise
+
+        # Lock it before giving it a name which recover() will look at.
+        fh = os.fdopen(fd, 'ab')
+        try:
+            _lock(fh)
+            os.rename(tmp_path, spool_path)
+        except:
+            fh.close()
+            os.unlink(tmp_path)
+            raise
+
+        try:
+            with open(spool_path + _target_suffix, 'w') as target_fh:
+                target_fh.write(target)
+        except IOError as e:
+            print '# Error while recording log target:', repr(e)
+
+        self._segment = (fh, spool_path, target)
+        self._segment_size = 0
+
+    def _rotate(self, compress):
+        """Hand the current segment to the thread; call with the lock held."""
+        fh, spool_path, target = self._segment
+        self._segment = None
+        self._index += 1
+        with self._cond:
+            self._pending.append((fh, spool_path, target, compress))
+            self._moving += 1
+            self._cond.notify_all()
+
+    def _wait(self):
+        """Wait (with the condition held) until there is something to do."""
+        while not self._pending and not self._stopping:
+            oldest = self._oldest
+            if oldest is None:
+                self._cond.wait()
+            else:
+                remaining = oldest + self.flush_interval - time.time()
+                if remaining <= 0:
+                    return
+                self._cond.wait(remaining)
+
+    def _run(self):
+
+        try:
+            self.moved += recover(self.spool_dir)
+        except Exception as e:
+            warnings.warn('Error while recovering log files: %r' % e)
+
+        cond = self._cond
+        while True:
+
+            with cond:
+                self._wait()
+                segments = list(self._pending)
+                self._pending.clear()
+                stopping = self._stopping
+
+            oldest = self._oldest
+            if oldest is not None and oldest + self.flush_interval <= time.time():
+                self.acquire()
+                try:
+                    self._write()
+                finally:
+                    self.release()
+
+            for fh, spool_path, target, compress in segments:
+                if _move(fh, spool_path, target, compress):
+                    _prune_dirs(os.path.dirname(spool_path), self.spool_dir)
+                    self.moved += 1
+
+            with cond:
+                self._moving -= len(segments)
+                cond.notify_all()
+
+            if stopping and not segments:
+                return
+
+    def flush(self):
+        """Write the buffer into the local spool."""
+        if self._pid != os.getpid():
+            return
+        self.acquire()
+        try:
+            self._write()
+        finally:
+            self.release()
+
+    def close(self):
+        """Write the buffer, and wait (for at most :attr:`close_timeout`) for
+        every segment to be moved."""
+
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._pid == os.getpid():
+
+            self.acquire()
+            try:
+                self._write()
+                if self._segment is not None:
+                    self._rotate(False)
+            finally:
+                self.release()
+
+            if self._thread is not None:
+                deadline = time.time() + self.close_timeout
+                with self._cond:
+                    self._stopping = True
+                    self._cond.notify_all()
+                    while self._moving > 0 and self._thread.is_alive():
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+
+        logging.Handler.close(self)
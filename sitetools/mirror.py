@@ -0,0 +1,390 @@
+"""
+
+Some sites are imported by every process on a host, in which case serving
+them from the network over and over wastes bandwidth and adds latency. This
+module mirrors selected sites to local disk the first time they are used, and
+points :data:`python:sys.path` at the local copy from then on.
+
+Each mirrored site must publish a manifest (a ``.sitemanifest`` file listing
+the size and modification time of every file), which is written as part of
+deployment with::
+
+    $ python -m sitetools.mirror manifest /path/to/site
+
+Checking a mirror then costs a single read of the manifest (whose hash
+identifies the version of the site) and a single stat of the local copy. Sites
+without a manifest are never mirrored.
+
+Every version of a site is copied into a temporary directory and then renamed
+into place, and is never modified afterwards. Processes which started with an
+older version keep using it, and it is removed a day after being superseded.
+
+Startup never waits for a copy. The first process to find a site without an
+up-to-date copy starts a detached ``python -m sitetools.mirror sync`` to make
+one, and it (and every other process) uses the site from its original location
+until the copy is done. Only one process on a host copies a site at a time.
+
+Relative paths in the ``*.pth`` files of a mirrored site are resolved against
+the original site (see :func:`resolve_pth_path`), so that those pointing
+outside of it (e.g. ``../shared``) still work.
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_MIRROR_SITES
+
+    A colon-delimited list of glob patterns of sites (after resolving
+    virtualenvs to their ``site-packages``) to mirror into
+    :envvar:`SITETOOLS_CACHE_DIR`. Has no effect unless that is also set.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import errno
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+from sitetools import cache
+from sitetools.utils import get_environ_list
+
+log = logging.getLogger(__name__)
+
+
+#: The name of the manifest within a site.
+MANIFEST_NAME = '.sitemanifest'
+
+#: How long (in seconds) to keep superseded copies of a site.
+prune_age = 86400
+
+# The original site of every copy returned by get_mirror, by path of the copy.
+_originals = {}
+
+# The path each site will be copied to, for those being copied in the
+# background (as far as we know).
+_pending = {}
+
+
+def get_patterns():
+    return [x for x in get_environ_list('SITETOOLS_MIRROR_SITES') if x]
+
+
+def is_enabled():
+    return bool(get_patterns()) and cache.get_cache_dir() is not None
+
+
+def build_manifest(site_path):
+    """Describe every file within a site.
+
+    :returns: A dict suitable for :func:`write_manifest`.
+
+    """
+
+    files = []
+    for dir_path, dir_names, file_names in os.walk(site_path):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            rel_path = os.path.relpath(path, site_path)
+            if rel_path == MANIFEST_NAME:
+                continue
+            st = os.lstat(path)
+            files.append([rel_path, st.st_size, st.st_mtime])
+
+    return {'format': 1, 'files': files}
+
+
+def write_manifest(site_path):
+    """Write the manifest of a site into that site, atomically.
+
+    :returns: The hash of the new manifest.
+
+    """
+
+    import tempfile
+
+    content = json.dumps(build_manifest(site_path), sort_keys=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.sitemanifest.', dir=site_path)
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, os.path.join(site_path, MANIFEST_NAME))
+    except:
+        os.unlink(tmp_path)
+        raise
+
+    return hashlib.sha1(content).hexdigest()
+
+
+def get_manifest_hash(site_path):
+    """Get the hash of the manifest of a site, or ``None`` if it has none."""
+    try:
+        with open(os.path.join(site_path, MANIFEST_NAME), 'rb') as fh:
+            return hashlib.sha1(fh.read()).hexdigest()
+    except IOError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            log.warning('could not read manifest of %s: %s', site_path, e)
+
+
+def get_mirror_root(site_path):
+    """Get the directory which holds every copy of the given site."""
+    site_path = os.path.abspath(site_path)
+    key = hashlib.sha1(site_path).hexdigest()[:16]
+    return cache.get_cache_path(os.path.join('mirrors', '%s-%s' % (os.path.basename(site_path), key)))
+
+
+def get_mirror(site_path, copy=True, wait=True):
+    """Get the local copy of the given site.
+
+    :param str site_path: The site to mirror.
+    :param bool copy: Copy the site if there is no up-to-date copy.
+    :param bool wait: Wait for that copy; otherwise it is made by a detached
+        process, and ``None`` is returned in the meantime.
+    :returns: The path to the copy, or ``None`` if there is none (e.g. the
+        site has no manifest, or another process is copying it).
+
+    """
+
+    path = _get_mirror(site_path, copy, wait)
+    if path is not None:
+        _originals[os.path.abspath(path)] = os.path.abspath(site_path)
+    return path
+
+
+def _get_mirror(site_path, copy, wait):
+
+    root = get_mirror_root(site_path)
+    if root is None:
+        return
+
+    digest = get_manifest_hash(site_path)
+    if digest is None:
+        log.log(5, 'not mirroring %s without a manifest', site_path)
+        return
+
+    version_path = os.path.join(root, digest[:16])
+    if os.path.exists(version_path):
+        return version_path
+
+    if copy and wait:
+        return _copy(site_path, root, version_path, digest)
+    elif copy:
+        _pending[site_path] = version_path
+        _spawn_copy(site_path, root)
+
+
+def _lock(site_path, root):
+    """Lock the copies of a site, returning the open lock file, or ``None`` if
+    another process holds it (or it could not be locked)."""
+
+    import fcntl
+
+    try:
+        os.makedirs(root)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            log.warning('could not create mirror directory %s: %s', root, e)
+            return
+
+    try:
+        lock = open(os.path.join(root, '.lock'), 'w')
+    except IOError as e:
+        log.warning('could not lock mirror directory %s: %s', root, e)
+        return
+
+    # Don't wait for another process; it is no worse to use the original.
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            log.log(5, 'another process is mirroring %s', site_path)
+        else:
+            log.warning('could not lock mirror directory %s: %s', root, e)
+        lock.close()
+        return
+
+    return lock
+
+
+def _spawn_copy(site_path, root):
+    """Copy a site in a detached process, unless one is already copying it."""
+
+    import subprocess
+
+    # Only a quick check, so that every process starting during a copy does
+    # not start another; the copying process takes the lock for itself.
+    lock = _lock(site_path, root)
+    if lock is None:
+        return
+    lock.close()
+
+    # The copying process must not start mirroring sites itself.
+    environ = dict(os.environ)
+    environ.pop('SITETOOLS_MIRROR_SITES', None)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cmd = [
+        sys.executable, '-c',
+        'import sys; sys.path.insert(0, sys.argv.pop(1)); from sitetools.mirror import main; main()',
+        package_root, 'sync', site_path,
+    ]
+
+    # Fork twice, so that the copying process is not our child and we need
+    # not wait for it.
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        log.info('mirroring %s in the background', site_path)
+        return
+    try:
+        os.setsid()
+        with open(os.devnull, 'r+') as devnull:
+            subprocess.Popen(cmd, env=environ, close_fds=True, stdin=devnull, stdout=devnull, stderr=devnull)
+    finally:
+        os._exit(0)
+
+
+def _copy(site_path, root, version_path, digest):
+
+    import tempfile
+
+    lock = _lock(site_path, root)
+    if lock is None:
+        return
+
+    try:
+
+        # It may have been finished while we were getting the lock.
+        if os.path.exists(version_path):
+            return version_path
+
+        start = time.time()
+        tmp_path = tempfile.mkdtemp(prefix='.tmp.', dir=root)
+        try:
+            shutil.copytree(site_path, os.path.join(tmp_path, 'site'), symlinks=True)
+
+            # Throw it away if the site changed while we were copying.
+            if get_manifest_hash(site_path) != digest:
+                log.info('%s changed while mirroring it', site_path)
+                return
+
+            os.rename(os.path.join(tmp_path, 'site'), version_path)
+
+            # Record when this copy was put into place, for pruning.
+            os.utime(version_path, None)
+
+        except (IOError, OSError, shutil.Error) as e:
+            log.warning('could not mirror %s: %s', site_path, e)
+            return
+
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        log.info('mirrored %s to %s in %.3fs', site_path, version_path, time.time() - start)
+        _prune(root, version_path)
+        return version_path
+
+    finally:
+        lock.close()
+
+
+def _prune(root, current):
+    """Remove copies which were superseded long enough ago."""
+
+    # The mtime of a copy is when it was put into place, which is when the
+    # copy before it was superseded.
+    versions = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith('.'):
+            continue
+        try:
+            versions.append((os.stat(path).st_mtime, path))
+        except OSError:
+            pass
+    versions.sort()
+
+    cutoff = time.time() - prune_age
+    for (_, path), (superseded, _) in zip(versions, versions[1:]):
+        if superseded < cutoff and path != current:
+            log.info('removing old mirror %s', path)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def mirror_sites(site_paths, patterns=None, wait=False):
+    """Substitute local copies for every selected site.
+
+    :param list site_paths: Site directories.
+    :param list patterns: Glob patterns of sites to mirror; defaults to
+        :envvar:`SITETOOLS_MIRROR_SITES`.
+    :param bool wait: Wait for sites to be copied, rather than using the
+        originals until they have been copied in the background.
+    :returns: A list of the same length as ``site_paths``.
+
+    """
+
+    patterns = get_patterns() if patterns is None else patterns
+    output = []
+    for site_path in site_paths:
+        if any(fnmatch.fnmatch(site_path, pattern) for pattern in patterns):
+            output.append(get_mirror(site_path, wait=wait) or site_path)
+        else:
+            output.append(site_path)
+    return output
+
+
+def resolve_pth_path(base, line):
+    """Resolve a path listed by a ``*.pth`` file within the directory ``base``.
+
+    If ``base`` is within a copy returned by :func:`get_mirror`, the path is
+    resolved against the original site instead, and is only within the copy if
+    it is within the site.
+
+    """
+
+    path = os.path.abspath(os.path.join(base, line))
+    for mirror_path, site_path in _originals.iteritems():
+        if base != mirror_path and not base.startswith(mirror_path + os.sep):
+            continue
+        path = os.path.abspath(os.path.join(site_path + base[len(mirror_path):], line))
+        if path == site_path or path.startswith(site_path + os.sep):
+            path = mirror_path + path[len(site_path):]
+        break
+    return path
+
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m sitetools.mirror')
+    commands = parser.add_subparsers(dest='command')
+
+    manifest_parser = commands.add_parser('manifest', help='write the manifest of sites')
+    manifest_parser.add_argument('sites', nargs='+')
+
+    sync_parser = commands.add_parser('sync', help='mirror sites now')
+    sync_parser.add_argument('sites', nargs='+')
+
+    args = parser.parse_args(argv)
+
+    for site_path in args.sites:
+        if args.command == 'manifest':
+            print '%s %s' % (write_manifest(site_path)[:16], site_path)
+        else:
+            print '%s -> %s' % (site_path, get_mirror(site_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,181 @@
+"""
+
+The platform specifiers which may be used within ``*.pth`` files (see
+:mod:`sitetools.sites`):
+
+- ``{basic_platform_spec}`` (or ``{platform_spec}``) is the same as distutils
+  uses, e.g. ``linux-x86_64-2.7``;
+- ``{extended_platform_spec}`` is a little more specific, as it allows us to
+  isolate the different versions of an OS, e.g. ``centos-7.9.2009-x86_64-2.7``.
+
+Working these out requires importing :mod:`python:distutils` and parsing files
+under ``/etc``, but the answer never changes for a given host and Python. So
+they are only computed the first time they are needed, are kept in a per-host
+cache within :envvar:`SITETOOLS_CACHE_DIR`, and are passed to subprocesses via
+:envvar:`SITETOOLS_PLATFORM_SPECS`.
+
+They were once module attributes, computed on import. ``basic_platform_spec``
+and ``extended_platform_spec`` may still be imported from this module, but are
+deprecated in favour of :func:`get_platform_specs` (and are worked out when
+first accessed).
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_PLATFORM_SPECS
+
+    Set by sitetools once the platform specifiers are known, so that
+    subprocesses need not work them out again. It is ignored by a process with
+    a different host or Python.
+
+
+API Reference
+-------------
+
+"""
+
 from __future__ import absolute_import
 
-import platform
+import hashlib
+import logging
+import os
 import sys
-from distutils.util import get_platform
+import types
+import warnings
+
+from sitetools import cache
+
+log = logging.getLogger(__name__)
+
+
+_specs = None
+_key = None
+
+
+def get_host_key():
+    """Get a short key identifying this host (and version of Python), which
+    determines the platform specifiers."""
+    global _key
+    if _key is None:
+        parts = os.uname() + (sys.executable, sys.version)
+        _key = hashlib.sha1('\0'.join(parts)).hexdigest()[:16]
+    return _key
+
+
+def _compute_platform_specs():
+
+    import platform
+    from distutils.util import get_platform
+
+    # This is the same as distutils uses.
+    basic_platform_spec = '%s-%s' % (get_platform(), sys.version[:3])
+
+    # extended_platform_spec is a little more platform specific as it allows us to isolate
+    # the different versions of Fedora we use.
+    _, _, _, _, machine, _ = platform.uname()
+    if sys.platform == 'darwin':
+        osx_v, _, _ = platform.mac_ver()
+        extended_platform_spec = 'macosx-%s-%s-%s' % ('.'.join(osx_v.split('.')[:2]), machine, sys.version[:3])
+    elif sys.platform.startswith('linux'):
+        name, version, nick = platform.linux_distribution()
+        extended_platform_spec = '%s-%s-%s-%s' % (name.lower(), version, machine, sys.version[:3])
+    else:
+        extended_platform_spec = basic_platform_spec
+
+    return {
+        'basic_platform_spec': basic_platform_spec,
+        'extended_platform_spec': extended_platform_spec,
+    }
+
+
+def _load_platform_specs():
+
+    key = get_host_key()
+
+    # From our parent.
+    raw = os.environ.get('SITETOOLS_PLATFORM_SPECS')
+    if raw:
+        parts = raw.split(':')
+        if len(parts) == 3 and parts[0] == key:
+            return {'basic_platform_spec': parts[1], 'extended_platform_spec': parts[2]}
+        log.log(5, 'ignoring SITETOOLS_PLATFORM_SPECS from another host')
+
+    # From a previous process on this host.
+    cache_name = 'platform-%s.json' % key
+    specs = cache.read_json(cache_name)
+    if specs and specs.get('key') == key:
+        del specs['key']
+        return specs
+
+    specs = _compute_platform_specs()
+    cache.write_json(cache_name, dict(specs, key=key))
+    return specs
+
+
+def get_platform_specs():
+    """Get a dict of every platform specifier, by name.
+
+    The specifiers are worked out (or loaded) on the first call, after which
+    they are also published to subprocesses via :envvar:`SITETOOLS_PLATFORM_SPECS`.
+
+    """
+
+    global _specs
+
+    if _specs is None:
+        specs = _load_platform_specs()
+        specs['platform_spec'] = specs['basic_platform_spec']
+        os.environ['SITETOOLS_PLATFORM_SPECS'] = '%s:%s:%s' % (
+            get_host_key(),
+            specs['basic_platform_spec'],
+            specs['extended_platform_spec'],
+        )
+        _specs = specs
+
+    return _specs
+
+
+def get_basic_platform_spec():
+    return get_platform_specs()['basic_platform_spec']
+
+
+def get_extended_platform_spec():
+    return get_platform_specs()['extended_platform_spec']
+
+
+# The module attributes which were once computed on import.
+_deprecated_attributes = ('basic_platform_spec', 'extended_platform_spec')
+
+
+class _Module(types.ModuleType):
+    """Stands in for this module within :data:`python:sys.modules`, so that the
+    deprecated attributes are only worked out when they are accessed.
+
+    Everything else is forwarded to the real module, which this also keeps
+    alive (as its globals would be cleared along with it).
+
+    """
+
+    def __init__(self, module):
+        types.ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__['_module'] = module
+
+    def __getattr__(self, name):
+        if name in _deprecated_attributes:
+            warnings.warn('sitetools.platform.%s is deprecated; use get_platform_specs()' % name,
+                DeprecationWarning, stacklevel=2)
+            return get_platform_specs()[name]
+        return getattr(self.__dict__['_module'], name)
+
+    def __setattr__(self, name, value):
+        setattr(self.__dict__['_module'], name, value)
 
+    def __delattr__(self, name):
+        delattr(self.__dict__['_module'], name)
 
-# This is the same as distutils uses.
-basic_platform_spec = '%s-%s' % (get_platform(), sys.version[:3])
+    def __dir__(self):
+        return dir(self.__dict__['_module'])
 
-# extended_platform_spec is a little more platform specific as it allows us to isolate
-# the different versions of Fedora we use.
-_, _, _, _, machine, _ = platform.uname()
-if sys.platform == 'darwin':
-    osx_v, _, _ = platform.mac_ver()
-    extended_platform_spec = 'macosx-%s-%s-%s' % ('.'.join(osx_v.split('.')[:2]), machine, sys.version[:3])
-elif sys.platform.startswith('linux'):
-    name, version, nick = platform.linux_distribution()
-    extended_platform_spec = '%s-%s-%s-%s' % (name.lower(), version, machine, sys.version[:3])
-else:
-    extended_platform_spec = basic_platform_spec
 
+sys.modules[__name__] = _Module(sys.modules[__name__])
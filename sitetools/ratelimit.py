@@ -0,0 +1,212 @@
+"""
+
+A misbehaving tool can log the same record millions of times, saturating
+stderr and the log files. When enabled, a :class:`RateLimitFilter` on the root
+handlers gives every call site (i.e. logger name, message template, file, and
+line) its own token bucket; records beyond the rate are dropped, and how many were dropped is
+logged every :attr:`RateLimitFilter.interval` seconds (and at exit).
+
+The filter decides once per record no matter how many handlers it is on, and
+costs a dictionary lookup and a little arithmetic per record.
+
+
+Environment Variables
+---------------------
+
+.. envvar:: SITETOOLS_LOG_RATE_LIMIT
+
+    ``rate[:burst[:interval]]``: the records per second allowed from each call
+    site, how many may be logged in a burst (defaults to 10 times the rate),
+    and how often (in seconds) to summarize suppressed records (defaults to
+    60). E.g.::
+
+        $ export SITETOOLS_LOG_RATE_LIMIT=10:100
+
+    allows bursts of 100 records, and 10 per second after that.
+
+
+API Reference
+-------------
+
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class RateLimitFilter(logging.Filter):
+    """A filter which limits how often each call site may log.
+
+    :param float rate: Records per second allowed from each call site.
+    :param float burst: The most records that may be logged at once; defaults
+        to 10 times the rate.
+    :param float interval: How often to log summaries of suppressed records.
+
+    The filter never raises; if anything goes wrong, the record is let through.
+
+    .. attribute:: suppressed
+
+        The total number of records suppressed.
+
+    """
+
+    #: The most call sites to track; the least recently used half are
+    #: forgotten (after summarizing them) beyond this.
+    max_keys = 10000
+
+    def __init__(self, rate, burst=None, interval=60.0):
+        logging.Filter.__init__(self)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, 10 * self.rate))
+        self.interval = interval
+        self.suppressed = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_summary = time.time() + interval
+        self._timer = None
+
+    def filter(self, record):
+        try:
+            return self._filter(record)
+        except Exception:
+            return True
+
+    def _filter(self, record):
+
+        # We may be on several handlers, but only decide once.
+        allowed = record.__dict__.get('_sitetools_rate_allowed')
+        if allowed is not None:
+            return allowed
+
+        # Don't limit our own summaries.
+        if record.name == __name__:
+            return True
+
+        # The message may be any object (which may not be hashable), in which
+        # case only its type is part of the key.
+        now = record.created
+        msg = record.msg
+        template = msg if isinstance(msg, basestring) else type(msg)
+        key = (record.name, template, record.pathname, record.lineno)
+        summaries = []
+
+        with self._lock:
+
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    summaries.extend(self._forget())
+                # [tokens, last update, suppressed since the last summary, message]
+                display = msg if template is msg else '<%s>' % template.__name__
+                bucket = self._buckets[key] = [self.burst, now, 0, display]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            allowed = bucket[0] >= 1
+            if allowed:
+                bucket[0] -= 1
+            else:
+                bucket[2] += 1
+                self.suppressed += 1
+                # Summarize even if nothing else is logged.
+                if self._timer is None or not self._timer.is_alive():
+                    self._start_timer(self._next_summary - time.time())
+
+            if now >= self._next_summary:
+                self._next_summary = now + self.interval
+                summaries.extend(self._collect_summaries())
+
+        record._sitetools_rate_allowed = allowed
+        self._log_summaries(summaries)
+        return allowed
+
+    def _start_timer(self, delay):
+        self._timer = threading.Timer(max(0, delay), self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Log summaries of every call site with suppressed records now."""
+        with self._lock:
+            self._next_summary = time.time() + self.interval
+            summaries = self._collect_summaries()
+        self._log_summaries(summaries)
+
+    def close(self):
+        """Stop waiting to summarize, and log any summaries now."""
+        timer = self._timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+    def _collect_summaries(self):
+        summaries = []
+        for key, bucket in self._buckets.iteritems():
+            if bucket[2]:
+                summaries.append((key, bucket[3], bucket[2]))
+                bucket[2] = 0
+        summaries.sort()
+        return summaries
+
+    def _log_summaries(self, summaries):
+        for (name, _, pathname, lineno), msg, count in summaries:
+            log.warning('%d similar records suppressed from %s at %s:%d: %r', count, name, pathname, lineno, msg)
+
+    def _forget(self):
+        """Forget the least recently used half of the call sites, returning
+        summaries of any records they suppressed."""
+        by_age = sorted(self._buckets.iteritems(), key=lambda x: x[1][1])
+        summaries = []
+        for key, bucket in by_age[:len(by_age) // 2 + 1]:
+            del self._buckets[key]
+            if bucket[2]:
+                summaries.append((key, bucket[3], bucket[2]))
+        return summaries
+
+
+def _parse_spec(spec):
+    parts = [float(x) for x in spec.split(':')]
+    if not 1 <= len(parts) <= 3 or any(x <= 0 for x in parts):
+        raise ValueError('expected rate[:burst[:interval]]')
+    rate = parts[0]
+    burst = parts[1] if len(parts) > 1 else None
+    interval = parts[2] if len(parts) > 2 else 60.0
+    return rate, burst, interval
+
+
+def _install(root=None):
+    """Add a :class:`RateLimitFilter` to all of the root handlers, if
+    requested by :envvar:`SITETOOLS_LOG_RATE_LIMIT`.
+
+    :returns: The :class:`RateLimitFilter`, or ``None``.
+
+    """
+
+    spec = os.environ.get('SITETOOLS_LOG_RATE_LIMIT')
+    if not spec:
+        return
+
+    try:
+        rate, burst, interval = _parse_spec(spec)
+    except ValueError as e:
+        log.error('invalid SITETOOLS_LOG_RATE_LIMIT %r: %s', spec, e)
+        return
+
+    import atexit
+
+    root = root or logging.getLogger()
+    filter_ = RateLimitFilter(rate, burst, interval)
+    for handler in root.handlers:
+        handler.addFilter(filter_)
+
+    # Before the handlers are closed by logging.shutdown.
+    atexit.register(filter_.close)
+
+    return filter_
@@ -53,6 +53,46 @@ Environment Variables
     If unset, defaults to ``~/dev:~/dev/venv/bin/python``.
 
 
+.. envvar:: SITETOOLS_SCAN_THREADS
+
+    The number of threads with which to scan sites (and read their ``*.pth``
+    files) concurrently. This is worthwhile when there are many sites on a
+    high-latency filesystem. The order of the resulting ``sys.path`` is
+    identical to scanning serially, which is the default (or when set to
+    ``"1"``).
+
+
+.. envvar:: SITETOOLS_SITES_CACHE
+
+    Set to ``"0"`` to disable the persistent cache of resolved sites, which is
+    otherwise used whenever :envvar:`SITETOOLS_CACHE_DIR` is set.
+
+    The cache records the final changes to ``sys.path`` (and any ``import``
+    lines within ``*.pth`` files) for a given :envvar:`SITETOOLS_SITES`,
+    Python, and platform. It is considered stale as soon as the modification
+    time of any site directory, site bundle, mirror manifest, or ``*.pth``
+    file changes, or as soon as a path listed by a ``*.pth`` file which did not
+    exist (or a mirror which was being copied) is created. Note that adding a
+    ``__site__.pth`` to an existing package will not be noticed until the site
+    directory itself is modified (e.g. by touching it).
+
+
+.. envvar:: SITETOOLS_PUBLISH_SNAPSHOT
+
+    Set to ``"1"`` to publish what the startup sequence did to ``sys.path`` via
+    :envvar:`SITETOOLS_SITES_SNAPSHOT` (see :func:`publish_snapshot`), so
+    that subprocesses need not discover the sites again.
+
+
+.. envvar:: SITETOOLS_SITES_SNAPSHOT
+
+    Set by :func:`publish_snapshot` to a snapshot of the startup sequence (or
+    the path to a file containing one). A process whose
+    :envvar:`SITETOOLS_SITES`, Python, host, and site modification times all
+    match those of the snapshot applies it directly; any other process
+    ignores it and discovers its sites as usual.
+
+
 API Reference
 -------------
 
@@ -60,7 +100,10 @@ API Reference
 
 from __future__ import absolute_import
 
+import contextlib
 import errno
+import hashlib
+import json
 import logging
 import os
 import stat
@@ -68,8 +111,8 @@ import sys
 import traceback
 import warnings
 
-from sitetools.utils import expand_user, get_environ_list
-from sitetools.platform import basic_platform_spec, extended_platform_spec
+from sitetools import bundles, bytecode, cache, importindex, instrument, mirror, platform
+from sitetools.utils import encode_strings, expand_user, get_environ_list, get_home, unique_list
 
 log = logging.getLogger(__name__)
 
@@ -80,7 +123,100 @@ site_postfix = os.path.join(lib_postfix, 'site.py')
 site_package_postfix = os.path.join(lib_postfix, 'site-packages')
 
 
+# Resolved prefixes of Python executables, for this process. Maps absolute
+# paths to `(prefix, python_path_stat)`, where the prefix is `None` if the
+# executable is not within a virtualenv.
+_prefixes = {}
+
+# Resolved prefixes from the persistent cache, and those we need to add to it.
+_cached_prefixes = None
+_new_prefixes = {}
+
+
+def _get_prefix_cache_name():
+    return 'prefixes-py%d%d.json' % sys.version_info[:2]
+
+
+def _get_cached_prefix(path, path_stat):
+    """Get a prefix (or ``None``) from the persistent cache, or raise KeyError
+    if it was not cached or the executable has changed since."""
+
+    global _cached_prefixes
+    if _cached_prefixes is None:
+        _cached_prefixes = cache.read_json(_get_prefix_cache_name()) or {}
+
+    ino, mtime, prefix = _cached_prefixes[path]
+    if ino != path_stat.st_ino or mtime != path_stat.st_mtime:
+        raise KeyError(path)
+    return prefix
+
+
+def _save_prefix_cache():
+    """Add newly resolved prefixes to the persistent cache."""
+
+    if not _new_prefixes or cache.get_cache_dir() is None:
+        return
+
+    # Merge with whatever other processes have done since we read it.
+    data = cache.read_json(_get_prefix_cache_name()) or {}
+    data.update(_new_prefixes)
+    _new_prefixes.clear()
+    cache.write_json(_get_prefix_cache_name(), data)
+
+
+def _find_prefix(path, path_stat):
+    """Find the prefix of the virtualenv containing a Python executable.
+
+    :returns: ``(prefix, python_path_stat)``; the prefix is ``None`` if the
+        executable is not within a virtualenv.
+
+    """
+
+    try:
+        return _prefixes[path]
+    except KeyError:
+        pass
+
+    try:
+        result = _get_cached_prefix(path, path_stat), None
+    except KeyError:
+        result = None
+
+    if result is None:
+
+        # Discover the prefix in much the same way that Python does itself.
+        result = None, None
+        prefix = path
+        while prefix and prefix != '/':
+            prefix = os.path.dirname(prefix)
+            try:
+                result = prefix, os.stat(os.path.join(prefix, site_package_postfix))
+                break
+            except OSError:
+                pass
+            if os.path.exists(os.path.join(prefix, site_postfix)):
+                result = prefix, None
+                break
+
+        _new_prefixes[path] = (path_stat.st_ino, path_stat.st_mtime, result[0])
+
+    _prefixes[path] = result
+    return result
+
+
 class Site(object):
+    """A directory or virtualenv from which to add a pseudo site-packages.
+
+    :param str path: A directory, or the Python executable of a virtualenv.
+    :raises ValueError: if it is neither.
+
+    The stat results taken while resolving the site are kept as :attr:`stat`
+    (for the given path) and :attr:`python_path_stat` (for the
+    :attr:`python_path`, or ``None`` if it was not taken), so that callers need
+    not take them again. Prefixes of executables are memoized for the process,
+    and in the persistent cache when :envvar:`SITETOOLS_CACHE_DIR` is set.
+
+    """
 
     def __init__(self, path):
 
@@ -94,23 +230,16 @@ class Site(object):
 
         if stat.S_ISDIR(self.stat.st_mode):
             self.is_venv = False
+            self.python_path_stat = self.stat
 
-        # Discover the prefix in much the same way that Python does itself.
         # This test for the python executable isn't very robust, but it catches
         # the normal cases on Linux and OS X (even when in a Framework).
         elif os.path.basename(self.path).lower() in ('python', 'python%s.%s' % sys.version_info[:2]):
-            prefix = os.path.abspath(self.path)
-            while prefix and prefix != '/':
-                prefix = os.path.dirname(prefix)
-                if (
-                    os.path.exists(os.path.join(prefix, site_package_postfix)) or
-                    os.path.exists(os.path.join(prefix, site_postfix))
-                ):
-                    self.is_venv = True
-                    self.prefix = prefix
-                    break
-            else:
+            prefix, self.python_path_stat = _find_prefix(os.path.abspath(self.path), self.stat)
+            if prefix is None:
                 raise ValueError('file is not within a virtualenv')
+            self.is_venv = True
+            self.prefix = prefix
 
         else:
             raise ValueError('expected directory or Python executable')
@@ -151,11 +280,12 @@ def find_dev_sites(patterns=None, users=None):
     if users is None:
         users = [None]
 
+    homes = {}
     found_sites = []
     for pattern in patterns:
         for user in users:
             
-            site_path = expand_user(pattern, user)
+            site_path = expand_user(pattern, user, homes)
             try:
                 site = Site(site_path)
             except ValueError:
@@ -163,15 +293,179 @@ def find_dev_sites(patterns=None, users=None):
             else:
                 found_sites.append(site)
 
+    _save_prefix_cache()
+
     return found_sites
 
 
+def iter_dev_sites(patterns=None, users=None, threads=8, timeout=None):
+    """Find development sites for many users at once.
+
+    :param list patterns: Site patterns, as in :envvar:`SITETOOLS_DEV_SITES`.
+    :param list users: User names to look for; ``None`` is the current user.
+    :param int threads: How many threads to do the lookups and checks with.
+    :param float timeout: How many seconds (from the call) to wait for all of
+        the lookups and checks, which may hang with LDAP/NIS or dead home
+        mounts; any users not finished by then are skipped.
+    :returns: An iterator of ``(user, site)`` tuples, in the order they are
+        found.
+
+    Unlike :func:`find_dev_sites`, each user's home is looked up only once,
+    and all lookups and candidate sites are checked concurrently.
+
+    Lookups which hang keep their thread busy, so once ``threads`` of them
+    have hung no others can start; hence the single deadline for everything,
+    rather than one per lookup.
+
+    """
+
+    import Queue
+    import threading
+    import time
+
+    if patterns is None:
+        patterns = get_dev_site_patterns()
+    if users is None:
+        users = [None]
+    users = unique_list(users)
+    if not patterns or not users:
+        return
+
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+
+    def work():
+        while True:
+
+            task = tasks.get()
+            if task is None:
+                return
+            kind, user, site_path = task
+
+            if kind == 'lookup':
+                try:
+                    homes = {user: get_home(user)}
+                except (KeyError, OSError) as e:
+                    results.put(('error', user, e))
+                    continue
+                results.put(('home', user, homes[user]))
+                for pattern in patterns:
+                    try:
+                        tasks.put(('check', user, expand_user(pattern, user, homes)))
+                    except (KeyError, OSError):
+                        results.put(('site', user, None))
+                continue
+
+            try:
+                site = Site(site_path)
+            except (ValueError, OSError):
+                site = None
+            results.put(('site', user, site))
+
+    deadline = None if timeout is None else time.time() + timeout
+
+    # How many results we are waiting for, by user.
+    remaining = {}
+    for user in users:
+        tasks.put(('lookup', user, None))
+        remaining[user] = 1
+
+    workers = []
+    for _ in xrange(max(1, min(threads, len(users) * len(patterns)))):
+        worker = threading.Thread(target=work, name='sitetools.dev_sites')
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    try:
+        while remaining:
+
+            try:
+                if deadline is None:
+                    kind, user, value = results.get()
+                else:
+                    kind, user, value = results.get(timeout=max(0, deadline - time.time()))
+            except Queue.Empty:
+                log.warning('dev site lookups timed out after %.1fs; skipping %s', timeout, ', '.join(
+                    sorted(repr(x) for x in remaining)))
+                return
+
+            if kind == 'error':
+                log.log(5, 'could not look up %r: %r', user, value)
+                del remaining[user]
+
+            elif kind == 'home':
+                remaining[user] = len(patterns)
+
+            else:
+                remaining[user] -= 1
+                if not remaining[user]:
+                    del remaining[user]
+                if value is not None:
+                    yield user, value
+
+    finally:
+        # Drop anything not yet started; any abandoned lookups will finish
+        # whatever they were doing first.
+        while True:
+            try:
+                tasks.get_nowait()
+            except Queue.Empty:
+                break
+        for _ in workers:
+            tasks.put(None)
+        _save_prefix_cache()
+
+
+class ScanStats(object):
+    """Counts of the filesystem calls made while scanning and adding sites."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.listdir = 0
+        self.stat = 0
+        self.open = 0
+        self.read = 0
+
+    @property
+    def total(self):
+        return self.listdir + self.stat + self.open + self.read
+
+    def add(self, other):
+        """Accumulate the counts from another :class:`ScanStats`."""
+        self.listdir += other.listdir
+        self.stat += other.stat
+        self.open += other.open
+        self.read += other.read
+
+    def __repr__(self):
+        return '<ScanStats listdir=%d stat=%d open=%d read=%d>' % (
+            self.listdir, self.stat, self.open, self.read
+        )
+
+
+#: The :class:`ScanStats` for everything done by this module in this process.
+scan_stats = ScanStats()
+
+
 class SysPathInserter(object):
-    """Class to insert a series of paths into :data:`sys.path` incrementally."""
+    """Class to insert a series of paths into :data:`sys.path` incrementally.
+
+    Each :meth:`add` takes effect immediately, unless it is within a
+    :meth:`batch`, in which case the paths are written into ``sys.path`` in a
+    single splice when the batch ends (or at :meth:`flush`). The final order is
+    the same either way.
+
+    """
     
     def __init__(self, index=None):
 
         self.index = None
+        self._pending = None
+        self._seen = None
+        self._seen_stamp = None
 
         if isinstance(index, int):
             self.index = index
@@ -181,53 +475,223 @@ class SysPathInserter(object):
             except ValueError:
                 warnings.warn('%r was not found on sys.path' % index)
         
-    def add(self, path):
-        """Add the given path to the decided place in sys.path"""
+    def add(self, path, check_exists=True):
+        """Add the given path to the decided place in sys.path
+
+        :param str path: The path to add.
+        :param bool check_exists: Only add the path if it exists.
+        :returns: ``True`` if the path was added.
+
+        """
         
         # sys.path always has absolute paths.
         path = os.path.abspath(path)
         
         # It must exist.
-        if not os.path.exists(path):
-            return
+        if check_exists:
+            scan_stats.stat += 1
+            if not os.path.exists(path):
+                return False
         
-        # It must not already be in sys.path.
-        if path in sys.path:
-            return
-
+        # It must not already be in sys.path (or pending).
+        seen = self._get_seen()
+        if path in seen:
+            return False
+        seen.add(path)
+
+        if self._pending is not None:
+            self._pending.append(path)
+        else:
+            self._insert([path])
+        return True
+
+    def _get_seen(self):
+        # The set of everything in sys.path (or pending), which is rebuilt
+        # whenever anyone else has replaced or resized sys.path since.
+        stamp = (id(sys.path), len(sys.path))
+        if self._seen is None or stamp != self._seen_stamp:
+            self._seen = set(sys.path)
+            self._seen.update(self._pending or ())
+            self._seen_stamp = stamp
+        return self._seen
+
+    def _insert(self, paths):
         if self.index is not None:
-            sys.path.insert(self.index, path)
-            self.index += 1
+            sys.path[self.index:self.index] = paths
+            self.index += len(paths)
         else:
-            sys.path.append(path)
+            sys.path.extend(paths)
+        self._seen_stamp = (id(sys.path), len(sys.path))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager which collects every path added within it, and
+        writes them all into :data:`sys.path` as it exits.
+
+        Nested batches are part of the outermost one.
+
+        """
+        if self._pending is not None:
+            yield self
+            return
+        self._pending = []
+        try:
+            yield self
+        finally:
+            self.flush()
+            self._pending = None
+
+    def flush(self):
+        """Write all paths pending within a :meth:`batch` into :data:`sys.path`.
+
+        :returns: The number of paths which were written.
+
+        """
+
+        pending = self._pending
+        if not pending:
+            return 0
+        self._pending = []
+
+        # Someone else may have added some of these since we saw sys.path.
+        present = set(sys.path)
+        pending = [x for x in pending if x not in present]
+        self._seen = None
+        self._insert(pending)
+
+        return len(pending)
+
+    def _record_exec(self, base, file_name, line):
+        pass
+
+    def _record_site(self, path):
+        pass
+
+
+class _RecordingInserter(SysPathInserter):
+    """A :class:`SysPathInserter` which records what it does for later replay."""
+
+    def __init__(self, index, ops, label):
+        super(_RecordingInserter, self).__init__(index)
+        self.ops = ops
+        self.label = label
+
+    def add(self, path, check_exists=True):
+        added = super(_RecordingInserter, self).add(path, check_exists)
+        if added:
+            self.ops.append(('add', self.label, os.path.abspath(path)))
+        return added
+
+    def _record_exec(self, base, file_name, line):
+        self.ops.append(('exec', base, file_name, line))
+
+    def _record_site(self, path):
+        self.ops.append(('site', path))
 
 
 _processed_pths = set()
 
+# The modification times of every processed *.pth, taken when it was opened.
+_pth_mtimes = {}
+
+# The paths listed by every processed *.pth which did not exist when scanned.
+_pth_missing = {}
+
+
+class _PthFile(object):
+    """The contents of a ``*.pth`` file, read and parsed but not yet processed.
+
+    ``entries`` is a list of either ``('exec', line)`` or
+    ``('path', path, exists)`` tuples.
+
+    """
+
+    def __init__(self, path, base, file_name, mtime, entries):
+        self.path = path
+        self.base = base
+        self.file_name = file_name
+        self.mtime = mtime
+        self.entries = entries
+
+
+class SiteScan(object):
+    """The result of :func:`scan_site_dir`.
+
+    .. attribute:: path
+
+        The absolute path to the site.
+
+    .. attribute:: pths
+
+        The ``*.pth`` and ``__site__.pth`` files found within the site, in the
+        order they should be processed.
+
+    .. attribute:: names
+
+        The names of every entry within the site.
+
+    .. attribute:: listings
+
+        The names of every entry within other directories added by the site,
+        by path, if they are already known (e.g. from a bundle).
+
+    """
+
+    def __init__(self, path, pths, names=(), listings=None):
+        self.path = path
+        self.pths = pths
+        self.names = names
+        self.listings = listings or {}
+
+
+def _read_pth(base, file_name, stats):
+    """Read a ``*.pth`` file, or return ``None`` if it can't be read.
+
+    This doubles as our existence check, so that a missing ``__site__.pth``
+    costs exactly one (failed) call.
+
+    """
 
-def _process_pth(path, base, file_name):
-    """Process a ``.pth`` file similar to site.addpackage(...)."""
-    
     pth_path = os.path.abspath(os.path.join(base, file_name))
-    
-    # This is for `exec` below, as some packages (e.g. virtualenvwrapper)
-    # assume that `site.addpackage` is running them.
-    sitedir = os.path.dirname(base)
 
-    # Only process this once.
+    # Don't bother reading those which have already been processed.
     if pth_path in _processed_pths:
         return
-    _processed_pths.add(pth_path)    
-    
-    log.log(1, '_process_pth(..., %r, %r)', base, file_name)
-    
+
+    stats.open += 1
     try:
         fh = open(pth_path)
     except IOError as e:
-        log.log(1, '_process_path IOError %s' % e)
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            log.log(1, '_process_path IOError %s' % e)
         return
-    
-    for line in open(pth_path):
+
+    try:
+        stats.stat += 1
+        try:
+            mtime = os.fstat(fh.fileno()).st_mtime
+        except OSError:
+            mtime = None
+        stats.read += 1
+        lines = fh.read().splitlines()
+    finally:
+        fh.close()
+
+    return _PthFile(pth_path, base, file_name, mtime, _parse_pth_lines(base, file_name, lines, stats))
+
+
+def _parse_pth_lines(base, file_name, lines, stats, exists=None):
+    """Parse a ``.pth`` file similar to site.addpackage(...), but don't apply it.
+
+    This is where we check that paths exist, so that all of the filesystem
+    access happens while scanning (which may be in another thread).
+
+    """
+
+    exists = exists or os.path.exists
+
+    entries = []
+    for line in lines:
         line = line.strip()
         
         # Blanks and comments.
@@ -241,21 +705,347 @@ def _process_pth(path, base, file_name):
             if file_name == 'easy-install.pth' and 'sys.__plen' in line:
                 continue
 
-            log.log(1, '_process_pth exec %s' % line)
-            exec line
+            entries.append(('exec', line))
             continue
         
-        # Replace "{platform_spec}" to allow per-platform paths.
-        line = line.format(
-            platform_spec=basic_platform_spec,
-            basic_platform_spec=basic_platform_spec,
-            extended_platform_spec=extended_platform_spec,
-        )
+        # Replace "{platform_spec}" to allow per-platform paths. The specs are
+        # only worked out if they are actually used.
+        if '{' in line:
+            line = line.format(**platform.get_platform_specs())
+
+        if mirror._originals:
+            path = mirror.resolve_pth_path(base, line)
+        else:
+            path = os.path.abspath(os.path.join(base, line))
+        stats.stat += 1
+        entries.append(('path', path, exists(path)))
+
+    return entries
+
+
+# The module providing scandir, as found by _get_scandir().
+_scandir_module = None
 
-        path.add(os.path.join(base, line))
 
+def _get_scandir():
+    """Get the module providing ``scandir``, or ``False`` if there is none.
+
+    This is imported the first time a directory is listed rather than with
+    this module, as the pure-Python half of the ``scandir`` backport pulls in
+    :mod:`ctypes`; we go straight to its C extension where we can.
+
+    """
+
+    global _scandir_module
+    if _scandir_module is None:
+        if hasattr(os, 'scandir'):
+            _scandir_module = os
+        else:
+            _scandir_module = False
+            for name in ('_scandir', 'scandir'):
+                try:
+                    _scandir_module = __import__(name)
+                except ImportError:
+                    continue
+                break
+    return _scandir_module
+
+
+def _iter_dir(dir_name, stats):
+    """Yield ``(name, is_dir)`` for every entry of a directory in a single pass.
+
+    ``is_dir`` is taken from the directory listing itself via
+    :func:`os.scandir` (or the ``scandir`` backport we require on Python 2),
+    and is ``None`` if it is not known without another call.
+
+    Without either, we fall back to :func:`os.listdir`, every ``is_dir`` is
+    ``None``, and every entry is probed for a ``__site__.pth`` as before; i.e.
+    the single pass saves nothing.
+
+    """
 
-def add_site_list(dir_list):
+    scandir_module = _get_scandir()
+    if scandir_module:
+        stats.listdir += 1
+        for entry in scandir_module.scandir(dir_name):
+            # Symlinks (and filesystems which don't report types) are unknown.
+            if entry.is_symlink():
+                yield entry.name, None
+            else:
+                yield entry.name, entry.is_dir(follow_symlinks=False)
+
+    else:
+        stats.listdir += 1
+        for name in os.listdir(dir_name):
+            yield name, None
+
+
+def scan_site_dir(dir_name, stats=None):
+    """Find and read all of the ``*.pth`` files for a site in a single pass.
+
+    :param str dir_name: The site to scan.
+    :param ScanStats stats: Where to count filesystem calls; defaults to
+        :data:`scan_stats`.
+    :returns: A :class:`SiteScan`, or ``None`` if the site does not exist.
+
+    Plain files are never probed for a ``__site__.pth`` when the directory
+    listing can tell us they are not directories.
+
+    If the site has an up-to-date bundle (see :mod:`sitetools.bundles`), the
+    bundle is scanned instead, and the resulting :attr:`SiteScan.path` is that
+    of the bundle.
+
+    """
+
+    stats = scan_stats if stats is None else stats
+    dir_name = os.path.abspath(dir_name)
+
+    with instrument.span('scan %s' % dir_name, 'sites', detail=True, path=dir_name):
+        return _scan_site_dir(dir_name, stats)
+
+
+def _scan_bundle(dir_name, stats):
+    """Scan the bundle of a site, or return ``None`` if it should not be used."""
+
+    bundle_path = dir_name + bundles.SUFFIX
+
+    # The open doubles as our existence check.
+    stats.open += 1
+    try:
+        fh = open(bundle_path, 'rb')
+    except IOError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            log.warning('could not open bundle %s: %s', bundle_path, e)
+        return
+
+    try:
+        stats.read += 1
+        metadata, names = bundles.read_metadata(fh)
+    except Exception as e:
+        log.warning('could not read bundle %s: %r', bundle_path, e)
+        return
+    finally:
+        fh.close()
+
+    if metadata.get('format') != bundles.FORMAT:
+        log.warning('bundle %s has unsupported format %r', bundle_path, metadata.get('format'))
+        return
+
+    # The loose directory wins if it has changed since the bundle was packed.
+    # Packages within it are only checked by `sitetools.bundles verify`, so
+    # that startup costs one stat per site.
+    stats.stat += 1
+    mtime = _get_mtime(dir_name)
+    if mtime is not None and mtime > metadata['source_mtime']:
+        log.info('bundle %s is older than %s; ignoring it', bundle_path, dir_name)
+        return
+
+    # The contents of every directory within the bundle, by relative path.
+    contents = {}
+    for name in names:
+        parts = name.split('/')
+        for i in xrange(len(parts)):
+            if parts[i]:
+                contents.setdefault('/'.join(parts[:i]), set()).add(parts[i])
+
+    prefix = bundle_path + os.sep
+    files = set(names)
+    listings = {}
+
+    def exists(path):
+        if not path.startswith(prefix):
+            return os.path.exists(path)
+        rel_path = path[len(prefix):].replace(os.sep, '/')
+        if rel_path in contents:
+            listings[path] = list(contents[rel_path])
+            return True
+        return rel_path in files
+
+    pths = []
+    for raw in metadata['pths']:
+        base = os.path.join(bundle_path, raw['base']) if raw['base'] else bundle_path
+        pth_path = os.path.join(base, raw['file_name'])
+        if pth_path in _processed_pths:
+            continue
+        entries = _parse_pth_lines(base, raw['file_name'], raw['lines'], stats, exists)
+        pths.append(_PthFile(pth_path, base, raw['file_name'], None, entries))
+
+    root = [x for x in contents.get('', ()) if x != bundles.METADATA_NAME]
+    return SiteScan(bundle_path, pths, root, listings)
+
+
+def _scan_site_dir(dir_name, stats):
+
+    if bundles.is_enabled():
+        scan = _scan_bundle(dir_name, stats)
+        if scan is not None:
+            return scan
+
+    pths = []
+    names = []
+    try:
+        for file_name, is_dir in _iter_dir(dir_name, stats):
+
+            names.append(file_name)
+        
+            # Skip dotfiles.
+            if file_name.startswith('.'):
+                continue
+        
+            # *.pth files.
+            if file_name.endswith('.pth') and not is_dir:
+                pth = _read_pth(dir_name, file_name, stats)
+                if pth is not None:
+                    pths.append(pth)
+        
+            # __site__.pth files inside packages.
+            if is_dir is not False:
+                pth = _read_pth(os.path.join(dir_name, file_name), '__site__.pth', stats)
+                if pth is not None:
+                    pths.append(pth)
+
+    except OSError as e:
+        # Don't do anything if the folder doesn't exist.
+        if e.errno in (errno.ENOENT, errno.ENOTDIR):
+            return
+        raise
+
+    return SiteScan(dir_name, pths, names)
+
+
+def _process_pth(path, base, file_name):
+    """Process a ``.pth`` file similar to site.addpackage(...)."""
+    pth = _read_pth(base, file_name, scan_stats)
+    if pth is not None:
+        _apply_pth(path, pth)
+
+
+def _apply_pth(path, pth):
+    """Process the contents of a ``.pth`` file, as read by :func:`_read_pth`."""
+
+    # Only process this once.
+    if pth.path in _processed_pths:
+        return
+    _processed_pths.add(pth.path)
+    _pth_mtimes[pth.path] = pth.mtime
+    _pth_missing[pth.path] = [entry[1] for entry in pth.entries if entry[0] == 'path' and not entry[2]]
+    
+    log.log(1, '_process_pth(..., %r, %r)', pth.base, pth.file_name)
+
+    for entry in pth.entries:
+        if entry[0] == 'exec':
+            # The exec may well look at sys.path.
+            path.flush()
+            path._record_exec(pth.base, pth.file_name, entry[1])
+            _exec_pth_line(pth.base, pth.file_name, entry[1])
+        elif entry[2]:
+            path.add(entry[1], check_exists=False)
+
+
+def _exec_pth_line(base, file_name, line):
+
+    # This is for `exec` below, as some packages (e.g. virtualenvwrapper)
+    # assume that `site.addpackage` is running them.
+    sitedir = os.path.dirname(base)
+
+    log.log(1, '_process_pth exec %s' % line)
+    exec line
+
+
+def _apply_site_scan(path, scan):
+    with instrument.span('apply %s' % scan.path, 'sites', detail=True, path=scan.path):
+        _apply_site_scan_inner(path, scan)
+
+
+def _apply_site_scan_inner(path, scan):
+
+    # Save the import index from listing this site again.
+    finder = importindex.get_installed()
+    if finder is not None:
+        archive = scan.path.endswith(bundles.SUFFIX)
+        finder.add_listing(scan.path, scan.names, archive=archive)
+        for dir_path, names in scan.listings.iteritems():
+            finder.add_listing(dir_path, names, archive=archive)
+
+    # We just listed it, so we know it exists.
+    path.add(scan.path, check_exists=False)
+
+    # Modules within the site may have their bytecode cached.
+    bytecode.add_root(scan.path)
+    path._record_site(scan.path)
+
+    # Process *.pth files in a manner similar to site.addsitedir(...).
+    for pth in scan.pths:
+        _apply_pth(path, pth)
+
+
+def _get_scan_threads():
+    try:
+        return int(os.environ.get('SITETOOLS_SCAN_THREADS') or 1)
+    except ValueError:
+        log.warning('SITETOOLS_SCAN_THREADS must be an integer; got %r', os.environ['SITETOOLS_SCAN_THREADS'])
+        return 1
+
+
+def scan_site_dirs(dir_list, threads=1, stats=None):
+    """Scan a list of sites via :func:`scan_site_dir`, possibly concurrently.
+
+    :param list dir_list: The sites to scan.
+    :param int threads: The maximum number of threads to scan with.
+    :param ScanStats stats: Where to count filesystem calls; defaults to
+        :data:`scan_stats`.
+    :returns: A list of :class:`SiteScan` (or ``None``), in the same order as
+        the given sites.
+
+    The calling thread takes part in the scanning, so no threads are started
+    at all unless there are at least two sites and two threads.
+
+    """
+
+    stats = scan_stats if stats is None else stats
+    threads = min(threads, len(dir_list))
+    if threads <= 1:
+        return [scan_site_dir(x, stats) for x in dir_list]
+
+    import threading
+
+    results = [None] * len(dir_list)
+    errors = [None] * len(dir_list)
+    thread_stats = [ScanStats() for _ in xrange(threads)]
+    pending = list(reversed(list(enumerate(dir_list))))
+    lock = threading.Lock()
+
+    def work(my_stats):
+        while True:
+            with lock:
+                if not pending:
+                    return
+                i, dir_name = pending.pop()
+            try:
+                results[i] = scan_site_dir(dir_name, my_stats)
+            except Exception:
+                errors[i] = sys.exc_info()
+
+    workers = [threading.Thread(target=work, args=(x, ), name='sitetools.scan') for x in thread_stats[1:]]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    work(thread_stats[0])
+    for worker in workers:
+        worker.join()
+
+    for x in thread_stats:
+        stats.add(x)
+
+    # Raise the first error, as if we had been scanning serially.
+    for error in errors:
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    return results
+
+
+def add_site_list(dir_list, threads=None, _ops=None):
     """Add a list of pseudo site-packages to :data:`python:sys.path`.
 
     This centers the list on ``sys.path`` around the current environment.
@@ -263,24 +1053,41 @@ def add_site_list(dir_list):
     list will be prepended to ``sys.path``, and directories after it will
     be appended to ``sys.path``.
 
+    :param int threads: How many threads to scan the sites with; defaults to
+        :envvar:`SITETOOLS_SCAN_THREADS`. The result is the same regardless.
+
     """
     
     our_site_packages = os.path.abspath(os.path.join(sys.prefix, site_package_postfix))
     dir_list = [os.path.abspath(x) for x in dir_list]
 
-    prepend = SysPathInserter(0)
-    append = SysPathInserter()
+    if _ops is None:
+        prepend = SysPathInserter(0)
+        append = SysPathInserter()
+    else:
+        prepend = _RecordingInserter(0, _ops, 'prepend')
+        append = _RecordingInserter(None, _ops, 'append')
 
     try:
         our_index = dir_list.index(our_site_packages)
     except ValueError:
         our_index = None
 
-    for i, dir_name in enumerate(dir_list):
-        if our_index is None or i < our_index:
-            add_site_dir(dir_name, _path=prepend)
-        else:
-            add_site_dir(dir_name, _path=append)
+    if threads is None:
+        threads = _get_scan_threads()
+    scans = scan_site_dirs(dir_list, threads)
+
+    with prepend.batch(), append.batch():
+        for i, (dir_name, scan) in enumerate(zip(dir_list, scans)):
+            log.log(5, 'add_site_dir(%r)', dir_name)
+            if scan is None:
+                continue
+            if our_index is None or i < our_index:
+                _apply_site_scan(prepend, scan)
+            else:
+                # Everything prepended must be visible before we start appending.
+                prepend.flush()
+                _apply_site_scan(append, scan)
 
 
 def add_site_dir(dir_name, before=None, _path=None):
@@ -297,42 +1104,321 @@ def add_site_dir(dir_name, before=None, _path=None):
 
     log.log(5, 'add_site_dir(%r, before=%r)', dir_name, before)
     
-    # Don't do anything if the folder doesn't exist.
-    if not os.path.exists(dir_name):
+    scan = scan_site_dir(dir_name)
+    if scan is None:
         return
     
     path = _path or SysPathInserter(index=before)
-    path.add(dir_name)
+    with path.batch():
+        _apply_site_scan(path, scan)
 
-    # Process *.pth files in a manner similar to site.addsitedir(...).
-    for file_name in os.listdir(dir_name):
-    
-        # Skip dotfiles.
-        if file_name.startswith('.'):
-            continue
-    
-        # *.pth files.
-        if file_name.endswith('.pth'):
-            _process_pth(path, dir_name, file_name)
-    
-        # __site__.pth files inside packages.
-        if os.path.exists(os.path.join(dir_name, file_name, '__site__.pth')):
-            _process_pth(path, os.path.join(dir_name, file_name), '__site__.pth')
 
+_cache_version = 3
 
-def _setup():
 
-    sites = []
-    for site_path in get_environ_list('SITETOOLS_SITES'):
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _get_cache_key(site_paths):
+    """Everything other than modification times which determines the result of
+    :func:`add_site_list` for the given raw :envvar:`SITETOOLS_SITES`."""
+    return {
+        'version': _cache_version,
+        'sites': list(site_paths),
+        'executable': sys.executable,
+        'prefix': sys.prefix,
+        'host': platform.get_host_key(),
+        'bundles': bundles.is_enabled(),
+        'mirror': mirror.get_patterns(),
+    }
+
+
+def _get_cache_name(key):
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True)).hexdigest()
+    return 'sites-%s.json' % digest[:16]
+
+
+def _is_cache_enabled():
+    return os.environ.get('SITETOOLS_SITES_CACHE', '1') != '0' and cache.get_cache_dir() is not None
+
+
+def _is_current(data, key, source):
+    """Were the recorded operations made with the given key, and are they
+    still up to date?"""
+
+    if not data or data.get('key') != key:
+        return False
+
+    # A single stat of every site and *.pth that went into the result, and of
+    # every path a *.pth listed which did not exist (with a ``None`` mtime, so
+    # that it is stale once they do).
+    for path, mtime in data['mtimes']:
+        if _get_mtime(path) != mtime:
+            log.log(5, '%s is stale due to %s', source, path)
+            return False
+
+    return True
+
+
+def _load_cached_ops(site_paths):
+    """Get the recorded operations for the given sites, or ``None`` if stale."""
+    key = _get_cache_key(site_paths)
+    data = cache.read_json(_get_cache_name(key))
+    if _is_current(data, key, 'sites cache'):
+        return data
+
+
+def _apply_cached_ops(data):
+
+    prepend = SysPathInserter(0)
+    append = SysPathInserter()
+
+    with prepend.batch(), append.batch():
+        for op in data['ops']:
+            if op[0] == 'site':
+                bytecode.add_root(op[1])
+            elif op[0] == 'add' and op[1] == 'prepend':
+                prepend.add(op[2], check_exists=False)
+            elif op[0] == 'add':
+                prepend.flush()
+                append.add(op[2], check_exists=False)
+            else:
+                prepend.flush()
+                append.flush()
+                _exec_pth_line(*op[1:])
+
+    _processed_pths.update(data['pths'])
+
+
+def _build_ops_data(site_paths, site_mtimes, pth_mtimes, ops):
+    missing = [(path, None) for pth_path, _ in pth_mtimes for path in _pth_missing.get(pth_path, ())]
+    return {
+        'key': _get_cache_key(site_paths),
+        'mtimes': site_mtimes + pth_mtimes + unique_list(missing, key=lambda x: x[0]),
+        'pths': [path for path, _ in pth_mtimes],
+        'ops': ops,
+    }
+
+
+def _save_cached_ops(data):
+    cache.write_json(_get_cache_name(data['key']), data)
+
+
+# The recorded operations which reproduce what _setup did, if any.
+_snapshot = None
+
+# Snapshots larger than this are published via a file.
+_max_inline_snapshot = 32 * 1024
+
+
+def _load_snapshot(site_paths):
+    """Get the operations published by our parent, or ``None`` if there are
+    none or they do not apply to us."""
+
+    raw = os.environ.get('SITETOOLS_SITES_SNAPSHOT')
+    if not raw:
+        return
+
+    try:
+        if raw.startswith('{'):
+            data = json.loads(raw)
+        else:
+            with open(raw) as fh:
+                data = json.load(fh)
+    except (IOError, ValueError) as e:
+        log.log(5, 'could not load sites snapshot: %r', e)
+        return
+
+    data = encode_strings(data)
+    if _is_current(data, _get_cache_key(site_paths), 'sites snapshot'):
+        return data
+
+
+def publish_snapshot(path=None):
+    """Publish what the startup sequence did to :data:`python:sys.path`, so
+    that subprocesses may repeat it without discovering the sites themselves.
+
+    :param str path: Where to write the snapshot. By default, small snapshots
+        are put directly into :envvar:`SITETOOLS_SITES_SNAPSHOT`, and larger
+        ones are written to a temporary file which is removed at exit.
+    :returns: The new value of :envvar:`SITETOOLS_SITES_SNAPSHOT`, or ``None``
+        if there is nothing to publish.
+
+    """
+
+    if _snapshot is None:
+        return
+
+    content = json.dumps(_snapshot, sort_keys=True)
+
+    if path is None and len(content) <= _max_inline_snapshot:
+        value = content
+
+    else:
+
+        import atexit
+        import tempfile
+
+        if path is None:
+            fd, value = tempfile.mkstemp(prefix='sitetools-snapshot.', suffix='.json')
+            atexit.register(_remove_snapshot, value)
+        else:
+            value = os.path.abspath(path)
+            fd = os.open(value, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(content)
+
+    os.environ['SITETOOLS_SITES_SNAPSHOT'] = value
+    return value
+
+
+def _remove_snapshot(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _resolve_sites(site_paths):
+    """Resolve raw site paths into :class:`Site` objects.
+
+    :returns: A list of ``(path, site)`` tuples, where ``site`` is ``None``
+        if the path was not valid.
+
+    """
+    resolved = []
+    for site_path in site_paths:
         try:
             site = Site(site_path)
         except ValueError as e:
             log.log(5, 'invalid site %s: %s' % (site_path, e.args[0]))
+            site = None
+        resolved.append((site_path, site))
+    _save_prefix_cache()
+    return resolved
+
+
+def _get_site_mtimes(resolved):
+    """Get the mtimes of every raw site and :attr:`Site.python_path` (and its
+    bundle), using the stat results already taken by :class:`Site` where
+    possible."""
+
+    use_bundles = bundles.is_enabled()
+    mtimes = []
+    for site_path, site in resolved:
+        if site is None:
+            mtimes.append((os.path.abspath(site_path), _get_mtime(site_path)))
+            continue
+        mtimes.append((os.path.abspath(site_path), site.stat.st_mtime))
+        st = site.python_path_stat
+        mtimes.append((
+            os.path.abspath(site.python_path),
+            _get_mtime(site.python_path) if st is None else st.st_mtime,
+        ))
+        if use_bundles:
+            bundle_path = bundles.get_bundle_path(site.python_path)
+            mtimes.append((bundle_path, _get_mtime(bundle_path)))
+
+    return unique_list(mtimes, key=lambda x: x[0])
+
+
+def _mirror_sites(sites):
+    """Substitute local mirrors for sites (except our own)."""
+    our_site_packages = os.path.abspath(os.path.join(sys.prefix, site_package_postfix))
+    with instrument.span('mirror sites', 'sites'):
+        mirrored = mirror.mirror_sites(sites)
+    return [
+        original if original == our_site_packages else path
+        for original, path in zip(sites, mirrored)
+    ]
+
+
+def _get_mirror_mtimes(originals, sites):
+    """Get the mtimes which invalidate the cache for mirrored sites: those of
+    the manifests (for new versions), of the mirrors (in case they are
+    removed), and of the mirrors being copied in the background (for when
+    they are done)."""
+    mtimes = []
+    for original, path in zip(originals, sites):
+        pending = mirror._pending.get(original)
+        if original != path or pending:
+            manifest = os.path.join(original, mirror.MANIFEST_NAME)
+            mtimes.append((manifest, _get_mtime(manifest)))
+            path = pending or path
+            mtimes.append((path, _get_mtime(path)))
+    return mtimes
+
+
+def _setup():
+
+    if os.environ.get('SITETOOLS_IMPORT_INDEX', '0') != '0':
+        importindex.install()
+    if os.environ.get('SITETOOLS_BYTECODE_CACHE', '0') != '0':
+        bytecode.install()
+
+    global _snapshot
+
+    site_paths = get_environ_list('SITETOOLS_SITES')
+    use_cache = _is_cache_enabled()
+    publish = os.environ.get('SITETOOLS_PUBLISH_SNAPSHOT', '0') != '0'
+    record = use_cache or publish
+
+    # From our parent, or from a previous process.
+    data = _load_snapshot(site_paths)
+    inherited = data is not None
+    if data is None and use_cache:
+        data = _load_cached_ops(site_paths)
+    if data is not None:
+        try:
+            _apply_cached_ops(data)
+        except Exception:
+            warnings.warn('Error while applying cached sites %s:\n%s' % (site_paths, traceback.format_exc().rstrip()))
         else:
-            sites.append(site.python_path)
+            log.log(5, 'applied %d %s site operations', len(data['ops']), 'inherited' if inherited else 'cached')
+            _snapshot = data
+            if publish and not inherited:
+                publish_snapshot()
+        return
+
+    resolved = _resolve_sites(site_paths)
+    sites = [site.python_path for _, site in resolved if site is not None]
+
+    # Take the site mtimes before we start, so that any changes made while
+    # we are scanning will invalidate the cache. The raw sites are included so
+    # that one which does not exist yet will be noticed when it is created.
+    site_mtimes = _get_site_mtimes(resolved) if record else None
+
+    # A failure to mirror must never drop any sites, so they are used from
+    # their original locations instead.
+    if mirror.is_enabled():
+        try:
+            mirrored = _mirror_sites(sites)
+        except Exception:
+            warnings.warn('Error while mirroring sites %s:\n%s' % (sites, traceback.format_exc().rstrip()))
+        else:
+            sites, originals = mirrored, sites
+            if record:
+                site_mtimes.extend(_get_mirror_mtimes(originals, sites))
+
+    pths_before = set(_processed_pths)
+    ops = [] if record else None
 
     try:
-        add_site_list(sites)
+        add_site_list(sites, _ops=ops)
     except Exception:
         warnings.warn('Error while adding sites %s:\n%s' % (sites, traceback.format_exc().rstrip()))
+        return
+
+    if record:
+        pths = sorted(_processed_pths - pths_before)
+        pth_mtimes = [(path, _pth_mtimes.get(path)) for path in pths]
+        _snapshot = _build_ops_data(site_paths, site_mtimes, pth_mtimes, ops)
+        if use_cache:
+            _save_cached_ops(_snapshot)
+        if publish:
+            publish_snapshot()
 
@@ -20,12 +20,28 @@ else:
         pass
 
 
-def expand_user(path, user=None):
-    """Roughly the same as os.path.expanduser, but you can pass a default user."""
+def get_home(user=None):
+    """Get the home directory of the given user, or of the current user."""
+    return pwd.getpwnam(user).pw_dir if user else pwd.getpwuid(os.getuid()).pw_dir
+
+
+def expand_user(path, user=None, homes=None):
+    """Roughly the same as os.path.expanduser, but you can pass a default user.
+
+    :param dict homes: A cache of home directories by user, so that repeated
+        calls only look up each user once.
+
+    """
 
     def _replace(m):
         m_user = m.group(1) or user
-        return pwd.getpwnam(m_user).pw_dir if m_user else pwd.getpwuid(os.getuid()).pw_dir
+        if homes is None:
+            return get_home(m_user)
+        try:
+            return homes[m_user]
+        except KeyError:
+            home = homes[m_user] = get_home(m_user)
+            return home
 
     return re.sub(r'~(\w*)', _replace, path)
 
@@ -42,6 +58,17 @@ def unique_list(input_, key=lambda x:x):
     return output
 
 
+def encode_strings(value, encoding='utf8'):
+    """Encode all unicode within decoded JSON, since paths are bytes."""
+    if isinstance(value, unicode):
+        return value.encode(encoding)
+    if isinstance(value, list):
+        return [encode_strings(x, encoding) for x in value]
+    if isinstance(value, dict):
+        return dict((encode_strings(k, encoding), encode_strings(v, encoding)) for k, v in value.iteritems())
+    return value
+
+
 def get_environ_list(name, default=None):
     """Return the split colon-delimited list from an environment variable.
 
@@ -0,0 +1,134 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from . import *
+
+from sitetools import bundles, importindex, sites
+
+
+class TestBundles(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.site = os.path.join(self.root, 'site')
+        self.write('site/sitetools_bundle_mod.py', 'value = 1\n')
+        self.write('site/sitetools_bundle_pkg/__init__.py', 'from .sub import value\n')
+        self.write('site/sitetools_bundle_pkg/sub.py', 'value = 2\n')
+        self.write('site/tool/python/sitetools_bundle_tool.py', 'value = 3\n')
+        self.write('site/tool/__site__.pth', 'python\nmissing\n')
+        self.write('site/extra.pth', '# A comment.\n%s\n' % os.path.join(self.root, 'outside'))
+        os.makedirs(os.path.join(self.root, 'outside'))
+        os.utime(self.site, (time.time() - 10, time.time() - 10))
+
+        self._sys_path = list(sys.path)
+        self._processed_pths = set(sites._processed_pths)
+        self._modules = set(sys.modules)
+        self._environ = dict(os.environ)
+        os.environ['SITETOOLS_BUNDLES'] = '1'
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        sites._snapshot = None
+        sys.path[:] = self._sys_path
+        sites._processed_pths.clear()
+        sites._processed_pths.update(self._processed_pths)
+        for name in set(sys.modules) - self._modules:
+            del sys.modules[name]
+        importindex.uninstall()
+        shutil.rmtree(self.root)
+
+    def write(self, path, content=''):
+        path = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(content)
+
+    def test_pack(self):
+
+        path = bundles.pack(self.site, version='v1')
+        self.assertEqual(path, self.site + bundles.SUFFIX)
+
+        metadata, names = bundles.read_metadata(path)
+        self.assertEqual(metadata['format'], bundles.FORMAT)
+        self.assertEqual(metadata['version'], 'v1')
+        self.assertEqual(sorted((x['base'], x['file_name']) for x in metadata['pths']), [
+            ('', 'extra.pth'),
+            ('tool', '__site__.pth'),
+        ])
+        self.assertIn('sitetools_bundle_pkg/sub.pyc', names)
+        self.assertIn('tool/python/sitetools_bundle_tool.pyc', names)
+
+    def test_extensions(self):
+        self.write('site/sitetools_bundle_ext.so')
+        self.assertRaises(ValueError, bundles.pack, self.site)
+        self.assertFalse(os.path.exists(self.site + bundles.SUFFIX))
+
+    def test_add_site_dir(self):
+
+        bundle = bundles.pack(self.site)
+        sites.add_site_dir(self.site)
+
+        self.assertIn(bundle, sys.path)
+        self.assertIn(os.path.join(bundle, 'tool', 'python'), sys.path)
+        self.assertIn(os.path.join(self.root, 'outside'), sys.path)
+        self.assertNotIn(os.path.join(bundle, 'tool', 'missing'), sys.path)
+        self.assertNotIn(self.site, sys.path)
+
+        import sitetools_bundle_pkg
+        import sitetools_bundle_tool
+        self.assertEqual(sitetools_bundle_pkg.value, 2)
+        self.assertEqual(sitetools_bundle_tool.value, 3)
+
+        # The precompiled bytecode was usable.
+        self.assertEqual(sitetools_bundle_pkg.sub.__file__, os.path.join(bundle, 'sitetools_bundle_pkg', 'sub.pyc'))
+
+    def test_stale(self):
+        bundle = bundles.pack(self.site)
+        os.utime(self.site, None)
+        sites.add_site_dir(self.site)
+        self.assertIn(self.site, sys.path)
+        self.assertNotIn(bundle, sys.path)
+
+    def test_verify(self):
+        bundle = bundles.pack(self.site)
+        self.assertEqual(bundles.find_stale(self.site), [])
+
+        package = os.path.join(self.site, 'sitetools_bundle_pkg')
+        os.utime(package, (time.time() + 10, time.time() + 10))
+        self.assertEqual(bundles.find_stale(self.site), [package])
+        self.assertRaises(SystemExit, bundles.main, ['verify', self.site])
+
+        # Startup only checks the site itself, so the bundle is still used.
+        sites.add_site_dir(self.site)
+        self.assertIn(bundle, sys.path)
+
+    def test_disabled(self):
+        bundle = bundles.pack(self.site)
+        del os.environ['SITETOOLS_BUNDLES']
+        stats = sites.ScanStats()
+        sites.scan_site_dir(self.site, stats)
+        sites.add_site_dir(self.site)
+        self.assertIn(self.site, sys.path)
+        self.assertNotIn(bundle, sys.path)
+        # Not even looked for; only the two packages and extra.pth are opened
+        # (and sitetools_bundle_mod.py and extra.pth are probed as directories
+        # too without scandir).
+        self.assertEqual(stats.open, 3 if sites._get_scandir() else 5)
+
+    def test_import_index(self):
+
+        bundle = bundles.pack(self.site)
+        finder = importindex.install()
+        sites.add_site_dir(self.site)
+
+        # The bundle is not a barrier, so the index covers what follows it.
+        loader = finder.find_module('sitetools_bundle_mod')
+        self.assertIsNotNone(loader)
+        self.assertEqual(loader.load_module('sitetools_bundle_mod').value, 1)
+        self.assertIsNotNone(finder.find_module('sitetools_bundle_tool'))
+        self.assertIsNotNone(finder.find_module('unittest'))
@@ -0,0 +1,136 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from . import *
+
+from sitetools import bytecode
+
+
+class TestBytecodeCache(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.site = os.path.join(self.root, 'site')
+        self.cache_dir = os.path.join(self.root, 'cache')
+        self.write('site/sitetools_bytecode_mod.py', 'value = 1\n')
+        self.write('site/sitetools_bytecode_pkg/__init__.py', 'from .sub import value\n')
+        self.write('site/sitetools_bytecode_pkg/sub.py', 'value = 2\n')
+
+        self._sys_path = list(sys.path)
+        self._modules = set(sys.modules)
+        self._prefixes = bytecode._prefixes
+        self._dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+        sys.path.insert(0, self.site)
+
+    def tearDown(self):
+        bytecode.uninstall()
+        bytecode._prefixes = self._prefixes
+        sys.dont_write_bytecode = self._dont_write_bytecode
+        sys.path[:] = self._sys_path
+        for name in set(sys.modules) - self._modules:
+            del sys.modules[name]
+        shutil.rmtree(self.root)
+
+    def write(self, path, content=''):
+        path = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(content)
+
+    def test_get_put(self):
+
+        cache = bytecode.BytecodeCache(self.cache_dir)
+        path = os.path.join(self.site, 'sitetools_bytecode_mod.py')
+        st = os.stat(path)
+        self.assertIsNone(cache.get(path, st))
+
+        code = bytecode.compile_source(cache, path)
+        self.assertEqual(cache.misses, 2)
+        self.assertIsNotNone(cache.get(path, st))
+        self.assertEqual(cache.hits, 1)
+
+        # A different size is a different key.
+        self.write('site/sitetools_bytecode_mod.py', 'value = 10\n')
+        os.utime(path, (st.st_mtime, st.st_mtime))
+        self.assertIsNone(cache.get(path, os.stat(path)))
+
+    def test_evict(self):
+
+        cache = bytecode.BytecodeCache(self.cache_dir)
+        for i in range(10):
+            path = os.path.join(self.site, 'mod%d.py' % i)
+            self.write(path, 'value = %d\n' % i)
+            os.utime(path, (i, i))
+            bytecode.compile_source(cache, path)
+
+        entries = [os.path.join(d, f) for d, _, fs in os.walk(self.cache_dir) for f in fs if f.endswith('.pyc')]
+        self.assertEqual(len(entries), 10)
+        size = os.path.getsize(entries[0])
+        for i, entry in enumerate(sorted(entries)):
+            os.utime(entry, (time.time() - 1000 + i, time.time() - 1000 + i))
+
+        self.assertEqual(cache.evict(max_size=5 * size), 6)
+        remaining = [os.path.join(d, f) for d, _, fs in os.walk(self.cache_dir) for f in fs if f.endswith('.pyc')]
+        self.assertEqual(sorted(remaining), sorted(entries)[6:])
+
+    def test_import(self):
+
+        cache = bytecode.install(self.cache_dir)
+        bytecode.add_root(self.site)
+
+        import sitetools_bytecode_mod
+        import sitetools_bytecode_pkg
+        self.assertEqual(sitetools_bytecode_mod.value, 1)
+        self.assertEqual(sitetools_bytecode_pkg.value, 2)
+        self.assertEqual(sitetools_bytecode_pkg.__path__, [os.path.join(self.site, 'sitetools_bytecode_pkg')])
+        self.assertEqual(cache.misses, 3)
+
+        # Nothing was written next to the sources.
+        self.assertFalse(os.path.exists(os.path.join(self.site, 'sitetools_bytecode_mod.pyc')))
+        self.assertFalse(os.path.exists(os.path.join(self.site, 'sitetools_bytecode_pkg', 'sub.pyc')))
+
+        for name in ('sitetools_bytecode_mod', 'sitetools_bytecode_pkg', 'sitetools_bytecode_pkg.sub'):
+            del sys.modules[name]
+        import sitetools_bytecode_pkg
+        self.assertEqual(sitetools_bytecode_pkg.value, 2)
+        self.assertEqual(cache.hits, 2)
+
+    def test_outside_roots(self):
+        cache = bytecode.install(self.cache_dir)
+        import sitetools_bytecode_mod
+        self.assertEqual(cache.hits + cache.misses, 0)
+
+    def test_deferred(self):
+        bytecode.install(self.cache_dir)
+        bytecode.add_root(self.site)
+        finder = bytecode._finder
+
+        # Outside of the sites (e.g. the standard library).
+        self.assertIsNone(finder.find_module('sitetools_bytecode_missing'))
+        self.assertIsNotNone(finder.find_module('sitetools_bytecode_mod'))
+
+        # Entries with their own importers.
+        def hook(entry):
+            if entry != self.site:
+                raise ImportError(entry)
+            return self
+        sys.path_hooks.insert(0, hook)
+        sys.path_importer_cache.pop(self.site, None)
+        try:
+            self.assertIsNone(finder.find_module('sitetools_bytecode_mod'))
+        finally:
+            sys.path_hooks.remove(hook)
+            sys.path_importer_cache.pop(self.site, None)
+
+    def test_warm(self):
+        self.write('site/broken.py', 'def broken(:\n')
+        compiled, cached, errors = bytecode.warm([self.site], processes=2, root=self.cache_dir)
+        self.assertEqual((compiled, cached), (3, 0))
+        self.assertEqual([path for path, _ in errors], [os.path.join(self.site, 'broken.py')])
+        compiled, cached, errors = bytecode.warm([self.site], processes=2, root=self.cache_dir)
+        self.assertEqual((compiled, cached), (0, 3))
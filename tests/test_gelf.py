@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import socket
+import zlib
+
+from . import *
+
+from sitetools import logging as sitelogging
+from sitetools.gelf import CHUNK_MAGIC, MAX_CHUNKS, GELFHandler, chunk
+
+
+class TestGELF(TestCase):
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+        self.port = self.server.getsockname()[1]
+        self.logger = logging.getLogger('sitetools.test.gelf')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = None
+
+    def tearDown(self):
+        self.logger.handlers[:] = []
+        if self.handler is not None:
+            self.handler.close()
+        self.server.close()
+
+    def make_handler(self, **kwargs):
+        self.handler = GELFHandler('127.0.0.1', self.port, **kwargs)
+        self.logger.addHandler(self.handler)
+        return self.handler
+
+    def receive(self):
+        """Receive one message, reassembling chunks."""
+        chunks = {}
+        while True:
+            data = self.server.recv(65536)
+            if not data.startswith(CHUNK_MAGIC):
+                return json.loads(zlib.decompress(data))
+            seq, count = ord(data[10]), ord(data[11])
+            chunks[seq] = data[12:]
+            if len(chunks) == count:
+                return json.loads(zlib.decompress(''.join(chunks[i] for i in xrange(count))))
+
+    def test_basic(self):
+        handler = self.make_handler()
+        self.logger.info('hello %s', 'world')
+        handler.flush()
+        msg = self.receive()
+        self.assertEqual(msg['short_message'], 'hello world')
+        self.assertEqual(msg['level'], 6)
+        self.assertEqual(msg['_pid'], os.getpid())
+        self.assertEqual((handler.sent, handler.chunked, handler.dropped), (1, 0, 0))
+
+    def test_fields(self):
+        handler = self.make_handler()
+        handler.fields = {'_login': 'someone'}
+        self.logger.info('hello')
+        self.assertEqual(self.receive()['_login'], 'someone')
+
+    def test_chunked(self):
+        handler = self.make_handler(chunk_size=200)
+        message = os.urandom(2000).encode('hex')
+        self.logger.error(message)
+        handler.flush()
+        msg = self.receive()
+        self.assertEqual(msg['short_message'], message)
+        self.assertIn('test_chunked', msg['_python_stack'])
+        self.assertEqual((handler.sent, handler.chunked, handler.dropped), (1, 1, 0))
+
+    def test_too_many_chunks(self):
+        data = os.urandom(MAX_CHUNKS * 20 + 1)
+        self.assertIsNone(chunk(data, 32))
+        self.assertEqual(len(chunk(data[:-1], 32)), MAX_CHUNKS)
+        handler = self.make_handler(chunk_size=32)
+        self.logger.info(os.urandom(MAX_CHUNKS * 20).encode('hex'))
+        handler.flush()
+        self.assertEqual((handler.sent, handler.dropped), (0, 1))
+
+    def test_batched(self):
+        handler = self.make_handler(batch_size=3, flush_interval=60)
+        self.logger.info('one')
+        self.logger.info('two')
+        self.server.settimeout(0.1)
+        self.assertRaises(socket.timeout, self.server.recv, 65536)
+        self.server.settimeout(5)
+        self.logger.info('three')
+        self.assertEqual([self.receive()['short_message'] for _ in xrange(3)], ['one', 'two', 'three'])
+
+    def test_flush_interval(self):
+        self.make_handler(batch_size=100, flush_interval=0.05)
+        self.logger.info('one')
+        self.assertEqual(self.receive()['short_message'], 'one')
+
+    def test_close(self):
+        handler = self.make_handler(batch_size=100, flush_interval=60)
+        self.logger.info('one')
+        handler.close()
+        self.assertEqual(self.receive()['short_message'], 'one')
+        self.assertEqual(handler.sent, 1)
+
+    def test_stack_sampling(self):
+        sitelogging._stack_counts.clear()
+        os.environ['SITETOOLS_LOG_STACK_SAMPLE'] = '2'
+        try:
+            handler = self.make_handler()
+            for i in xrange(5):
+                self.logger.error('failed')
+            self.logger.error('elsewhere')
+            handler.flush()
+        finally:
+            del os.environ['SITETOOLS_LOG_STACK_SAMPLE']
+
+        msgs = [self.receive() for _ in xrange(6)]
+        self.assertEqual([m['_python_stack_count'] for m in msgs], [1, 2, 3, 4, 5, 1])
+        self.assertEqual(['_python_stack' in m for m in msgs], [True, False, True, False, True, True])
+        self.assertEqual(len(set(m['_python_stack_fingerprint'] for m in msgs[:5])), 1)
+        self.assertNotEqual(msgs[0]['_python_stack_fingerprint'], msgs[5]['_python_stack_fingerprint'])
@@ -0,0 +1,118 @@
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+from . import *
+
+from sitetools.importindex import IndexedFinder, get_module_names
+
+
+class TestIndexedFinder(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dirs = []
+        for i in range(3):
+            path = os.path.join(self.root, 'dir%d' % i)
+            os.makedirs(path)
+            self.dirs.append(path)
+
+        self._sys_path = list(sys.path)
+        self._meta_path = list(sys.meta_path)
+        self._modules = set(sys.modules)
+
+        self.finder = IndexedFinder()
+        sys.meta_path.insert(0, self.finder)
+        sys.path[:0] = self.dirs
+
+    def tearDown(self):
+        sys.path[:] = self._sys_path
+        sys.meta_path[:] = self._meta_path
+        for name in set(sys.modules) - self._modules:
+            del sys.modules[name]
+        shutil.rmtree(self.root)
+
+    def write(self, path, content=''):
+        path = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(content)
+
+    def test_module_names(self):
+        self.assertEqual(
+            get_module_names(['a.py', 'b.pyc', 'c', '.d.py', 'e.txt']),
+            set(['a', 'b', 'c']),
+        )
+        self.assertEqual(get_module_names(['barmodule.so']), set(['bar', 'barmodule']))
+
+    def test_order(self):
+        self.write('dir1/sitetools_test_mod.py', 'value = 1')
+        self.write('dir2/sitetools_test_mod.py', 'value = 2')
+        import sitetools_test_mod
+        self.assertEqual(sitetools_test_mod.value, 1)
+        self.assertEqual(self.finder.find_module('sitetools_test_mod').found[1], os.path.join(self.dirs[1], 'sitetools_test_mod.py'))
+
+    def test_not_a_package(self):
+        # A directory without an __init__ does not shadow a later module.
+        os.makedirs(os.path.join(self.dirs[0], 'sitetools_test_mod'))
+        self.write('dir2/sitetools_test_pkg/__init__.py', 'value = 2')
+        self.write('dir2/sitetools_test_mod.py', 'value = 2')
+        import sitetools_test_mod
+        import sitetools_test_pkg
+        self.assertEqual(sitetools_test_mod.value, 2)
+        self.assertEqual(sitetools_test_pkg.value, 2)
+
+    def test_submodules_and_builtins(self):
+        self.assertIsNone(self.finder.find_module('sys'))
+        self.assertIsNone(self.finder.find_module('os.path'))
+        self.assertIsNone(self.finder.find_module('x', ['/']))
+
+    def test_barrier(self):
+        zip_path = os.path.join(self.root, 'archive.zip')
+        with zipfile.ZipFile(zip_path, 'w') as zf:
+            zf.writestr('sitetools_test_mod.py', 'value = 1')
+        sys.path.insert(1, zip_path)
+        self.write('dir2/sitetools_test_mod.py', 'value = 2')
+        self.assertIsNone(self.finder.find_module('sitetools_test_mod'))
+        import sitetools_test_mod
+        self.assertEqual(sitetools_test_mod.value, 1)
+
+    def test_path_hooks(self):
+        # A hook which claims an uncached directory stops the index there.
+        claimed = self.dirs[1]
+        def hook(entry):
+            if entry != claimed:
+                raise ImportError(entry)
+            return self
+        sys.path_hooks.insert(0, hook)
+        try:
+            for entry in self.dirs:
+                sys.path_importer_cache.pop(entry, None)
+            self.write('dir2/sitetools_test_mod.py', 'value = 2')
+            self.assertIsNone(self.finder.find_module('sitetools_test_mod'))
+            self.assertIs(sys.path_importer_cache[claimed], self)
+            self.assertIsNone(sys.path_importer_cache[self.dirs[0]])
+        finally:
+            sys.path_hooks.remove(hook)
+            for entry in self.dirs:
+                sys.path_importer_cache.pop(entry, None)
+
+    def find_module(self, fullname, path=None):
+        # For test_path_hooks, as the importer its hook returns.
+        return None
+
+    def test_path_changes(self):
+        self.write('dir2/sitetools_test_mod.py', 'value = 2')
+        self.assertIsNotNone(self.finder.find_module('sitetools_test_mod'))
+        sys.path.remove(self.dirs[2])
+        self.assertIsNone(self.finder.find_module('sitetools_test_mod'))
+
+    def test_seeded_listing(self):
+        self.write('dir2/sitetools_test_mod.py', 'value = 2')
+        self.finder.add_listing(self.dirs[2], [])
+        self.assertIsNone(self.finder.find_module('sitetools_test_mod'))
+        self.finder.invalidate_caches()
+        self.assertIsNotNone(self.finder.find_module('sitetools_test_mod'))
@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import *
+
+from sitetools import instrument, sites
+
+
+class TestInstrument(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        instrument.stop_profiling()
+        shutil.rmtree(self.root)
+
+    def test_counter(self):
+        with instrument.FSCounter() as counter:
+            os.listdir(self.root)
+            os.path.exists(self.root)
+            open(os.path.join(self.root, 'x'), 'w').close()
+        os.listdir(self.root)
+        self.assertEqual(counter.counts, {'listdir': 1, 'stat': 1, 'open': 1})
+
+    def test_counter_latency(self):
+        with instrument.FSCounter(root=self.root, latency=0.05) as counter:
+            start = time.time()
+            os.listdir(self.root)
+            os.path.exists(self.root)
+            elapsed = time.time() - start
+        self.assertEqual(counter.counts, {'listdir': 1, 'stat': 1})
+        self.assertGreaterEqual(elapsed, 0.1)
+
+    def test_spans(self):
+
+        with instrument.span('basic') as span:
+            os.listdir(self.root)
+            sites.scan_site_dir(self.root)
+        self.assertIsNotNone(span.wall_time)
+        self.assertIsNone(span.rss)
+        # Only those counted by the sites module.
+        self.assertEqual(span.fs_calls, {'listdir': 1})
+
+        with instrument.span('detail', detail=True) as span:
+            pass
+        self.assertIsNone(span)
+
+        instrument.start_profiling()
+        with instrument.span('profiled') as span:
+            os.listdir(self.root)
+        self.assertEqual(span.fs_calls, {'listdir': 1})
+        self.assertIn(span, instrument.get_spans())
+
+    def test_startup_trace(self):
+
+        site = os.path.join(self.root, 'site')
+        os.makedirs(os.path.join(site, 'package'))
+        trace_path = os.path.join(self.root, 'trace.{pid}.{other}.json')
+
+        env = dict(os.environ)
+        env['SITETOOLS_SITES'] = site
+        env['SITETOOLS_STARTUP_TRACE'] = trace_path
+        env['PYTHONPATH'] = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        proc = subprocess.Popen([sys.executable, '-c', 'import os, sitetools._startup; print os.getpid()'], env=env, stdout=subprocess.PIPE)
+        pid = int(proc.communicate()[0].strip())
+
+        with open(trace_path.replace('{pid}', str(pid))) as fh:
+            events = json.load(fh)['traceEvents']
+        by_name = dict((e['name'], e) for e in events)
+        self.assertIn('sitetools.sites._setup', by_name)
+        self.assertIn('scan %s' % site, by_name)
+        fs_calls = by_name['scan %s' % site]['args']['fs_calls']
+        self.assertEqual(fs_calls.get('listdir', 0) + fs_calls.get('scandir', 0), 1)
+        for event in events:
+            self.assertEqual(event['ph'], 'X')
+            self.assertEqual(event['pid'], pid)
@@ -0,0 +1,175 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from . import *
+
+from sitetools.logqueue import QueueHandler
+
+
+class GatedHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.threads = set()
+        self.prepared = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def prepare(self, record):
+        self.prepared.append(threading.current_thread())
+
+    def emit(self, record):
+        self.gate.wait()
+        self.threads.add(threading.current_thread())
+        self.records.append(record)
+
+
+class TestQueueHandler(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('sitetools.test.queue')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.target = GatedHandler()
+
+    def tearDown(self):
+        if isinstance(self.target, GatedHandler):
+            self.target.gate.set()
+        for handler in self.logger.handlers:
+            handler.close()
+        self.logger.handlers[:] = []
+
+    def install(self, **kwargs):
+        handler = QueueHandler([self.target], **kwargs)
+        self.logger.addHandler(handler)
+        return handler
+
+    def messages(self):
+        return [r.getMessage() for r in self.target.records]
+
+    def test_background(self):
+        handler = self.install()
+        value = ['before']
+        self.logger.info('value is %s', value)
+        value[0] = 'after'
+        handler.flush()
+        self.assertEqual(self.messages(), ["value is ['before']"])
+        self.assertNotIn(threading.current_thread(), self.target.threads)
+        self.assertEqual(self.target.prepared, [threading.current_thread()])
+        self.assertEqual(handler.handled, 1)
+
+    def test_drop_new(self):
+        handler = self.install(maxsize=2, overflow='drop-new')
+        self.target.gate.clear()
+        self.logger.info('blocker')
+        handler._thread.join(0.05) # Let it pick up the blocker.
+        for i in range(5):
+            self.logger.info('%d', i)
+        self.assertEqual(handler.dropped, 3)
+        self.target.gate.set()
+        handler.flush()
+        self.assertEqual(self.messages(), ['blocker', '0', '1'])
+
+    def test_drop_oldest(self):
+        handler = self.install(maxsize=2, overflow='drop-oldest')
+        self.target.gate.clear()
+        self.logger.info('blocker')
+        handler._thread.join(0.05)
+        for i in range(5):
+            self.logger.info('%d', i)
+        self.assertEqual(handler.dropped, 3)
+        self.target.gate.set()
+        handler.flush()
+        self.assertEqual(self.messages(), ['blocker', '3', '4'])
+
+    def test_block(self):
+        handler = self.install(maxsize=1, overflow='block')
+        self.target.gate.clear()
+        self.logger.info('blocker')
+        handler._thread.join(0.05)
+        self.logger.info('queued')
+
+        done = threading.Event()
+        def log():
+            self.logger.info('blocked')
+            done.set()
+        thread = threading.Thread(target=log)
+        thread.start()
+        self.assertFalse(done.wait(0.1))
+
+        self.target.gate.set()
+        thread.join()
+        handler.flush()
+        self.assertEqual(self.messages(), ['blocker', 'queued', 'blocked'])
+        self.assertEqual(handler.dropped, 0)
+
+    def test_block_nested(self):
+
+        # The real handler logs through the queue while another thread is
+        # waiting for space in it.
+        logger = self.logger
+        class NestingHandler(GatedHandler):
+            def emit(self, record):
+                self.gate.wait()
+                if record.getMessage() == 'blocker':
+                    logger.info('nested')
+                self.records.append(record)
+        self.target = NestingHandler()
+
+        handler = self.install(maxsize=1, overflow='block')
+        self.target.gate.clear()
+        self.logger.info('blocker')
+        handler._thread.join(0.05)
+        self.logger.info('queued')
+
+        thread = threading.Thread(target=self.logger.info, args=('blocked', ))
+        thread.daemon = True
+        thread.start()
+        thread.join(0.05)
+        self.target.gate.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        handler.flush()
+        self.assertEqual(self.messages(), ['nested', 'blocker', 'queued', 'blocked'])
+
+    def test_close_reports_drops(self):
+        handler = self.install(maxsize=1, overflow='drop-new')
+        self.target.gate.clear()
+        self.logger.info('blocker')
+        handler._thread.join(0.05)
+        self.logger.info('queued')
+        self.logger.info('dropped')
+        self.target.gate.set()
+        handler.close()
+        self.assertEqual(self.messages(), ['blocker', 'queued', 'dropped 1 log records due to a full queue'])
+
+    def test_fork(self):
+
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'log')
+            self.target = logging.FileHandler(path)
+            self.target.setFormatter(logging.Formatter('%(process)d %(message)s'))
+            handler = self.install()
+
+            pid = os.fork()
+            if not pid:
+                try:
+                    self.logger.info('child')
+                    handler.flush()
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+
+            self.logger.info('parent')
+            handler.flush()
+            with open(path) as fh:
+                lines = sorted(fh.read().splitlines())
+            self.assertEqual(lines, sorted(['%d child' % pid, '%d parent' % os.getpid()]))
+
+        finally:
+            shutil.rmtree(tmp)
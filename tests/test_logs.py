@@ -0,0 +1,141 @@
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from . import *
+
+from sitetools import logs
+
+
+def text_line(stamp, login, ip, pid, level, message):
+    return '%s,000 %s@%s:%d %s test: %s\n' % (stamp, login, ip, pid, level, message)
+
+
+class TestLogs(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pattern = os.path.join(self.root, 'logs', '{date}', '{login}@{ip}', '{time}.{pid}.log')
+        self.index = os.path.join(self.root, 'index.json')
+
+        self.write('2013-01-21/alice@10.0.0.1/09-00-00.100.log', [
+            text_line('2013-01-21 09:00:00', 'alice', '10.0.0.1', 100, 'INFO', 'a1'),
+            text_line('2013-01-21 09:00:02', 'alice', '10.0.0.1', 100, 'ERROR', 'a2'),
+            'Traceback (most recent call last):\n',
+            'ValueError: oops\n',
+            text_line('2013-01-21 09:00:04', 'alice', '10.0.0.1', 100, 'INFO', 'a3'),
+        ])
+        self.write('2013-01-21/bob@10.0.0.2/09-00-01.200.log', [
+            text_line('2013-01-21 09:00:01', 'bob', '10.0.0.2', 200, 'INFO', 'b1'),
+            text_line('2013-01-21 09:00:03', 'bob', '10.0.0.2', 200, 'WARNING', 'b2'),
+        ])
+        base = time.mktime(time.strptime('2013-01-22 10:00:00', '%Y-%m-%d %H:%M:%S'))
+        self.write('2013-01-22/alice@10.0.0.1/10-00-00.300.log', [
+            json.dumps({'time': base + 0.5, 'level': 'INFO', 'logger': 'test', 'message': 'c1', 'pid': 300}) + '\n',
+            json.dumps({'time': base + 1.5, 'level': 'DEBUG', 'logger': 'test', 'message': 'c2', 'pid': 300}) + '\n',
+        ])
+        self.write('2013-01-22/alice@10.0.0.1/10-00-00.300.log.1.gz', [
+            json.dumps({'time': base + 1.0, 'level': 'INFO', 'logger': 'test', 'message': 'c0', 'pid': 300}) + '\n',
+        ])
+        self.write('2013-01-22/alice@10.0.0.1/unrelated.txt', ['nothing\n'])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, rel_path, lines):
+        path = os.path.join(self.root, 'logs', rel_path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'wb') as fh:
+            fh.write(''.join(lines))
+        return path
+
+    def tree(self):
+        return logs.LogTree(self.pattern, self.index)
+
+    def names(self, files):
+        return [os.path.relpath(f.path, os.path.join(self.root, 'logs')) for f in files]
+
+    def test_find(self):
+        tree = self.tree()
+        self.assertEqual(self.names(tree.find()), [
+            '2013-01-21/alice@10.0.0.1/09-00-00.100.log',
+            '2013-01-21/bob@10.0.0.2/09-00-01.200.log',
+            '2013-01-22/alice@10.0.0.1/10-00-00.300.log',
+            '2013-01-22/alice@10.0.0.1/10-00-00.300.log.1.gz',
+        ])
+        self.assertEqual(len(tree.find(login='alice')), 3)
+        self.assertEqual(len(tree.find(ip='10.0.0.2')), 1)
+        self.assertEqual(len(tree.find(pid=300)), 2)
+        self.assertEqual(len(tree.find(since='2013-01-22')), 2)
+        self.assertEqual(len(tree.find(until='2013-01-21')), 2)
+        self.assertEqual(self.names(tree.find(level=logging.WARNING)), [
+            '2013-01-21/alice@10.0.0.1/09-00-00.100.log',
+            '2013-01-21/bob@10.0.0.2/09-00-01.200.log',
+        ])
+
+    def test_incremental(self):
+
+        tree = self.tree()
+        tree.find(level=logging.ERROR)
+        tree.save_index()
+
+        # Nothing changed, so nothing is listed.
+        original = os.listdir
+        listed = []
+        def listdir(path):
+            listed.append(path)
+            return original(path)
+        os.listdir = listdir
+        try:
+            tree = self.tree()
+            self.assertEqual(len(tree.find(level=logging.ERROR)), 1)
+        finally:
+            os.listdir = original
+        self.assertEqual(listed, [])
+
+        # A new log changes the mtime of its directory.
+        path = self.write('2013-01-21/bob@10.0.0.2/12-00-00.400.log', [
+            text_line('2013-01-21 12:00:00', 'bob', '10.0.0.2', 400, 'ERROR', 'd1'),
+        ])
+        dir_path = os.path.dirname(path)
+        os.utime(dir_path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(len(self.tree().find(level=logging.ERROR)), 2)
+
+    def test_pruned_walk(self):
+        tree = self.tree()
+        tree.find(since='2013-01-22')
+        self.assertEqual(sorted(tree._index['dirs']), ['', '2013-01-22', '2013-01-22/alice@10.0.0.1'])
+
+    def test_merge(self):
+        tree = self.tree()
+        records = list(logs.merge_records(tree.find()))
+        self.assertEqual([r['message'].split('\n')[0] for r in records], ['a1', 'b1', 'a2', 'b2', 'a3', 'c1', 'c0', 'c2'])
+        self.assertIn('ValueError: oops', records[2]['message'])
+        self.assertEqual(records[2]['pid'], 100)
+        self.assertEqual(records[2]['login'], 'alice')
+
+        records = list(logs.merge_records(tree.find(), level=logging.WARNING))
+        self.assertEqual([r['message'].split('\n')[0] for r in records], ['a2', 'b2'])
+
+    def test_lazy_open(self):
+
+        opened = []
+        original = logs.LogFile.open
+        def open_(self):
+            opened.append(self.fields['pid'])
+            return original(self)
+        logs.LogFile.open = open_
+        try:
+            records = logs.merge_records(self.tree().find())
+            self.assertEqual(next(records)['message'], 'a1')
+            self.assertEqual(opened, ['100'])
+            self.assertEqual(next(records)['message'], 'b1')
+            self.assertEqual(opened, ['100', '200'])
+        finally:
+            logs.LogFile.open = original
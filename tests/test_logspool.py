@@ -0,0 +1,165 @@
+import gzip
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+from . import *
+
+from sitetools.logspool import SpooledFileHandler, recover
+
+
+class TestSpooledFileHandler(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.spool = os.path.join(self.root, 'spool')
+        self.target = os.path.join(self.root, 'logs', 'test.%d.log' % os.getpid())
+        self.logger = logging.getLogger('sitetools.test.logspool')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.handler = None
+
+    def tearDown(self):
+        self.logger.handlers[:] = []
+        if self.handler is not None:
+            self.handler.close()
+        shutil.rmtree(self.root)
+
+    def make_handler(self, **kwargs):
+        self.handler = SpooledFileHandler(os.path.join(self.root, 'logs', 'test.{pid}.log'), self.spool, **kwargs)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger.addHandler(self.handler)
+        return self.handler
+
+    def spooled(self):
+        paths = []
+        for dir_path, _, file_names in os.walk(self.spool):
+            paths.extend(os.path.join(dir_path, x) for x in file_names if x.endswith('.spool'))
+        return paths
+
+    def read(self, path):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path) as fh:
+            return fh.read()
+
+    def test_buffered(self):
+
+        handler = self.make_handler()
+        self.logger.info('one')
+        self.logger.info('two')
+        self.assertEqual(self.spooled(), [])
+
+        handler.flush()
+        spooled = self.spooled()
+        self.assertEqual(len(spooled), 1)
+        self.assertEqual(self.read(spooled[0]), 'one\ntwo\n')
+        self.assertFalse(os.path.exists(self.target))
+
+        self.logger.info('three')
+        handler.close()
+        self.assertEqual(self.read(self.target), 'one\ntwo\nthree\n')
+        self.assertEqual(self.spooled(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.spool, self.root.lstrip(os.sep))))
+
+    def test_error_flushes(self):
+        self.make_handler()
+        self.logger.info('one')
+        self.logger.error('two')
+        self.assertEqual(self.read(self.spooled()[0]), 'one\ntwo\n')
+
+    def test_flush_interval(self):
+        handler = self.make_handler()
+        handler.flush_interval = 0.05
+        self.logger.info('one')
+        deadline = time.time() + 5
+        while not (self.spooled() and os.path.getsize(self.spooled()[0])) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.read(self.spooled()[0]), 'one\n')
+
+    def test_rotate(self):
+
+        handler = self.make_handler(max_bytes=20, compress=True)
+        handler.flush_size = 1
+        lines = ['line %02d' % i for i in xrange(10)]
+        for line in lines:
+            self.logger.info(line)
+        handler.close()
+
+        # 8 bytes per line, so 3 lines per segment.
+        paths = [self.target + '.%d.gz' % i for i in (1, 2)] + [self.target + '.3']
+        self.assertEqual(self.read(self.target + '.gz'), '\n'.join(lines[:3]) + '\n')
+        self.assertEqual(''.join(self.read(p) for p in paths), '\n'.join(lines[3:]) + '\n')
+        self.assertEqual(handler.moved, 4)
+
+    def test_recover(self):
+
+        orphan = os.path.join(self.root, 'logs', 'dead.log')
+        spooled = os.path.join(self.spool, orphan.lstrip(os.sep)) + '.12345.spool'
+        os.makedirs(os.path.dirname(spooled))
+        with open(spooled, 'w') as fh:
+            fh.write('from the dead\n')
+
+        handler = self.make_handler()
+        self.logger.info('one')
+        handler.close()
+        self.assertEqual(self.read(orphan), 'from the dead\n')
+        self.assertEqual(self.read(self.target), 'one\n')
+        self.assertEqual(self.spooled(), [])
+
+    def test_recover_relative(self):
+
+        os.makedirs(os.path.join(self.root, 'cwd'))
+        cwd = os.getcwd()
+        os.chdir(os.path.join(self.root, 'cwd'))
+        try:
+            handler = self.handler = SpooledFileHandler('relative.log', self.spool)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.info('one')
+            handler.flush()
+        finally:
+            os.chdir(cwd)
+
+        # Pretend we died, letting go of the segment.
+        handler._segment[0].close()
+        handler._segment = None
+
+        self.assertEqual(recover(self.spool), 1)
+        self.assertEqual(self.read(os.path.join(self.root, 'cwd', 'relative.log')), 'one\n')
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_fork_during_write(self):
+
+        handler = self.make_handler()
+        self.logger.info('parent')
+
+        # As if the parent's thread was writing when we forked.
+        locked = threading.Event()
+        release = threading.Event()
+        def hold():
+            with handler.lock:
+                locked.set()
+                release.wait()
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait()
+
+        try:
+            pid = os.fork()
+            if not pid:
+                try:
+                    signal.alarm(5)
+                    self.logger.info('child')
+                    handler.flush()
+                finally:
+                    os._exit(0)
+        finally:
+            release.set()
+            thread.join()
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
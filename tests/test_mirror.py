@@ -0,0 +1,164 @@
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+from . import *
+
+from sitetools import mirror, sites
+
+
+class TestMirror(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.site = os.path.join(self.root, 'site')
+        os.makedirs(os.path.join(self.site, 'package'))
+        with open(os.path.join(self.site, 'package', '__init__.py'), 'w') as fh:
+            fh.write('value = 1\n')
+        self._cache_dir = os.environ.get('SITETOOLS_CACHE_DIR')
+        os.environ['SITETOOLS_CACHE_DIR'] = os.path.join(self.root, 'cache')
+
+    def tearDown(self):
+        mirror._originals.clear()
+        mirror._pending.clear()
+        if self._cache_dir is None:
+            os.environ.pop('SITETOOLS_CACHE_DIR', None)
+        else:
+            os.environ['SITETOOLS_CACHE_DIR'] = self._cache_dir
+        shutil.rmtree(self.root)
+
+    def test_no_manifest(self):
+        self.assertIsNone(mirror.get_mirror(self.site))
+        self.assertEqual(mirror.mirror_sites([self.site], ['*']), [self.site])
+
+    def test_mirror(self):
+
+        digest = mirror.write_manifest(self.site)
+        self.assertEqual(mirror.get_manifest_hash(self.site), digest)
+
+        path = mirror.get_mirror(self.site)
+        self.assertTrue(path.startswith(os.environ['SITETOOLS_CACHE_DIR']))
+        with open(os.path.join(path, 'package', '__init__.py')) as fh:
+            self.assertEqual(fh.read(), 'value = 1\n')
+        self.assertEqual(mirror.get_mirror(self.site, copy=False), path)
+
+        # A new version is copied alongside the old one.
+        with open(os.path.join(self.site, 'package', '__init__.py'), 'w') as fh:
+            fh.write('value = 2\n')
+        os.utime(os.path.join(self.site, 'package', '__init__.py'), (time.time() + 10, time.time() + 10))
+        self.assertEqual(mirror.get_mirror(self.site), path)
+        mirror.write_manifest(self.site)
+        self.assertIsNone(mirror.get_mirror(self.site, copy=False))
+        new_path = mirror.get_mirror(self.site)
+        self.assertNotEqual(new_path, path)
+        with open(os.path.join(new_path, 'package', '__init__.py')) as fh:
+            self.assertEqual(fh.read(), 'value = 2\n')
+        self.assertTrue(os.path.exists(path))
+
+    def test_prune(self):
+        mirror.write_manifest(self.site)
+        paths = [mirror.get_mirror(self.site)]
+        for i in range(2):
+            open(os.path.join(self.site, 'new%d.py' % i), 'w').close()
+            mirror.write_manifest(self.site)
+            paths.append(mirror.get_mirror(self.site))
+        for path, age in zip(paths, (3, 2, 0.5)):
+            then = time.time() - age * mirror.prune_age
+            os.utime(path, (then, then))
+
+        # The first was superseded long ago, but the second only recently.
+        open(os.path.join(self.site, 'new.py'), 'w').close()
+        mirror.write_manifest(self.site)
+        self.assertIsNotNone(mirror.get_mirror(self.site))
+        self.assertEqual([os.path.exists(x) for x in paths], [False, True, True])
+
+    def test_locked(self):
+        mirror.write_manifest(self.site)
+        root = mirror.get_mirror_root(self.site)
+        os.makedirs(root)
+        with open(os.path.join(root, '.lock'), 'w') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            # flock locks are per open file, so this conflicts even in-process.
+            self.assertIsNone(mirror.get_mirror(self.site))
+        self.assertIsNotNone(mirror.get_mirror(self.site))
+
+    def test_unlockable(self):
+        mirror.write_manifest(self.site)
+        os.makedirs(os.path.join(mirror.get_mirror_root(self.site), '.lock'))
+        self.assertIsNone(mirror.get_mirror(self.site))
+        self.assertEqual(mirror.mirror_sites([self.site], ['*']), [self.site])
+
+    def test_setup_failure(self):
+
+        mirror.write_manifest(self.site)
+        environ = dict(os.environ)
+        sys_path = list(sys.path)
+        processed_pths = set(sites._processed_pths)
+        original = mirror.mirror_sites
+        def fail(*args, **kwargs):
+            raise RuntimeError('oops')
+
+        os.environ['SITETOOLS_SITES'] = self.site
+        os.environ['SITETOOLS_MIRROR_SITES'] = '*'
+        os.environ['SITETOOLS_SITES_CACHE'] = '0'
+        mirror.mirror_sites = fail
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                sites._setup()
+            self.assertEqual(len(caught), 1)
+            self.assertIn(self.site, sys.path)
+        finally:
+            mirror.mirror_sites = original
+            os.environ.clear()
+            os.environ.update(environ)
+            sys.path[:] = sys_path
+            sites._processed_pths.clear()
+            sites._processed_pths.update(processed_pths)
+            sites._snapshot = None
+
+    def test_patterns(self):
+        mirror.write_manifest(self.site)
+        other = os.path.join(self.root, 'other')
+        res = mirror.mirror_sites([self.site, other], [os.path.join(self.root, 's*')], wait=True)
+        self.assertEqual(res[0], mirror.get_mirror(self.site, copy=False))
+        self.assertEqual(res[1], other)
+
+    def test_background(self):
+        mirror.write_manifest(self.site)
+
+        # The original is used until the copy is done.
+        self.assertEqual(mirror.mirror_sites([self.site], ['*']), [self.site])
+        self.assertIn(self.site, mirror._pending)
+
+        deadline = time.time() + 10
+        while mirror.get_mirror(self.site, copy=False) is None and time.time() < deadline:
+            time.sleep(0.05)
+        path = mirror.get_mirror(self.site, copy=False)
+        self.assertEqual(mirror._pending[self.site], path)
+        self.assertEqual(mirror.mirror_sites([self.site], ['*']), [path])
+
+    def test_relative_pth(self):
+
+        os.makedirs(os.path.join(self.site, 'tool', 'python'))
+        os.makedirs(os.path.join(self.root, 'shared'))
+        with open(os.path.join(self.site, 'tool', '__site__.pth'), 'w') as fh:
+            fh.write('python\n../../shared\n')
+        mirror.write_manifest(self.site)
+        path = mirror.get_mirror(self.site)
+
+        sys_path = list(sys.path)
+        processed_pths = set(sites._processed_pths)
+        try:
+            sites.add_site_dir(path)
+            # Within the site is within the copy, but outside of it is not.
+            self.assertIn(os.path.join(path, 'tool', 'python'), sys.path)
+            self.assertIn(os.path.join(self.root, 'shared'), sys.path)
+        finally:
+            sys.path[:] = sys_path
+            sites._processed_pths.clear()
+            sites._processed_pths.update(processed_pths)
@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from . import *
+
+from sitetools import platform
+
+
+_bootstrap = '''
+import json, os, sys
+import sitetools._startup
+sys.stdout.write(json.dumps({
+    'distutils': 'distutils' in sys.modules,
+    'specs': os.environ.get('SITETOOLS_PLATFORM_SPECS'),
+    'path': sys.path,
+}))
+'''
+
+
+class TestPlatformSpecs(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.site = os.path.join(self.root, 'site')
+        os.makedirs(os.path.join(self.site, 'tool'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def run_startup(self, pth, env=None):
+
+        with open(os.path.join(self.site, 'tool', '__site__.pth'), 'w') as fh:
+            fh.write(pth)
+
+        environ = dict((k, v) for k, v in os.environ.iteritems() if not k.startswith('SITETOOLS_'))
+        environ.update(env or {})
+        environ['SITETOOLS_SITES'] = self.site
+        environ['PYTHONPATH'] = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+        proc = subprocess.Popen([sys.executable, '-c', _bootstrap], env=environ,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode:
+            self.fail('startup failed:\n%s' % err)
+        return json.loads(out)
+
+    def test_not_used(self):
+        res = self.run_startup('python\n')
+        self.assertFalse(res['distutils'])
+        self.assertIsNone(res['specs'])
+
+    def test_used(self):
+        res = self.run_startup('build/{extended_platform_spec}\n')
+        self.assertTrue(res['distutils'])
+        self.assertEqual(res['specs'].split(':')[0], platform.get_host_key())
+        self.assertEqual(res['specs'].split(':')[2], platform.get_extended_platform_spec())
+
+    def test_inherited(self):
+        specs = '%s:basic:extended' % platform.get_host_key()
+        os.makedirs(os.path.join(self.site, 'tool', 'build', 'extended'))
+        res = self.run_startup('build/{extended_platform_spec}\n', {'SITETOOLS_PLATFORM_SPECS': specs})
+        self.assertFalse(res['distutils'])
+        self.assertIn(os.path.join(self.site, 'tool', 'build', 'extended'), res['path'])
+
+    def test_other_host(self):
+        res = self.run_startup('build/{extended_platform_spec}\n', {'SITETOOLS_PLATFORM_SPECS': 'elsewhere:basic:extended'})
+        self.assertTrue(res['distutils'])
+
+    def test_cached(self):
+        env = {'SITETOOLS_CACHE_DIR': os.path.join(self.root, 'cache'), 'SITETOOLS_SITES_CACHE': '0'}
+        self.assertTrue(self.run_startup('build/{extended_platform_spec}\n', env)['distutils'])
+        res = self.run_startup('build/{extended_platform_spec}\n', env)
+        self.assertFalse(res['distutils'])
+        self.assertEqual(res['specs'].split(':')[2], platform.get_extended_platform_spec())
+
+    def test_deprecated_attributes(self):
+
+        import warnings
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            from sitetools.platform import basic_platform_spec, extended_platform_spec
+        self.assertEqual(basic_platform_spec, platform.get_basic_platform_spec())
+        self.assertEqual(extended_platform_spec, platform.get_extended_platform_spec())
+        self.assertEqual([x.category for x in caught], [DeprecationWarning] * 2)
+
+        # Everything else is still the real module.
+        specs = platform._specs
+        platform._specs = None
+        try:
+            self.assertIsNone(platform.get_platform_specs.__globals__['_specs'])
+        finally:
+            platform._specs = specs
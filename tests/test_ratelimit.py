@@ -0,0 +1,121 @@
+import logging
+import time
+
+from . import *
+
+from sitetools.ratelimit import RateLimitFilter, _parse_spec
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestRateLimit(TestCase):
+
+    def setUp(self):
+        self.root = logging.getLogger('sitetools.test.ratelimit')
+        self.root.propagate = False
+        self.root.setLevel(logging.DEBUG)
+        self.handlers = [ListHandler(), ListHandler()]
+        self.filter = RateLimitFilter(1, burst=3, interval=3600)
+        for handler in self.handlers:
+            handler.addFilter(self.filter)
+            self.root.addHandler(handler)
+
+        # Summaries go through the real module logger, so catch them there.
+        self.summaries = ListHandler()
+        self.summary_logger = logging.getLogger('sitetools.ratelimit')
+        self.summary_logger.addHandler(self.summaries)
+
+    def tearDown(self):
+        self.filter.close()
+        self.root.handlers[:] = []
+        self.summary_logger.removeHandler(self.summaries)
+
+    def messages(self, handler):
+        return [r.getMessage() for r in handler.records]
+
+    def test_burst(self):
+        for i in xrange(10):
+            self.root.warning('storm %d', i)
+        self.root.warning('elsewhere')
+        for handler in self.handlers:
+            self.assertEqual(self.messages(handler), ['storm 0', 'storm 1', 'storm 2', 'elsewhere'])
+        self.assertEqual(self.filter.suppressed, 7)
+
+    def test_templates(self):
+        # Different messages from the same line are limited separately.
+        for i in xrange(6):
+            self.root.warning('odd %d' if i % 2 else 'even %d', i)
+        self.assertEqual(len(self.handlers[0].records), 6)
+        self.assertEqual(self.filter.suppressed, 0)
+
+    def test_refill(self):
+        for i in xrange(8):
+            if i == 5:
+                for bucket in self.filter._buckets.itervalues():
+                    bucket[1] -= 2
+            self.root.warning('storm %d', i)
+        self.assertEqual(self.messages(self.handlers[0]), ['storm 0', 'storm 1', 'storm 2', 'storm 5', 'storm 6'])
+
+    def test_summary(self):
+        for i in xrange(10):
+            self.root.warning('storm %d', i)
+        self.assertEqual(self.summaries.records, [])
+        self.filter._next_summary = time.time()
+        self.root.info('later')
+        self.assertEqual(len(self.summaries.records), 1)
+        self.assertIn('7 similar records suppressed', self.summaries.records[0].getMessage())
+        self.assertIn("'storm %d'", self.summaries.records[0].getMessage())
+        self.assertEqual(self.messages(self.handlers[0])[-1], 'later')
+
+    def test_unhashable_message(self):
+        for i in xrange(5):
+            self.root.warning({'a': i})
+        self.assertEqual(self.messages(self.handlers[0]), ["{'a': 0}", "{'a': 1}", "{'a': 2}"])
+        self.filter.flush()
+        self.assertIn('2 similar records suppressed', self.summaries.records[0].getMessage())
+        self.assertIn("'<dict>'", self.summaries.records[0].getMessage())
+
+    def test_never_raises(self):
+        record = logging.LogRecord('x', logging.INFO, __file__, 1, 'hello', None, None)
+        record.created = None
+        self.assertTrue(self.filter.filter(record))
+
+    def test_summary_after_storm(self):
+        self.filter = RateLimitFilter(1, burst=1, interval=0.05)
+        for handler in self.handlers:
+            handler.filters[:] = [self.filter]
+        for i in xrange(5):
+            self.root.warning('storm %d', i)
+        # Nothing else is logged, but the summary still arrives.
+        deadline = time.time() + 5
+        while not self.summaries.records and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.summaries.records), 1)
+        self.assertIn('4 similar records suppressed', self.summaries.records[0].getMessage())
+
+    def test_forget(self):
+        self.filter.max_keys = 10
+        for i in xrange(5):
+            self.root.warning('storm')
+        for i in xrange(100):
+            record = logging.LogRecord('sitetools.test', logging.INFO, 'file%d.py' % i, 1, 'hello', None, None)
+            self.filter.filter(record)
+        self.assertLessEqual(len(self.filter._buckets), self.filter.max_keys)
+        # The storm's suppressed count was summarized when it was forgotten.
+        self.assertIn("2 similar records suppressed", self.summaries.records[0].getMessage())
+        self.assertIn("'storm'", self.summaries.records[0].getMessage())
+
+    def test_spec(self):
+        self.assertEqual(_parse_spec('10'), (10, None, 60))
+        self.assertEqual(_parse_spec('10:100:5'), (10, 100, 5))
+        self.assertRaises(ValueError, _parse_spec, 'fast')
+        self.assertRaises(ValueError, _parse_spec, '0')
+        self.assertRaises(ValueError, _parse_spec, '1:2:3:4')
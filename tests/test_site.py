@@ -1,9 +1,16 @@
+import json
 import os
+import pwd
+import shutil
 import sys
+import tempfile
+import threading
+import time
 
 from . import *
 
-from sitetools.sites import Site
+from sitetools import sites, utils
+from sitetools.sites import Site, SysPathInserter
 
 
 class TestSite(TestCase):
@@ -44,4 +51,156 @@ class TestSite(TestCase):
     def test_not_in_venv(self):
         self.assertRaises(ValueError, Site, '/etc/hosts')
 
+    def test_stats(self):
+        site = Site(os.path.dirname(__file__))
+        self.assertIs(site.stat, site.python_path_stat)
+        site = Site(sys.executable)
+        self.assertEqual(site.python_path_stat.st_ino, os.stat(site.python_path).st_ino)
+
+
+class TestPrefixCache(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self._environ = dict(os.environ)
+        os.environ['SITETOOLS_CACHE_DIR'] = self.cache_dir
+        self.reset()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        self.reset()
+        shutil.rmtree(self.cache_dir)
+
+    def reset(self):
+        sites._prefixes.clear()
+        sites._new_prefixes.clear()
+        sites._cached_prefixes = None
+
+    def test_persistent(self):
+
+        not_venv = os.path.join(self.cache_dir, 'bin', 'python')
+        os.makedirs(os.path.dirname(not_venv))
+        open(not_venv, 'w').close()
+
+        sites.find_dev_sites([sys.executable, not_venv])
+        path = os.path.join(self.cache_dir, sites._get_prefix_cache_name())
+        with open(path) as fh:
+            data = json.load(fh)
+        self.assertEqual(data[os.path.abspath(sys.executable)][2], sys.prefix)
+        self.assertIsNone(data[not_venv][2])
+
+        # Prove that the cache is used by lying in it.
+        data[os.path.abspath(sys.executable)][2] = '/sitetools-test'
+        with open(path, 'w') as fh:
+            json.dump(data, fh)
+        self.reset()
+        self.assertEqual(Site(sys.executable).prefix, '/sitetools-test')
+
+        # ... but not if the executable has changed.
+        data[os.path.abspath(sys.executable)][1] -= 1
+        with open(path, 'w') as fh:
+            json.dump(data, fh)
+        self.reset()
+        self.assertEqual(Site(sys.executable).prefix, sys.prefix)
+
+    def test_process(self):
+        Site(sys.executable)
+        sites._prefixes[os.path.abspath(sys.executable)] = ('/sitetools-test', None)
+        self.assertEqual(Site(sys.executable).prefix, '/sitetools-test')
+
+
+
+
+class TestSysPathInserter(TestCase):
+
+    def setUp(self):
+        self._sys_path = list(sys.path)
+
+    def tearDown(self):
+        sys.path[:] = self._sys_path
+
+    def test_add(self):
+        sys.path[:] = ['/a', '/b']
+        prepend = SysPathInserter(1)
+        self.assertTrue(prepend.add('/c', check_exists=False))
+        self.assertEqual(sys.path, ['/a', '/c', '/b'])
+        self.assertFalse(prepend.add('/b', check_exists=False))
+
+    def test_remove_between_adds(self):
+        sys.path[:] = ['/a', '/b']
+        append = SysPathInserter()
+        self.assertTrue(append.add('/c', check_exists=False))
+        sys.path.remove('/c')
+        self.assertTrue(append.add('/c', check_exists=False))
+        self.assertEqual(sys.path, ['/a', '/b', '/c'])
+
+    def test_batch_order(self):
+
+        paths = ['/sitetools-test/%d' % i for i in range(5)]
+        sys.path[:] = ['/a', '/b']
+
+        prepend = SysPathInserter(1)
+        with prepend.batch():
+            for path in paths:
+                prepend.add(path, check_exists=False)
+            self.assertFalse(prepend.add(paths[0], check_exists=False))
+            self.assertFalse(prepend.add('/b', check_exists=False))
+
+            # Nothing happens until the batch ends.
+            self.assertEqual(sys.path, ['/a', '/b'])
+        self.assertEqual(sys.path, ['/a'] + paths + ['/b'])
+
+        # Outside changes are respected.
+        sys.path.remove(paths[0])
+        sys.path.append('/c')
+        append = SysPathInserter()
+        with append.batch():
+            self.assertTrue(append.add(paths[0], check_exists=False))
+            self.assertTrue(append.add('/d', check_exists=False))
+            self.assertFalse(append.add('/c', check_exists=False))
+            sys.path.append('/d')
+        self.assertEqual(sys.path, ['/a'] + paths[1:] + ['/b', '/c', '/d', paths[0]])
+
+
+class TestIterDevSites(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for user in 'a', 'b', 'slow':
+            os.makedirs(os.path.join(self.root, user, 'dev'))
+        os.makedirs(os.path.join(self.root, 'c'))
+
+        root = self.root
+        hung = self.hung = threading.Event()
+        class FakePwd(object):
+            def getpwnam(self, name):
+                if name == 'missing':
+                    raise KeyError(name)
+                if name == 'slow':
+                    time.sleep(0.5)
+                if name.startswith('hung'):
+                    hung.wait()
+                return pwd.struct_passwd((name, 'x', 0, 0, '', os.path.join(root, name), ''))
+
+        self._pwd = utils.pwd
+        utils.pwd = FakePwd()
+
+    def tearDown(self):
+        self.hung.set()
+        utils.pwd = self._pwd
+        shutil.rmtree(self.root)
+
+    def test_bulk(self):
+        found = sites.iter_dev_sites(['~/dev', '~/nope'], ['a', 'b', 'c', 'missing', 'slow', 'a'], timeout=0.1)
+        self.assertEqual(sorted((user, str(site)) for user, site in found), [
+            ('a', os.path.join(self.root, 'a', 'dev')),
+            ('b', os.path.join(self.root, 'b', 'dev')),
+        ])
 
+    def test_hung_lookups(self):
+        # Every thread hangs, so "a" is never even looked up.
+        start = time.time()
+        found = list(sites.iter_dev_sites(['~/dev'], ['hung1', 'hung2', 'a'], threads=2, timeout=0.2))
+        self.assertEqual(found, [])
+        self.assertLess(time.time() - start, 2)
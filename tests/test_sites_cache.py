@@ -0,0 +1,164 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from . import *
+
+from sitetools import sites
+
+
+class TestSitesCache(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.site = os.path.join(self.root, 'site')
+        self.cache_dir = os.path.join(self.root, 'cache')
+        os.makedirs(os.path.join(self.site, 'package', 'lib'))
+        with open(os.path.join(self.site, 'package', '__site__.pth'), 'w') as fh:
+            fh.write('lib\n')
+
+        self._environ = dict(os.environ)
+        self._sys_path = list(sys.path)
+        self._processed_pths = set(sites._processed_pths)
+        os.environ['SITETOOLS_SITES'] = self.site
+        os.environ['SITETOOLS_CACHE_DIR'] = self.cache_dir
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        sys.path[:] = self._sys_path
+        sites._processed_pths.clear()
+        sites._processed_pths.update(self._processed_pths)
+        sites._snapshot = None
+        shutil.rmtree(self.root)
+
+    def reset(self):
+        sys.path[:] = self._sys_path
+        sites._processed_pths.clear()
+        sites._processed_pths.update(self._processed_pths)
+        sites._snapshot = None
+
+    def setup_without_scanning(self):
+        original = sites.add_site_list
+        def fail(*args, **kwargs):
+            self.fail('add_site_list was called')
+        sites.add_site_list = fail
+        try:
+            sites._setup()
+        finally:
+            sites.add_site_list = original
+
+    def test_hit(self):
+
+        sites._setup()
+        expected = list(sys.path)
+        self.assertIn(os.path.join(self.site, 'package', 'lib'), expected)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        self.reset()
+        self.setup_without_scanning()
+        self.assertEqual(sys.path, expected)
+        self.assertFalse([x for x in sys.path if isinstance(x, unicode)])
+
+    def test_stale(self):
+
+        sites._setup()
+        self.reset()
+
+        pth_path = os.path.join(self.site, 'package', '__site__.pth')
+        with open(pth_path, 'w') as fh:
+            fh.write('lib\nother\n')
+        os.makedirs(os.path.join(self.site, 'package', 'other'))
+        st = os.stat(pth_path)
+        os.utime(pth_path, (st.st_atime, st.st_mtime + 10))
+
+        sites._setup()
+        self.assertIn(os.path.join(self.site, 'package', 'other'), sys.path)
+
+        # And the rebuilt cache is good again.
+        expected = list(sys.path)
+        self.reset()
+        self.setup_without_scanning()
+        self.assertEqual(sys.path, expected)
+
+    def test_stale_missing_target(self):
+
+        pth_path = os.path.join(self.site, 'package', '__site__.pth')
+        with open(pth_path, 'w') as fh:
+            fh.write('lib\nbuild\n')
+        build = os.path.join(self.site, 'package', 'build')
+
+        sites._setup()
+        self.assertNotIn(build, sys.path)
+        self.reset()
+
+        # Creating it changes the mtime of the package, but not of any site
+        # or *.pth.
+        os.makedirs(build)
+        sites._setup()
+        self.assertIn(build, sys.path)
+
+    def test_snapshot_missing_target(self):
+        pth_path = os.path.join(self.site, 'package', '__site__.pth')
+        with open(pth_path, 'w') as fh:
+            fh.write('lib\nbuild\n')
+        build = os.path.join(self.site, 'package', 'build')
+        self.publish()
+        os.makedirs(build)
+        sites._setup()
+        self.assertIn(build, sys.path)
+
+    def test_disabled(self):
+        os.environ['SITETOOLS_SITES_CACHE'] = '0'
+        sites._setup()
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def publish(self):
+        del os.environ['SITETOOLS_CACHE_DIR']
+        os.environ['SITETOOLS_PUBLISH_SNAPSHOT'] = '1'
+        sites._setup()
+        del os.environ['SITETOOLS_PUBLISH_SNAPSHOT']
+        expected = list(sys.path)
+        self.reset()
+        return expected
+
+    def test_snapshot(self):
+        expected = self.publish()
+        self.assertTrue(os.environ['SITETOOLS_SITES_SNAPSHOT'].startswith('{'))
+        self.setup_without_scanning()
+        self.assertEqual(sys.path, expected)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_snapshot_file(self):
+        original = sites._max_inline_snapshot
+        sites._max_inline_snapshot = 0
+        try:
+            expected = self.publish()
+        finally:
+            sites._max_inline_snapshot = original
+        path = os.environ['SITETOOLS_SITES_SNAPSHOT']
+        self.assertTrue(os.path.exists(path))
+        self.setup_without_scanning()
+        self.assertEqual(sys.path, expected)
+        sites._remove_snapshot(path)
+
+    def test_snapshot_stale(self):
+        self.publish()
+        pth_path = os.path.join(self.site, 'package', '__site__.pth')
+        with open(pth_path, 'w') as fh:
+            fh.write('lib\nother\n')
+        os.makedirs(os.path.join(self.site, 'package', 'other'))
+        st = os.stat(pth_path)
+        os.utime(pth_path, (st.st_atime, st.st_mtime + 10))
+        sites._setup()
+        self.assertIn(os.path.join(self.site, 'package', 'other'), sys.path)
+
+    def test_snapshot_other_sites(self):
+        self.publish()
+        other = os.path.join(self.root, 'other')
+        os.makedirs(other)
+        os.environ['SITETOOLS_SITES'] = other
+        sites._setup()
+        self.assertIn(other, sys.path)
+        self.assertNotIn(self.site, sys.path)
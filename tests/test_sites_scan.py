@@ -0,0 +1,136 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from . import *
+
+from sitetools import sites
+
+
+class TestScanSiteDir(TestCase):
+
+    def setUp(self):
+        self.site = tempfile.mkdtemp()
+        for i in range(20):
+            os.makedirs(os.path.join(self.site, 'package%d' % i))
+            open(os.path.join(self.site, 'module%d.py' % i), 'w').close()
+        os.makedirs(os.path.join(self.site, 'tool', 'python'))
+        with open(os.path.join(self.site, 'tool', '__site__.pth'), 'w') as fh:
+            fh.write('python\n')
+        with open(os.path.join(self.site, 'extra.pth'), 'w') as fh:
+            fh.write('# A comment.\ntool\n')
+        open(os.path.join(self.site, '.hidden.pth'), 'w').close()
+
+        self._sys_path = list(sys.path)
+        self._processed_pths = set(sites._processed_pths)
+
+    def tearDown(self):
+        sys.path[:] = self._sys_path
+        sites._processed_pths.clear()
+        sites._processed_pths.update(self._processed_pths)
+        shutil.rmtree(self.site)
+
+    def test_scan(self):
+
+        stats = sites.ScanStats()
+        scan = sites.scan_site_dir(self.site, stats)
+
+        self.assertEqual(
+            sorted(pth.path for pth in scan.pths),
+            sorted([
+                os.path.join(self.site, 'extra.pth'),
+                os.path.join(self.site, 'tool', '__site__.pth'),
+            ]),
+        )
+
+        # One listing, then one open (and fstat and read) for each real pth.
+        self.assertEqual(stats.listdir, 1)
+        if sites._get_scandir():
+            # Only the 21 directories and the top-level pth are opened.
+            self.assertEqual(stats.open, 22)
+        else:
+            # Every one of the 42 entries is probed once, plus the pth itself.
+            self.assertEqual(stats.open, 43)
+        self.assertEqual(stats.read, 2)
+
+    def test_missing(self):
+        stats = sites.ScanStats()
+        self.assertIsNone(sites.scan_site_dir(os.path.join(self.site, 'missing'), stats))
+        self.assertIsNone(sites.scan_site_dir(os.path.join(self.site, 'module0.py'), stats))
+        # A listing for each.
+        self.assertEqual(stats.total, 2)
+
+    def test_scandir_is_lazy(self):
+        # The backport is only imported once a directory is listed.
+        out = subprocess.check_output([sys.executable, '-c',
+            'import sys, sitetools.sites; print sorted(set(sys.modules) & set(["ctypes", "scandir", "_scandir"]))'])
+        self.assertEqual(out.strip(), '[]')
+
+    def test_add_site_dir(self):
+        sites.add_site_dir(self.site)
+        self.assertIn(self.site, sys.path)
+        self.assertIn(os.path.join(self.site, 'tool'), sys.path)
+        self.assertIn(os.path.join(self.site, 'tool', 'python'), sys.path)
+
+
+class TestAddSiteList(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.sites = []
+        for i in range(6):
+            site = os.path.join(self.root, 'site%d' % i)
+            os.makedirs(os.path.join(site, 'tool', 'python'))
+            with open(os.path.join(site, 'tool', '__site__.pth'), 'w') as fh:
+                fh.write('python\n')
+            with open(os.path.join(site, 'shared.pth'), 'w') as fh:
+                fh.write('%s\n' % os.path.join(self.root, 'site0', 'tool'))
+            self.sites.append(site)
+        self.sites.insert(3, os.path.join(self.root, 'missing'))
+
+        # Center the list around our own environment.
+        self.sites.insert(4, os.path.join(sys.prefix, sites.site_package_postfix))
+
+        self._sys_path = list(sys.path)
+        self._processed_pths = set(sites._processed_pths)
+
+    def tearDown(self):
+        self.reset()
+        shutil.rmtree(self.root)
+
+    def reset(self):
+        sys.path[:] = self._sys_path
+        sites._processed_pths.clear()
+        sites._processed_pths.update(self._processed_pths)
+
+    def test_threads_match_serial(self):
+
+        sites.add_site_list(self.sites, threads=1)
+        serial = list(sys.path)
+        self.reset()
+
+        stats = sites.ScanStats()
+        stats.add(sites.scan_stats)
+        sites.add_site_list(self.sites, threads=4)
+        self.assertEqual(sys.path, serial)
+
+        # Both sides of our environment were used.
+        self.assertLess(serial.index(os.path.join(self.root, 'site0')), serial.index(self._sys_path[0]))
+        self.assertGreater(serial.index(os.path.join(self.root, 'site5')), serial.index(self._sys_path[-1]))
+
+        # All of the work was counted.
+        self.assertGreater(sites.scan_stats.listdir, stats.listdir + 5)
+
+    def test_thread_errors(self):
+        original = sites.scan_site_dir
+        def scan_site_dir(dir_name, stats=None):
+            if dir_name.endswith('site2'):
+                raise OSError('boom')
+            return original(dir_name, stats)
+        sites.scan_site_dir = scan_site_dir
+        try:
+            self.assertRaises(OSError, sites.scan_site_dirs, self.sites, 4)
+        finally:
+            sites.scan_site_dir = original
@@ -0,0 +1,169 @@
+"""Filesystem call budgets for the startup sequence.
+
+Each fixture builds a site layout and imports ``sitetools._startup`` in a
+fresh interpreter, counting every stat, listdir, open and read within the
+fixture (via :class:`sitetools.instrument.FSCounter`). A test fails if any
+count goes over its budget in ``syscall_budgets.json``, and reports which
+functions made the extra calls.
+
+Sites are listed very differently with and without ``scandir``, so every
+fixture is run (and budgeted) with each: once with ``scandir`` hidden, and
+once more with it if it is installed.
+
+After an intentional change, regenerate the budgets with::
+
+    $ SITETOOLS_UPDATE_BUDGETS=1 python -m unittest tests.test_syscall_budget
+
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from . import *
+
+from sitetools.platform import get_extended_platform_spec
+from sitetools.sites import site_package_postfix
+
+
+budgets_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'syscall_budgets.json')
+update_budgets = os.environ.get('SITETOOLS_UPDATE_BUDGETS', '0') != '0'
+
+
+_bootstrap = '''
+import json, os, sys
+if os.environ['SITETOOLS_TEST_BACKEND'] == 'listdir':
+    sys.modules['scandir'] = sys.modules['_scandir'] = None
+from sitetools.instrument import FSCounter
+counter = FSCounter(root=os.environ['SITETOOLS_TEST_ROOT'], callers=True, reads=True)
+counter.install()
+import sitetools._startup
+counter.uninstall()
+sys.stdout.write(json.dumps({'counts': counter.counts, 'callers': counter.callers}))
+'''
+
+
+def build_site(path, packages=0, modules=0, pths=0, nested=0):
+    os.makedirs(path)
+    for i in range(packages):
+        os.makedirs(os.path.join(path, 'package%d' % i))
+        open(os.path.join(path, 'package%d' % i, '__init__.py'), 'w').close()
+    for i in range(modules):
+        open(os.path.join(path, 'module%d.py' % i), 'w').close()
+    for i in range(pths):
+        with open(os.path.join(path, 'extra%d.pth' % i), 'w') as fh:
+            fh.write('# Extra.\npackage%d\n' % i)
+    for i in range(nested):
+        tool = os.path.join(path, 'tool%d' % i)
+        os.makedirs(os.path.join(tool, 'python'))
+        os.makedirs(os.path.join(tool, 'build', get_extended_platform_spec()))
+        with open(os.path.join(tool, '__site__.pth'), 'w') as fh:
+            fh.write('python\nbuild/{extended_platform_spec}\nmissing\n')
+    return path
+
+
+class TestSyscallBudget(TestCase):
+
+    backend = 'listdir'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def run_startup(self, sites, env=None):
+
+        environ = dict((k, v) for k, v in os.environ.iteritems() if not (
+            k.startswith('SITETOOLS_') or k in ('GRAYLOG', 'PYTHONSENTRYDSN')
+        ))
+        environ.update(env or {})
+        environ['SITETOOLS_SITES'] = ':'.join(sites)
+        environ['SITETOOLS_TEST_ROOT'] = self.root
+        environ['SITETOOLS_TEST_BACKEND'] = self.backend
+        environ['PYTHONPATH'] = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+        proc = subprocess.Popen([sys.executable, '-c', _bootstrap], env=environ,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode:
+            self.fail('startup failed:\n%s' % err)
+        return json.loads(out)
+
+    def assertWithinBudget(self, name, result):
+
+        try:
+            with open(budgets_path) as fh:
+                budgets = json.load(fh)
+        except IOError:
+            budgets = {}
+
+        if update_budgets:
+            budgets.setdefault(self.backend, {})[name] = result
+            with open(budgets_path, 'w') as fh:
+                json.dump(budgets, fh, indent=4, sort_keys=True)
+                fh.write('\n')
+            return
+
+        budget = budgets.get(self.backend, {}).get(name)
+        if budget is None:
+            self.fail('no %s budget for %r; run with SITETOOLS_UPDATE_BUDGETS=1' % (self.backend, name))
+
+        over = []
+        for kind, count in sorted(result['counts'].iteritems()):
+            allowed = budget['counts'].get(kind, 0)
+            if count > allowed:
+                over.append('%s: %d calls, over its budget of %d' % (kind, count, allowed))
+        if not over:
+            return
+
+        for caller, counts in sorted(result['callers'].iteritems()):
+            for kind, count in sorted(counts.iteritems()):
+                allowed = budget['callers'].get(caller, {}).get(kind, 0)
+                if count > allowed:
+                    over.append('    %s made %d %s calls; previously %d' % (caller, count, kind, allowed))
+
+        self.fail('%s is over its %s filesystem budget:\n%s' % (name, self.backend, '\n'.join(over)))
+
+    def test_flat(self):
+        site = build_site(os.path.join(self.root, 'site'), packages=50, modules=20, pths=2)
+        self.assertWithinBudget('flat', self.run_startup([site]))
+
+    def test_nested(self):
+        sites = [
+            build_site(os.path.join(self.root, 'site%d' % i), packages=10, nested=5)
+            for i in range(3)
+        ]
+        self.assertWithinBudget('nested', self.run_startup(sites))
+
+    def test_venv(self):
+        prefix = os.path.join(self.root, 'venv')
+        build_site(os.path.join(prefix, site_package_postfix), packages=10, nested=2)
+        os.makedirs(os.path.join(prefix, 'bin'))
+        python = os.path.join(prefix, 'bin', 'python')
+        open(python, 'w').close()
+        self.assertWithinBudget('venv', self.run_startup([python]))
+
+    def test_cached(self):
+        sites = [
+            build_site(os.path.join(self.root, 'site%d' % i), packages=10, nested=5)
+            for i in range(3)
+        ]
+        env = {'SITETOOLS_CACHE_DIR': os.path.join(self.root, 'cache')}
+        self.run_startup(sites, env)
+        self.assertWithinBudget('cached', self.run_startup(sites, env))
+
+
+class TestSyscallBudgetScandir(TestSyscallBudget):
+
+    backend = 'scandir'
+
+    def setUp(self):
+        try:
+            import scandir
+        except ImportError:
+            self.skipTest('scandir is not installed')
+        super(TestSyscallBudgetScandir, self).setUp()